@@ -0,0 +1,125 @@
+# candle patterns: vectorized engine (workers/candle.py) vs previous
+# groupby("symbol").apply + merge_asof path, on random OHLC panel
+# checks both give the same candle_pattern and formation
+#   python -m dev.bench_candles [symbols] [days] [daily|weekly|monthly|quarterly]
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from workers import candle
+
+CP_COLS = {"CP": "candle_pattern", "CF": "formation"}
+RULES = {"daily": "D", "weekly": "W", "monthly": "ME", "quarterly": "QE"}
+PATTERNS = {
+    "dark_cloud": {"ind": -2, "kwargs": {}},
+    "bullish_engulfing": {"ind": 2, "kwargs": {}},
+    "bearish_engulfing": {"ind": -2, "kwargs": {}},
+    "n_white_soldiers": {"ind": 3, "kwargs": {"n": 3}},
+    "n_black_crows": {"ind": -3, "kwargs": {"n": 3}},
+    "bullish_star": {"ind": 2, "kwargs": {}},
+    "bearish_star": {"ind": -2, "kwargs": {}},
+    "rising_three": {"ind": 1, "kwargs": {}},
+    "falling_three": {"ind": -1, "kwargs": {}},
+    "hammer": {"ind": 1, "kwargs": {}},
+    "inverted_hammer": {"ind": -1, "kwargs": {}},
+}
+
+
+def panel(symbols: int, days: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range("2015-01-01", periods=days)
+    n = symbols * days
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, (symbols, days)), axis=1)).ravel()
+    opn = close * np.exp(rng.normal(0, 0.01, n))
+    dat = pd.DataFrame(
+        {
+            "symbol": np.repeat([f"S{i:04d}" for i in range(symbols)], days),
+            "date": np.tile(dates, symbols),
+            "open": opn,
+            "high": np.maximum(opn, close) * np.exp(np.abs(rng.normal(0, 0.01, n))),
+            "low": np.minimum(opn, close) * np.exp(-np.abs(rng.normal(0, 0.01, n))),
+            "val": close,
+            "vol": rng.integers(0, 10_000, n),
+        }
+    )
+    # symbols listed at different time
+    return dat.loc[dat["date"] >= dates[rng.integers(0, days // 2, n)]].reset_index(drop=True)
+
+
+def legacy(dat: pd.DataFrame, date_period: str, file: str) -> pd.DataFrame:
+    """previous Trader.candle_pattern"""
+    from technical_analysis import candles
+    from workers.common import read_json
+
+    req_cols = ["open", "high", "low", "val", "vol", "symbol", "date"]
+    cp_cols = ["symbol", "date"] + list(CP_COLS.values())
+    candle_pattern = read_json(file=file)
+    agg = {"open": "first", "high": "max", "low": "min", "val": "last", "vol": "sum"}
+
+    def calc_cp(grp):
+        symbol = grp.iloc[0]["symbol"]
+        grp = grp.resample(rule=RULES[date_period], on="date").agg(agg)
+        grp.reset_index(inplace=True)
+        grp[CP_COLS["CP"]] = 0
+        grp[CP_COLS["CF"]] = ""
+        for cp, cv in candle_pattern.items():
+            ta_func = getattr(candles, cp)
+            cp_rows = ta_func(
+                open=grp["open"],
+                low=grp["low"],
+                high=grp["high"],
+                close=grp["val"],
+                **cv["kwargs"],
+            )
+            grp.loc[cp_rows, CP_COLS["CP"]] += cv["ind"]
+            grp.loc[cp_rows, CP_COLS["CF"]] = cp
+        grp[CP_COLS["CP"]] = grp[CP_COLS["CP"]].cumsum()
+        grp["symbol"] = symbol
+        return grp
+
+    dat = dat.sort_values(by=["symbol", "date"])
+    cp_DF = (
+        dat.reindex(columns=req_cols)
+        .drop_duplicates()
+        .groupby("symbol", group_keys=False)
+        .apply(calc_cp)
+    )
+    dat = dat.sort_values(by=["date"])
+    cp_DF.sort_values(by=["date"], inplace=True)
+    dat = pd.merge_asof(
+        left=dat, right=cp_DF.reindex(columns=cp_cols), on="date", by="symbol"
+    )
+    dat.sort_values(by=["symbol", "date"], inplace=True, ignore_index=True)
+    dat[CP_COLS["CP"]] = dat.groupby("symbol")[CP_COLS["CP"]].ffill()
+    dat[CP_COLS["CP"]] = dat[CP_COLS["CP"]].fillna(0)
+    dat[CP_COLS["CF"]] = dat[CP_COLS["CF"]].fillna("")
+    return dat
+
+
+if __name__ == "__main__":
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    date_period = sys.argv[3] if len(sys.argv) > 3 else "daily"
+    dat = panel(symbols, days)
+    with tempfile.TemporaryDirectory() as tmp:
+        file = os.path.join(tmp, "candle_pattern.jsonc")
+        with open(file, "w") as f:
+            json.dump(PATTERNS, f)
+        print(f"{len(dat)} rows, {symbols} symbols, {date_period}")
+
+        start = time.perf_counter()
+        old = legacy(dat, date_period, file)
+        t_old = time.perf_counter() - start
+        start = time.perf_counter()
+        new = candle.candle_pattern(dat, date_period, file, CP_COLS)
+        t_new = time.perf_counter() - start
+
+    print(f"groupby.apply: {t_old:.2f}s, vectorized: {t_new:.2f}s ({t_old / t_new:.0f}x)")
+    pd.testing.assert_frame_equal(old, new)
+    found = (new[CP_COLS["CF"]] != "").sum()
+    print(f"identical output, {found} rows with formation")
@@ -0,0 +1,66 @@
+# currency conversion of existing DB: in-memory FX rates (workers/fx.py)
+# vs previous exact date merges with rates read for each query
+# checks both give the same values where previous found the rate
+#   python -m dev.bench_fx [db_file] [tab] [currency] [years]
+import sys
+import time
+from datetime import date
+
+import pandas as pd
+
+from workers import fx, sql
+
+COLS = ["val", "low", "high", "open", "vol"]
+
+
+def legacy(db_file: str, dat: pd.DataFrame, currency: str) -> pd.DataFrame:
+    """previous Trader.__convert_currency__"""
+    key = sql.__key__(db_file)
+
+    def rate(cur: pd.Series, col: str) -> pd.DataFrame:
+        cmd = f"""SELECT c.val AS {col}, c.date, cd.symbol FROM CURRENCY c
+                INNER JOIN CURRENCY_DESC cd ON c.{key}=cd.{key}
+                WHERE cd.symbol IN ({",".join(["?"] * cur.nunique())})
+                AND c.date BETWEEN ? AND ?"""
+        params = list(cur.dropna().unique())
+        params += [sql.__day__(db_file, dat.date.min()), sql.__day__(db_file, dat.date.max())]
+        resp = sql.__execute_sql__([(cmd, params)], db_file)
+        return sql.__decode_dates__(db_file, resp[cmd])
+
+    cur = sql.currency_of_country(db_file, set(dat["country"]))
+    d = dat.merge(cur.loc[:, ["iso2", "symbol"]].rename(columns={"symbol": "cur_from"}),
+                  left_on="country", right_on="iso2", how="left")
+    d = d.merge(rate(pd.Series([currency]), "val_to").drop(columns="symbol"), on="date", how="left")
+    d = d.merge(rate(d["cur_from"], "val_from").rename(columns={"symbol": "cur_from"}),
+                on=["date", "cur_from"], how="left")
+    for col in [c for c in COLS if c in dat.columns]:
+        d[col] = pd.to_numeric(d[col], errors="coerce") / d["val_from"] * d["val_to"]
+    return d.reindex(columns=dat.columns)
+
+
+if __name__ == "__main__":
+    db_file = sys.argv[1] if len(sys.argv) > 1 else "./trader.sqlite"
+    tab = sys.argv[2] if len(sys.argv) > 2 else "STOCK"
+    currency = sys.argv[3] if len(sys.argv) > 3 else "USD"
+    years = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+    to_date = date.today()
+    dat = sql.query(db_file, tab, ["%"], date(to_date.year - years, 1, 1), to_date)
+    cur_from = dat["country"].map(
+        sql.currency_of_country(db_file, set(dat["country"])).set_index("iso2")["symbol"]
+    )
+
+    start = time.perf_counter()
+    old = legacy(db_file, dat, currency)
+    t_old = time.perf_counter() - start
+    start = time.perf_counter()
+    fx.convert(db_file, dat, cur_from, [currency], COLS)  # loads rates
+    t_load = time.perf_counter() - start
+    start = time.perf_counter()
+    new = fx.convert(db_file, dat, cur_from, [currency], COLS)[currency.upper()]
+    t_new = time.perf_counter() - start
+
+    print(f"{len(dat)} rows, merges: {t_old:.2f}s, fx: {t_load:.2f}s first, {t_new:.2f}s next")
+    print(f"without rate: merges {old['val'].isna().sum()}, fx {new['val'].isna().sum()}")
+    known = old["val"].notna()
+    pd.testing.assert_frame_equal(old.loc[known], new.loc[known], check_dtype=False)
+    print("identical where merges found rate")
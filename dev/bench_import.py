@@ -0,0 +1,50 @@
+# cold start time of 'from tradeDB import Trader'
+# each run in fresh interpreter, fails if slow libs (plotting, sklearn, scraping,
+# SDMX, World Bank...) are imported again at start or median above limit
+#   python -m dev.bench_import [runs] [limit_sec]
+import statistics
+import subprocess
+import sys
+
+# libs which should be imported only when used
+LAZY = [
+    "matplotlib",
+    "sklearn",
+    "technical_analysis",
+    "alive_progress",
+    "playwright",
+    "tkinter",
+    "PIL",
+    "pandasdmx",
+    "bs4",
+    "wbdata",
+]
+
+CODE = f"""
+import sys, time
+start = time.perf_counter()
+from tradeDB import Trader
+sec = time.perf_counter() - start
+print(sec, ",".join(m for m in {LAZY!r} if m in sys.modules))
+"""
+
+
+def cold_start() -> tuple:
+    out = subprocess.run(
+        [sys.executable, "-c", CODE], capture_output=True, text=True, check=True
+    ).stdout.split()
+    return float(out[0]), out[1] if len(out) > 1 else ""
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    limit = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    results = [cold_start() for _ in range(runs)]
+    secs = [sec for sec, _ in results]
+    loaded = results[0][1]
+    med = statistics.median(secs)
+    print(f"import: median {med:.2f}s, min {min(secs):.2f}s, max {max(secs):.2f}s")
+    if loaded:
+        sys.exit(f"FAIL: imported at start: {loaded}")
+    if med > limit:
+        sys.exit(f"FAIL: median above {limit:.2f}s")
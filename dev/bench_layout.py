@@ -0,0 +1,36 @@
+# compare DB layouts: file size and scan speed
+# converts existing DB into layout 2 (compact) and runs the same query on both
+#   python -m dev.bench_layout [trader.sqlite] [STOCK]
+import os
+import sys
+import time
+from datetime import date
+
+from workers import sql
+
+
+def scan(db_file: str, tab: str) -> float:
+    symbols = sql.getL(db_file=db_file, tab=f"{tab}_DESC", get=["symbol"])
+    start = time.perf_counter()
+    dat = sql.query(
+        db_file=db_file,
+        tab=tab,
+        symbol=symbols,
+        from_date=date(1900, 1, 1),
+        to_date=date.today(),
+    )
+    sec = time.perf_counter() - start
+    print(f"{db_file}: {len(dat)} rows in {sec:.2f}s")
+    return sec
+
+
+if __name__ == "__main__":
+    db_file = sys.argv[1] if len(sys.argv) > 1 else "./trader.sqlite"
+    tab = sys.argv[2] if len(sys.argv) > 2 else "STOCK"
+    new_file = os.path.splitext(db_file)[0] + "_v2.sqlite"
+    if not sql.convert_layout(db_file, new_file, layout=2):
+        sys.exit("conversion failed")
+    size1, size2 = os.path.getsize(db_file), os.path.getsize(new_file)
+    print(f"size: {size1 / 2**20:.1f}MB -> {size2 / 2**20:.1f}MB ({size2 / size1:.0%})")
+    t1, t2 = scan(db_file, tab), scan(new_file, tab)
+    print(f"scan: {t1:.2f}s -> {t2:.2f}s ({t2 / t1:.0%})")
@@ -0,0 +1,41 @@
+# OHLCV resample of all symbols: one pass (workers/resample.py) vs
+# pandas resample of each symbol (groupby.apply), on random OHLC panel
+# checks both give the same periods and values
+#   python -m dev.bench_resample [symbols] [days] [daily|weekly|monthly|quarterly]
+import sys
+import time
+
+import pandas as pd
+
+from dev.bench_candles import RULES, panel
+from workers import resample
+
+AGG = {"open": "first", "high": "max", "low": "min", "val": "last", "vol": "sum"}
+
+
+def legacy(dat: pd.DataFrame, date_period: str) -> pd.DataFrame:
+    """resample of each symbol separately"""
+    return (
+        dat.groupby("symbol", group_keys=True)
+        .apply(lambda grp: grp.resample(rule=RULES[date_period], on="date").agg(AGG))
+        .reset_index()
+    )
+
+
+if __name__ == "__main__":
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    date_period = sys.argv[3] if len(sys.argv) > 3 else "weekly"
+    dat = panel(symbols, days)
+    print(f"{len(dat)} rows, {symbols} symbols, {date_period}")
+
+    start = time.perf_counter()
+    old = legacy(dat, date_period)
+    t_old = time.perf_counter() - start
+    start = time.perf_counter()
+    new = resample.ohlcv(dat, date_period)
+    t_new = time.perf_counter() - start
+
+    print(f"groupby.apply: {t_old:.2f}s, one pass: {t_new:.2f}s ({t_old / t_new:.0f}x)")
+    pd.testing.assert_frame_equal(old, new, check_freq=False)
+    print(f"identical output, {len(new)} periods")
@@ -0,0 +1,39 @@
+# monthly/weekly bars of existing DB: rollup table (i.e. STOCK_M) vs
+# daily rows resampled in pandas, for all symbols of 'tab'
+# checks both give the same close
+#   python -m dev.bench_rollup [db_file] [tab] [weekly|monthly] [years]
+import sys
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+
+from workers import resample, sql
+
+if __name__ == "__main__":
+    db_file = sys.argv[1] if len(sys.argv) > 1 else "./trader.sqlite"
+    tab = sys.argv[2] if len(sys.argv) > 2 else "STOCK"
+    period = sys.argv[3] if len(sys.argv) > 3 else "monthly"
+    years = int(sys.argv[4]) if len(sys.argv) > 4 else 20
+    if not sql.rollup(tab, period):
+        sys.exit(f"no {period} rollup table of {tab} in scheme")
+    to_date = date.today()
+    from_date = date(to_date.year - years, 1, 1)
+    # whole first week, as read from rollup
+    from_date -= timedelta(days=from_date.weekday())
+
+    start = time.perf_counter()
+    daily = sql.query(db_file, tab, ["%"], from_date, to_date)
+    old = resample.ohlcv(daily, period, empty=False)
+    t_old = time.perf_counter() - start
+    start = time.perf_counter()
+    new = sql.query(db_file, tab, ["%"], from_date, to_date, period=period)
+    t_new = time.perf_counter() - start
+
+    print(f"daily rows: {len(daily)}, {period} rows: {len(new)}")
+    print(f"daily + resample: {t_old:.2f}s, rollup: {t_new:.2f}s ({t_old / t_new:.0f}x)")
+    new = new.sort_values(["symbol", "date"], ignore_index=True)
+    pd.testing.assert_series_equal(
+        old["val"], new["val"], check_dtype=False, check_index=False
+    )
+    print("identical close")
@@ -0,0 +1,66 @@
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from workers import cache, sql
+from workers.common import hash_table
+
+"""tests run offline (no stooq, ECB or world bank requests)
+    python -m pytest -q
+"""
+
+DATA = os.path.join(ROOT, "tests", "data")
+
+
+def geo_tab() -> pd.DataFrame:
+    """small GEO table instead of world bank data"""
+    geo = pd.DataFrame(
+        {
+            "iso2": ["PL", "US", "UNKNOWN"],
+            "country": ["POLAND", "UNITED STATES", "UNKNOWN"],
+            "iso2_region": ["ECS", "NAC", "UNKNOWN"],
+            "region": ["EUROPE & CENTRAL ASIA", "NORTH AMERICA", "UNKNOWN"],
+            "currency": ["PLN", "USD", "UNKNOWN"],
+        }
+    )
+    geo["last_upd"] = date.today()
+    return geo
+
+
+def stock(symbol: str, days, val=10.0, country="PL") -> pd.DataFrame:
+    """STOCK rows of symbol (name=symbol) for sql.put(), one per day"""
+    dat = pd.DataFrame({"date": list(days)})
+    dat["val"] = val
+    dat["open"], dat["high"], dat["low"] = dat["val"], dat["val"] + 1, dat["val"] - 1
+    dat["vol"] = 100
+    dat["symbol"], dat["name"], dat["country"] = symbol, symbol, country
+    dat["hash"] = hash_table(dat, "STOCK")
+    dat["from_date"], dat["to_date"] = dat["date"].min(), dat["date"].max()
+    dat["start_quote"] = date(1800, 1, 1)
+    return dat
+
+
+@pytest.fixture(autouse=True)
+def offline(tmp_path, monkeypatch):
+    """repo root as working dir (assets are read with relative paths),
+    web cache in tmp_path, GEO table from geo_tab()"""
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(sql, "__geo_tab__", geo_tab)
+    cache.configure(file=str(tmp_path / "web_cache"))
+    yield
+    sql.close()
+    cache.configure()
+
+
+@pytest.fixture
+def db(tmp_path) -> str:
+    """new db file"""
+    db_file = str(tmp_path / "test.sqlite")
+    assert sql.create_sql(db_file)
+    return db_file
@@ -0,0 +1,137 @@
+import os
+from datetime import date
+
+import pandas as pd
+import pandasdmx as sdmx
+import pytest
+
+from conftest import DATA
+from workers import api, cache
+
+# saved ECB EXR response: daily USD (3 days) and PLN (2 days)
+EXR_FILE = os.path.join(DATA, "ecb_exr.xml")
+CSV = b"Date,Open,High,Low,Close,Volume\n2024-01-02,10,12,9,11,100\n2024-01-03,11,13,10,12,200\n"
+LISTING = b"""<html><body><table id="fth1">
+<thead><tr><th>Symbol</th><th>Name</th><th>Last</th><th>Date</th></tr></thead>
+<tbody><tr><td>KGH</td><td>KGHM</td><td>116.8</td><td>2024-01-02</td></tr></tbody>
+</table></body></html>"""
+
+
+class Request:
+    """sdmx.Request("ECB") answering from EXR_FILE, counts requests"""
+
+    def __init__(self):
+        self.keys = []
+
+    def data(self, flow: str, key: str, params: dict):
+        assert flow == "EXR"
+        self.keys.append(key)
+        return sdmx.read_sdmx(EXR_FILE)
+
+
+@pytest.fixture
+def ecb(monkeypatch) -> Request:
+    req = Request()
+    monkeypatch.setattr(api, "__ecb_request__", lambda: req)
+    monkeypatch.setattr(api, "__exr_symbols__", lambda: ["USD", "PLN", "JPY"])
+    return req
+
+
+def test_split_currency():
+    dat = sdmx.to_pandas(sdmx.read_sdmx(EXR_FILE)).reset_index()
+    split = api.split_currency(dat)
+    assert set(split) == {"USD", "PLN"}
+    assert split["USD"].columns.to_list() == ["date", "val"]
+    assert split["USD"]["date"].to_list() == [
+        date(2024, 1, 2),
+        date(2024, 1, 3),
+        date(2024, 1, 4),
+    ]
+    assert split["PLN"]["val"].to_list() == [4.358, 4.3675]
+
+
+def test_ecb_batch(ecb):
+    resp = api.ecb_batch(
+        date(2024, 1, 2), date(2024, 1, 4), ["USD", "PLN", "JPY", "EUR", "XXX"]
+    )
+    # one request for all known currencies, EUR and unknown not asked
+    assert ecb.keys == ["D.USD+PLN+JPY..."]
+    assert len(resp["USD"]) == 3 and len(resp["PLN"]) == 2
+    # asked, but not in response
+    assert resp["JPY"].empty
+    # EUR is the base: 1 for each day
+    assert resp["EUR"]["val"].to_list() == [1, 1, 1]
+    assert resp["EUR"]["date"].to_list()[0] == date(2024, 1, 2)
+    # unknown symbol
+    assert resp["XXX"].iloc[0, 0] == ""
+
+
+def test_ecb_cached(ecb, tmp_path):
+    first = api.ecb_batch(date(2024, 1, 2), date(2024, 1, 4), ["USD", "PLN"])
+    # reopened from disk
+    cache.configure(file=str(tmp_path / "web_cache"))
+    again = api.ecb_batch(date(2024, 1, 2), date(2024, 1, 4), ["USD", "PLN"])
+    assert len(ecb.keys) == 1
+    for cur in ["USD", "PLN"]:
+        pd.testing.assert_frame_equal(first[cur], again[cur])
+    # other window is requested
+    api.ecb(date(2024, 1, 2), date(2024, 1, 3), "USD")
+    assert len(ecb.keys) == 2
+
+
+class Response:
+    def __init__(self, status: int, content=b""):
+        self.status_code = status
+        self.content = content
+        self.headers = {}
+
+
+@pytest.fixture
+def web(monkeypatch) -> dict:
+    """stooq answering from {url: Response}"""
+    pages = {}
+    monkeypatch.setattr(api, "header", {"user-agent": "test"})
+    monkeypatch.setattr(api, "set_header", lambda file, upd_header: api.header)
+    monkeypatch.setattr(api, "__get__", lambda url, **kwargs: pages[url])
+    return pages
+
+
+def csv_url(symbol: str, page="1") -> str:
+    return f"https://stooq.com/q/d/l/?s={symbol}&d1=20240102&d2=20240103&l={page}&i=d"
+
+
+def listing_url(symbol: str, page="1") -> str:
+    return f"https://stooq.com/q/i/?s={symbol}&i=0&l={page}"
+
+
+def stooq_csv(symbol: str) -> pd.DataFrame:
+    return api.stooq(from_date=date(2024, 1, 2), to_date=date(2024, 1, 3), symbol=symbol)
+
+
+def cached(url: str) -> bool:
+    # url as given to __scrap_cached__
+    return cache.get(cache.normalize_url(url)) is not None
+
+
+def test_stooq_cached(web):
+    web[csv_url("kgh")] = Response(200, CSV)
+    assert stooq_csv("KGH")["val"].to_list() == [11, 12]
+    assert cached(csv_url("KGH", "%page%"))
+
+
+def test_stooq_removed_not_cached(web):
+    web[csv_url("old")] = Response(302)
+    assert stooq_csv("OLD").iloc[0, 0] == "asset removed"
+    assert not cached(csv_url("OLD", "%page%"))
+
+
+def test_stooq_truncated_not_cached(web):
+    # second page failed: pages read before are returned, not cached
+    web[listing_url("wig20", "1")] = Response(200, LISTING)
+    web[listing_url("wig20", "2")] = Response(500)
+    assert api.stooq(component="WIG20")["symbol"].to_list() == ["KGH"]
+    assert not cached(listing_url("WIG20", "%page%"))
+    # asked again: complete (no more pages) and cached
+    web[listing_url("wig20", "2")] = Response(200, b"<html><body><p>end</p></body></html>")
+    assert api.stooq(component="WIG20")["symbol"].to_list() == ["KGH"]
+    assert cached(listing_url("WIG20", "%page%"))
@@ -0,0 +1,64 @@
+import json
+
+import pandas as pd
+import pytest
+
+from dev.bench_candles import CP_COLS, PATTERNS, legacy, panel
+from workers import candle, sql
+
+
+@pytest.fixture
+def cp_file(tmp_path) -> str:
+    file = tmp_path / "candle_pattern.json"
+    file.write_text(json.dumps(PATTERNS))
+    return str(file)
+
+
+def state(db: str) -> pd.DataFrame:
+    cmd = "SELECT symbol, period, digest, to_date FROM CANDLES_STATE"
+    return sql.__execute_sql__([cmd], db)[cmd]
+
+
+@pytest.mark.parametrize("period", ["daily", "weekly", "monthly"])
+def test_engine(cp_file, period):
+    # all symbols at once, the same as each symbol resampled separately
+    dat = panel(12, 200)
+    got = candle.candle_pattern(dat, period, cp_file, CP_COLS)
+    exp = legacy(dat, period, cp_file)
+    pd.testing.assert_frame_equal(got, exp)
+
+
+def test_cache(db, cp_file, monkeypatch):
+    dat = panel(12, 200)
+    dates = sorted(dat["date"].unique())
+    exp = candle.candle_pattern(dat, "weekly", cp_file, CP_COLS)
+    older = dat.loc[dat["date"] <= dates[150]]
+    candle.candle_pattern(older, "weekly", cp_file, CP_COLS, db_file=db)
+    # cached periods are used, new ones calculated
+    got = candle.candle_pattern(dat, "weekly", cp_file, CP_COLS, db_file=db)
+    pd.testing.assert_frame_equal(got, exp)
+    assert len(state(db)) == 12
+
+    # nothing changed: nothing written
+    writes = []
+    monkeypatch.setattr(sql, "put_candles", lambda *args: writes.append(args))
+    got = candle.candle_pattern(dat, "weekly", cp_file, CP_COLS, db_file=db)
+    pd.testing.assert_frame_equal(got, exp)
+    assert writes == []
+
+
+def test_cache_invalidated(db, cp_file, tmp_path):
+    dat = panel(12, 200)
+    candle.candle_pattern(dat, "weekly", cp_file, CP_COLS, db_file=db)
+    # changed history (i.e. other currency): checksum differs, recalculated
+    scaled = dat.assign(**{c: dat[c] * 4.1 for c in ["open", "high", "low", "val"]})
+    got = candle.candle_pattern(scaled, "weekly", cp_file, CP_COLS, db_file=db)
+    pd.testing.assert_frame_equal(got, candle.candle_pattern(scaled, "weekly", cp_file, CP_COLS))
+
+    # other pattern file: cache of previous one removed
+    other = tmp_path / "other.json"
+    other.write_text(json.dumps({k: v for k, v in PATTERNS.items() if k != "hammer"}))
+    got = candle.candle_pattern(dat, "weekly", str(other), CP_COLS, db_file=db)
+    pd.testing.assert_frame_equal(got, candle.candle_pattern(dat, "weekly", str(other), CP_COLS))
+    assert set(state(db)["digest"]) == {candle.digest(str(other))}
+    assert candle.digest(str(other)) != candle.digest(cp_file)
@@ -0,0 +1,64 @@
+import locale
+import threading
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from workers.common import convert_date, hash_table
+
+
+def test_hash_table():
+    dat = pd.DataFrame({"symbol": ["KGH", "PKO", "KGH"], "name": ["KGHM", "PKO BP", "KGHM"]})
+    hashes = hash_table(dat, "STOCK")
+    assert hashes[0] == hashes[2] != hashes[1]
+    assert hashes[0] != hash_table(dat, "INDEXES")[0]
+
+
+@pytest.mark.parametrize("missing", [None, float("nan")])
+def test_hash_table_missing(missing):
+    dat = pd.DataFrame({"symbol": ["KGH", missing], "name": ["KGHM", "X"]})
+    with pytest.raises(ValueError, match="missing symbol or name"):
+        hash_table(dat, "STOCK")
+
+
+def test_convert_date():
+    year = date.today().year
+    dates = pd.Series(
+        ["2024-01-02", "Jan 3", "3 sty", "4 Lut 2023", "Mar 5, 2022", "paź 6", "12:30", "Group"],
+        index=range(10, 18),
+    )
+    got = convert_date(dates)
+    assert list(got.index) == list(dates.index)
+    assert got.to_list() == [
+        date(2024, 1, 2),
+        date(year, 1, 3),
+        date(year, 1, 3),
+        date(2023, 2, 4),
+        date(2022, 3, 5),
+        date(year, 10, 6),
+        date.today(),
+        # no digits: group name
+        date(1900, 1, 1),
+    ]
+
+
+def test_convert_date_unknown():
+    with pytest.raises(SystemExit):
+        convert_date(pd.Series(["2024/01/02"]))
+
+
+def test_convert_date_locale_free():
+    # process locale is not used nor changed, also from many threads
+    before = locale.setlocale(locale.LC_TIME)
+    dates = pd.Series(["Jan 3 2024", "3 sty 2024"] * 100)
+    got = []
+    threads = [
+        threading.Thread(target=lambda: got.append(set(convert_date(dates)))) for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert got == [{date(2024, 1, 3)}] * 4
+    assert locale.setlocale(locale.LC_TIME) == before
@@ -0,0 +1,82 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from workers import dump, sql
+from workers.common import hash_table
+
+HEADER = "<TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>,<OPENINT>"
+
+
+def dump_file(path, ticker: str, days: list) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = [HEADER] + [
+        f"{ticker},D,{d:%Y%m%d},000000,{10 + n},{12 + n},{9 + n},{11 + n},{100 * n},0"
+        for n, d in enumerate(days)
+    ]
+    path.write_text("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def source(tmp_path) -> str:
+    """dump directory: KGH (known to db) and XYZ (unknown)
+    and file in directory which is not loaded"""
+    root = tmp_path / "dump"
+    stocks = root / "data" / "daily" / "pl" / "wse stocks"
+    dump_file(stocks / "kgh.txt", "KGH", pd.bdate_range("2024-01-02", "2024-01-05").date)
+    dump_file(stocks / "xyz.txt", "XYZ", pd.bdate_range("2024-01-02", "2024-01-04").date)
+    dump_file(root / "data" / "daily" / "pl" / "nc bonds" / "b.txt", "B", [date(2024, 1, 2)])
+    return str(root)
+
+
+@pytest.fixture
+def known(db) -> str:
+    """db with KGH quoted 2023-12-27..29"""
+    dat = pd.DataFrame({"date": pd.bdate_range("2023-12-27", "2023-12-29").date})
+    dat["val"], dat["open"], dat["low"], dat["high"], dat["vol"] = 10.0, 9.5, 9.0, 11.0, 100
+    dat["symbol"], dat["name"], dat["country"] = "KGH", "KGHM", "PL"
+    dat["hash"] = hash_table(dat, "STOCK")
+    dat["from_date"], dat["to_date"] = dat["date"].min(), dat["date"].max()
+    dat["start_quote"] = date(1800, 1, 1)
+    assert sql.put(dat, "STOCK", db)
+    return db
+
+
+def desc(db: str) -> pd.DataFrame:
+    return sql.getDF(tab="STOCK_DESC", search=["%"], where=["symbol"], db_file=db)
+
+
+def test_dump_files(source):
+    files = dump.dump_files(source)
+    assert list(files) == ["STOCK"]
+    assert [f.split("/")[-1] for f in files["STOCK"]] == ["kgh.txt", "xyz.txt"]
+
+
+def test_load_known(source, known):
+    assert dump.load(source, db_file=known, workers=1) == {"STOCK": 4}
+    dat = sql.query(known, "STOCK", ["%"], date(2023, 1, 1), date(2024, 12, 31))
+    assert dat.groupby("symbol").size().to_dict() == {"KGH": 7}
+    d = desc(known)
+    assert d["symbol"].to_list() == ["KGH"]
+    assert d.loc[0, "name"] == "KGHM" and d.loc[0, "country"] == "PL"
+    # Monday 2024-01-01 (holiday) gap is within COVER_GAP: one period
+    cover = sql.coverage(known, d["hash"].to_list())
+    assert cover.loc[:, ["from_date", "to_date"]].values.tolist() == [
+        [date(2023, 12, 27), date(2024, 1, 5)]
+    ]
+
+
+def test_load_unknown(source, known):
+    assert dump.load(source, db_file=known, allow_unknown=True, workers=1) == {"STOCK": 7}
+    # loaded again: nothing added
+    dump.load(source, db_file=known, allow_unknown=True, workers=1)
+    dat = sql.query(known, "STOCK", ["%"], date(2023, 1, 1), date(2024, 12, 31))
+    assert dat.groupby("symbol").size().to_dict() == {"KGH": 7, "XYZ": 3}
+    d = desc(known).set_index("symbol")
+    assert d.loc["XYZ", "name"] == "XYZ" and d.loc["XYZ", "country"] == "UNKNOWN"
+    assert d.loc["XYZ", "start_quote"] == date(2024, 1, 2)
+    cover = sql.coverage(known, [d.loc["XYZ", "hash"]])
+    assert cover.loc[:, ["from_date", "to_date"]].values.tolist() == [
+        [date(2024, 1, 2), date(2024, 1, 4)]
+    ]
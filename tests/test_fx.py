@@ -0,0 +1,63 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from workers import fx, sql
+
+
+def put_rates(db: str, cur: str, rates: dict) -> None:
+    """{date: rate to EUR} of currency to CURRENCY table"""
+    desc = sql.getDF(db_file=db, tab="CURRENCY_DESC", search=[cur], where=["symbol"])
+    dat = pd.DataFrame({"date": list(rates), "val": list(rates.values())})
+    dat = dat.assign(**{c: desc[c].iloc[0] for c in desc.columns if c != "date"})
+    assert sql.put(dat, "CURRENCY", db)
+
+
+@pytest.fixture
+def rates(db) -> str:
+    # Thursday, Friday and Monday fixings
+    put_rates(db, "PLN", {date(2024, 1, 4): 4.0, date(2024, 1, 5): 4.4, date(2024, 1, 8): 4.2})
+    put_rates(db, "USD", {date(2024, 1, 4): 1.1, date(2024, 1, 5): 1.0, date(2024, 1, 8): 1.2})
+    return db
+
+
+def test_as_of(rates):
+    days = [date(2024, 1, 3), date(2024, 1, 4), date(2024, 1, 6), date(2024, 1, 9)]
+    fac = fx.factors(rates, days, ["PLN"] * 4, ["EUR", "USD", "PLN"])
+    # before first fixing: unknown
+    assert np.isnan(fac[0]).all()
+    # weekend: Friday fixing, later days: last fixing
+    np.testing.assert_allclose(fac[1:, 0], [1 / 4.0, 1 / 4.4, 1 / 4.2])
+    np.testing.assert_allclose(fac[1:, 1], [1.1 / 4.0, 1.0 / 4.4, 1.2 / 4.2])
+    np.testing.assert_allclose(fac[1:, 2], [1.0, 1.0, 1.0])
+
+
+def test_base_and_unknown(rates):
+    fac = fx.factors(rates, [date(2024, 1, 5)] * 3, ["EUR", "XXX", "USD"], ["PLN", "XXX"])
+    np.testing.assert_allclose(fac[[0, 2], 0], [4.4, 4.4])
+    assert np.isnan(fac[1]).all() and np.isnan(fac[:, 1]).all()
+
+
+def test_invalidate(rates):
+    day = [date(2024, 1, 10)]
+    assert fx.factors(rates, day, ["EUR"], ["PLN"])[0, 0] == pytest.approx(4.2)
+    put_rates(rates, "PLN", {date(2024, 1, 10): 4.3})
+    # kept in memory until invalidated
+    assert fx.factors(rates, day, ["EUR"], ["PLN"])[0, 0] == pytest.approx(4.2)
+    fx.invalidate(rates, ["PLN"])
+    assert fx.factors(rates, day, ["EUR"], ["PLN"])[0, 0] == pytest.approx(4.3)
+
+
+def test_convert(rates):
+    dat = pd.DataFrame(
+        {"date": [date(2024, 1, 5), date(2024, 1, 8)], "val": [44.0, 42.0], "name": ["A", "B"]}
+    )
+    got = fx.convert(rates, dat, ["PLN", "PLN"], ["eur", "USD"], cols=["val", "vol"])
+    assert set(got) == {"EUR", "USD"}
+    assert got["EUR"]["val"].to_list() == pytest.approx([10.0, 10.0])
+    assert got["USD"]["val"].to_list() == pytest.approx([10.0, 12.0])
+    assert got["USD"]["name"].to_list() == ["A", "B"]
+    # input not changed
+    assert dat["val"].to_list() == [44.0, 42.0]
@@ -0,0 +1,46 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from dev.bench_candles import panel
+from dev.bench_resample import legacy
+from workers import resample
+
+
+@pytest.mark.parametrize("period", ["weekly", "monthly", "quarterly"])
+def test_ohlcv(period):
+    # all symbols at once, the same as pandas resample of each symbol
+    dat = panel(12, 300)
+    pd.testing.assert_frame_equal(
+        resample.ohlcv(dat, period), legacy(dat, period), check_freq=False
+    )
+
+
+def test_ohlcv_unsorted():
+    # first/last of period by date, not by row order
+    dat = pd.DataFrame(
+        {
+            "symbol": ["A", "A", "A", "B"],
+            "date": pd.to_datetime(["2024-01-04", "2024-01-02", "2024-01-03", "2024-01-03"]),
+            "open": [3.0, 1.0, 2.0, 7.0],
+            "high": [3.5, 1.5, 9.0, 7.5],
+            "low": [2.5, 0.5, 1.5, 6.5],
+            "val": [3.2, 1.2, 2.2, 7.2],
+            "vol": [30, 10, 20, 70],
+        }
+    )
+    got = resample.ohlcv(dat, "weekly").set_index("symbol")
+    assert got.loc["A", "date"] == pd.Timestamp("2024-01-07")
+    assert got.loc["A", ["open", "high", "low", "val", "vol"]].to_list() == [1.0, 9.0, 0.5, 3.2, 60]
+    assert got.loc["B", "vol"] == 70
+
+
+def test_period_label():
+    days = pd.to_datetime(["2024-01-01", "2024-01-07", "2024-01-08", "2024-02-29"])
+    assert list(resample.label(resample.ordinal(days, "W"), "W")) == list(
+        pd.to_datetime(["2024-01-07", "2024-01-07", "2024-01-14", "2024-03-03"])
+    )
+    assert pd.Timestamp(resample.label(resample.ordinal([date(2024, 2, 10)], "Q"), "Q")[0]) == (
+        pd.Timestamp("2024-03-31")
+    )
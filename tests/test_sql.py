@@ -0,0 +1,191 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from conftest import stock
+from workers import resample, sql
+
+DAYS = pd.bdate_range("2024-01-02", "2024-01-05").date
+
+
+def periods(rows: list) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["hash", "from_date", "to_date"])
+
+
+def as_list(dat: pd.DataFrame) -> list:
+    return dat.loc[:, ["hash", "from_date", "to_date"]].values.tolist()
+
+
+def test_merge_overlapping():
+    dat = periods(
+        [
+            ["a", date(2024, 1, 2), date(2024, 1, 10)],
+            ["a", date(2024, 1, 5), date(2024, 1, 15)],
+            # within previous one
+            ["a", date(2024, 1, 3), date(2024, 1, 4)],
+            # other asset is not merged
+            ["b", date(2024, 1, 9), date(2024, 1, 12)],
+        ]
+    )
+    assert as_list(sql.__merge_periods__(dat)) == [
+        ["a", date(2024, 1, 2), date(2024, 1, 15)],
+        ["b", date(2024, 1, 9), date(2024, 1, 12)],
+    ]
+
+
+def test_merge_adjacent():
+    dat = periods(
+        [
+            ["a", date(2024, 1, 8), date(2024, 1, 10)],
+            ["a", date(2024, 1, 2), date(2024, 1, 7)],
+        ]
+    )
+    assert as_list(sql.__merge_periods__(dat)) == [
+        ["a", date(2024, 1, 2), date(2024, 1, 10)]
+    ]
+
+
+def test_merge_gap():
+    # Friday 2024-01-05 to Monday: weekend is no gap
+    # up to COVER_GAP (3) business days without quotes: holidays
+    dat = periods(
+        [
+            ["a", date(2024, 1, 2), date(2024, 1, 5)],
+            ["a", date(2024, 1, 8), date(2024, 1, 9)],
+            # 10, 11, 12 (Wed-Fri) missing
+            ["a", date(2024, 1, 15), date(2024, 1, 16)],
+            # 17, 18, 19, 22 missing
+            ["a", date(2024, 1, 23), date(2024, 1, 24)],
+        ]
+    )
+    assert sql.COVER_GAP == 3
+    assert as_list(sql.__merge_periods__(dat)) == [
+        ["a", date(2024, 1, 2), date(2024, 1, 16)],
+        ["a", date(2024, 1, 23), date(2024, 1, 24)],
+    ]
+
+
+def test_merge_empty():
+    assert sql.__merge_periods__(periods([])).empty
+
+
+def test_missing_periods(db):
+    sql.put_cover(db, ["a"], (date(2024, 1, 2), date(2024, 1, 5)))
+    sql.put_cover(db, ["a"], (date(2024, 1, 15), date(2024, 1, 19)))
+    sql.put_cover(db, ["c"], (date(2023, 12, 1), date(2024, 2, 1)))
+    # Saturday 2023-12-30 to Sunday 2024-01-21
+    windows = periods(
+        [[h, date(2023, 12, 30), date(2024, 1, 21)] for h in ["a", "b", "c"]]
+    )
+    assert as_list(sql.missing_periods(db, windows)) == [
+        # Monday 2024-01-01 is business day
+        ["a", date(2023, 12, 30), date(2024, 1, 1)],
+        ["a", date(2024, 1, 6), date(2024, 1, 14)],
+        # nothing after 2024-01-19 (Friday), only weekend
+        # not stored at all
+        ["b", date(2023, 12, 30), date(2024, 1, 21)],
+    ]
+
+
+def test_put_cover(db):
+    # empty download is stored as covered, merged with existing periods
+    sql.put_cover(db, ["a"], (date(2024, 1, 2), date(2024, 1, 5)))
+    sql.put_cover(db, ["a", "a"], (date(2024, 1, 8), date(2024, 1, 12)))
+    assert as_list(sql.coverage(db, ["a"])) == [
+        ["a", date(2024, 1, 2), date(2024, 1, 12)]
+    ]
+    windows = periods([["a", date(2024, 1, 2), date(2024, 1, 12)]])
+    assert sql.missing_periods(db, windows).empty
+
+
+def values(db: str) -> dict:
+    dat = sql.query(db, "STOCK", ["%"], date(2024, 1, 1), date(2024, 12, 31))
+    return dict(zip(dat["date"], dat["val"]))
+
+
+def test_put_replace(db):
+    assert sql.put(stock("KGH", DAYS), "STOCK", db)
+    # corrected bar replaces stored one
+    assert sql.put(stock("KGH", [date(2024, 1, 3)], val=20.0), "STOCK", db)
+    assert values(db) == {
+        date(2024, 1, 2): 10.0,
+        date(2024, 1, 3): 20.0,
+        date(2024, 1, 4): 10.0,
+        date(2024, 1, 5): 10.0,
+    }
+
+
+def test_put_upsert(db):
+    assert sql.put(stock("KGH", DAYS), "STOCK", db)
+    # only new rows are added, stored ones are kept
+    new = stock("KGH", [date(2024, 1, 3), date(2024, 1, 8)], val=30.0)
+    assert sql.put(new, "STOCK", db, upsert=True)
+    got = values(db)
+    assert got[date(2024, 1, 3)] == 10.0 and got[date(2024, 1, 8)] == 30.0
+    assert len(got) == 5
+    # one description, dates extended
+    desc = sql.getDF(tab="STOCK_DESC", search=["%"], where=["symbol"], db_file=db)
+    assert len(desc) == 1 and desc.loc[0, "to_date"] == date(2024, 1, 8)
+
+
+@pytest.fixture
+def universe(db) -> str:
+    """db with 600 symbols (more then MAX_BOUND_KEYS), 4 days each"""
+    dat = pd.concat([stock(f"S{n:03d}", DAYS, val=float(n)) for n in range(600)])
+    assert sql.put(dat, "STOCK", db)
+    return db
+
+
+@pytest.mark.parametrize("symbols", [["%"], [f"S{n:03d}" for n in range(600)]])
+def test_query_iter(universe, symbols):
+    chunks = list(
+        sql.query_iter(
+            universe, "STOCK", symbols, date(2024, 1, 1), date(2024, 1, 31), chunk_rows=50
+        )
+    )
+    assert len(chunks) > 1
+    dat = pd.concat(chunks)
+    assert len(dat) == 2400 and dat["symbol"].nunique() == 600
+    # all rows of symbol in one chunk
+    assert sum(c["symbol"].nunique() for c in chunks) == 600
+    assert (dat.groupby("symbol")["val"].first() == [float(n) for n in range(600)]).all()
+
+
+def test_query_iter_consumer(universe):
+    # key filter with temp table (>MAX_BOUND_KEYS) while stream is read
+    rows = 0
+    hashes = list(sql.coverage(universe, ["%"])["hash"])
+    for chunk in sql.query_iter(
+        universe, "STOCK", ["%"], date(2024, 1, 1), date(2024, 1, 31), chunk_rows=1000
+    ):
+        rows += len(chunk)
+        assert len(sql.coverage(universe, hashes)) == 600
+    assert rows == 2400
+
+
+def weekly(db: str) -> list:
+    dat = sql.query(db, "STOCK", ["%"], date(2024, 1, 1), date(2024, 1, 31), period="weekly")
+    return dat.loc[:, ["date", "open", "high", "low", "val", "vol"]].values.tolist()
+
+
+@pytest.mark.parametrize("layout", [1, 2])
+def test_rollup(tmp_path, layout):
+    db = str(tmp_path / f"layout{layout}.sqlite")
+    assert sql.create_sql(db, layout=layout)
+    assert sql.put(stock("KGH", DAYS), "STOCK", db)
+    assert weekly(db) == [[date(2024, 1, 7), 10.0, 11.0, 9.0, 10.0, 400]]
+    # corrected bar and new day in the same week and in next one
+    fix = stock("KGH", [date(2024, 1, 5)], val=20.0)
+    assert sql.put(fix, "STOCK", db)
+    assert sql.put(stock("KGH", [date(2024, 1, 6), date(2024, 1, 8)], val=5.0), "STOCK", db)
+    assert weekly(db) == [
+        [date(2024, 1, 7), 10.0, 21.0, 4.0, 5.0, 500],
+        [date(2024, 1, 14), 5.0, 6.0, 4.0, 5.0, 100],
+    ]
+    # the same as daily data resampled
+    daily = sql.query(db, "STOCK", ["%"], date(2024, 1, 1), date(2024, 1, 31))
+    daily["date"] = pd.to_datetime(daily["date"])
+    exp = resample.ohlcv(daily, "weekly", empty=False)
+    exp["date"] = exp["date"].dt.date
+    assert weekly(db) == exp.loc[:, ["date", "open", "high", "low", "val", "vol"]].values.tolist()
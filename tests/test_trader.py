@@ -0,0 +1,138 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import tradeDB
+from workers import api, sql
+from workers.common import hash_table
+
+# Wednesday, session not published yet
+TODAY = date(2024, 1, 10)
+
+
+class Today(date):
+    """date of tradeDB, with today() fixed to TODAY"""
+
+    def __new__(cls, *args):
+        return date(*args)
+
+    @classmethod
+    def today(cls):
+        return TODAY
+
+
+def bars(symbol: str, days) -> pd.DataFrame:
+    """stooq csv of symbol as returned by api.stooq()"""
+    dat = pd.DataFrame({"date": list(days)})
+    dat["open"], dat["high"], dat["low"], dat["val"], dat["vol"] = 10.0, 12.0, 9.0, 11.0, 100
+    return dat
+
+
+def stored(symbol: str, days) -> pd.DataFrame:
+    """bars of symbol as written by Trader"""
+    dat = bars(symbol, days)
+    dat["symbol"], dat["name"], dat["country"] = symbol, symbol, "PL"
+    dat["hash"] = hash_table(dat, "STOCK")
+    dat["from_date"], dat["to_date"] = dat["date"].min(), dat["date"].max()
+    dat["start_quote"] = date(1800, 1, 1)
+    return dat
+
+
+@pytest.fixture
+def trader(db, monkeypatch) -> tradeDB.Trader:
+    """Trader of STOCK (KGH stored up to 2024-01-05) asking up to TODAY"""
+    monkeypatch.setattr(tradeDB, "date", Today)
+    assert sql.put(stored("KGH", pd.bdate_range("2024-01-02", "2024-01-05").date), "STOCK", db)
+    t = tradeDB.Trader(db=db, update_symbols=False)
+    t.tab, t.symbol = "STOCK", ["%"]
+    t.start_date, t.end_date = date(2024, 1, 2), TODAY
+    return t
+
+
+@pytest.fixture
+def web(monkeypatch) -> list:
+    """api.stooq answering with web[-1] (DataFrame), requests in web[:-1]"""
+    resp = [pd.DataFrame()]
+
+    def stooq(from_date, to_date, symbol):
+        resp.insert(-1, (symbol, from_date, to_date))
+        return resp[-1].copy()
+
+    monkeypatch.setattr(api, "stooq", stooq)
+    return resp
+
+
+def test_today_empty_asked_again(trader, web):
+    trader.__update_dates__()
+    trader.__update_dates__()
+    # today's session not published: window is not covered
+    assert web[:-1] == [("KGH", date(2024, 1, 6), TODAY)] * 2
+
+
+def test_covered_to_last_bar(trader, web):
+    web[-1] = bars("KGH", [date(2024, 1, 8), date(2024, 1, 9)])
+    trader.__update_dates__()
+    trader.__update_dates__()
+    assert web[:-1] == [
+        ("KGH", date(2024, 1, 6), TODAY),
+        ("KGH", TODAY, TODAY),
+    ]
+
+
+def test_past_window(trader, web):
+    trader.end_date = date(2024, 1, 9)
+    # failed request says nothing about window
+    web[-1] = pd.DataFrame([api.FAILED])
+    trader.__update_dates__()
+    # no quotes (holidays) in closed window: covered
+    web[-1] = pd.DataFrame()
+    trader.__update_dates__()
+    trader.__update_dates__()
+    assert web[:-1] == [("KGH", date(2024, 1, 6), date(2024, 1, 9))] * 2
+
+
+def test_currency_before_first_date(trader, monkeypatch):
+    asked = []
+
+    def ecb_batch(from_date, end_date, symbols):
+        asked.append(from_date)
+        days = pd.bdate_range(from_date, end_date).date
+        return {s: pd.DataFrame({"date": days, "val": 4.0 if s == "PLN" else 1.1}) for s in symbols}
+
+    monkeypatch.setattr(api, "ecb_batch", ecb_batch)
+    # first row on Sunday: rate of Friday is needed
+    trader.data = stored("KGH", [date(2024, 1, 7), date(2024, 1, 8)])
+    trader.currency = "USD"
+    trader.__update_currency__()
+    trader.__convert_currency__()
+    assert asked[0] < date(2024, 1, 5)
+    assert trader.data["val"].round(4).to_list() == [3.025, 3.025]
+
+
+def plan(trader) -> list:
+    desc = sql.getDF(tab="STOCK_DESC", search=["%"], where=["symbol"], db_file=trader.db)
+    dat = trader.__missing_dates__(desc)
+    return sorted(dat.loc[:, ["symbol", "from_date", "to_date"]].values.tolist())
+
+
+def test_plan_per_symbol(trader):
+    # PKO: short stored period inside window, one request over it
+    assert sql.put(stored("PKO", [date(2024, 1, 8), date(2024, 1, 9)]), "STOCK", trader.db)
+    # PEO: stored up to date
+    assert sql.put(stored("PEO", pd.bdate_range("2024-01-02", TODAY).date), "STOCK", trader.db)
+    assert plan(trader) == [
+        ["KGH", date(2024, 1, 6), TODAY],
+        ["PKO", date(2024, 1, 2), TODAY],
+    ]
+
+
+def test_plan_long_gap(trader):
+    # stored period longer then COALESCE_DAYS: separate requests
+    days = pd.bdate_range("2023-12-01", "2023-12-29").date
+    assert sql.put(stored("KGH", days), "STOCK", trader.db)
+    trader.start_date = date(2023, 11, 1)
+    assert plan(trader) == [
+        ["KGH", date(2023, 11, 1), date(2023, 11, 30)],
+        ["KGH", date(2024, 1, 6), TODAY],
+    ]
@@ -1,22 +1,18 @@
 import os
 import re
 import sys
-import itertools
+import bisect
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, timedelta
-from typing import Callable, List, Tuple, Union, Dict, Self
+from typing import Callable, Iterator, List, Tuple, Union, Dict, Self
 
+import numpy as np
 import pandas as pd
-from sklearn import preprocessing as prep
 
-# import matplotlib
-# matplotlib.use("Agg")  # necessery for debuging plot in VS code (not-interactive mode)
-from matplotlib import pyplot as plt
-import matplotlib.dates as mdate
-from alive_progress import alive_bar
-from technical_analysis import candles
-
-from workers import api, sql
-from workers.common import read_json, biz_date, hash_table
+# plotting, scaling, candle and progress bar libs are slow to import,
+# so are imported in methods using them (fast start for db queries only)
+from workers import api, sql, dump, candle, resample, fx
+from workers.common import read_json, biz_date, hash_table, rate_limit
 
 
 class Trader:
@@ -42,13 +38,28 @@ class Trader:
         - data - collected data (as pandas DataFrame)
                 usefull pandas methods are to_csv and pivot
         - get - collect data and stores inside class
+        - iter_get - as get, but yields data in chunks (for big queries)
         - + - can add data from different queries
         - pivot - 'excell' like table
         - plot - quick plots
         - candle_apatterns - calculate bullish/bearish trend based on candles
+        - resample - OHLCV of all symbols to weekly, monthly or quarterly periods
+        - load_dump - seed db from stooq bulk dump (zip or directory)
+        - open/close - keep db connection open between queries
+                (also 'with Trader() as tr:' closes connection on exit)
+
+    Web downloads run in 'workers' threads, limited to 'rate' requests
+    per second to stooq (to not trigger captcha)
     """
 
-    def __init__(self, db="", update_symbols=True) -> None:
+    # download planning: stored period shorter than this is requested again
+    # rather than split into head and tail request
+    COALESCE_DAYS = 7
+    BYTES_PER_ROW = 50  # csv row from stooq, for download estimates
+
+    def __init__(
+        self, db="", update_symbols=True, layout=1, workers=4, rate=2.0
+    ) -> None:
         # global variables - defoult
         self.args = {
             "update_dates": True,
@@ -59,7 +70,8 @@ class Trader:
             "start_date": "",
             "end_date": "",
             "date_format": r"%d-%m-%Y",
-            # filtering args start at pos.7
+            "period": "daily",
+            # filtering args start at pos.9
             "region": ["%"],
             "country": ["%"],
             "components": ["%"],
@@ -76,6 +88,9 @@ class Trader:
         self.candle_pattern_kwargs = {}  # store candle_pattern arguments
         self.candle_pattern_file = "./assets/candle_pattern.jsonc"
         self.cp_cols = {"CP":"candle_pattern", "CF":"formation"}
+        # concurrent downloads: threads and requests per second to stooq
+        self.workers = workers
+        self.rate = rate
         # read table sectors
         self.SECTORS = self.__read_sectors__(
             {
@@ -90,7 +105,7 @@ class Trader:
             self.db = "./trader.sqlite"
         else:
             # check path
-            db = os.path.split(db)[0]
+            db = os.path.split(db)
             f = db[-1]
             p = db[0]
             if not os.path.exists(p):
@@ -98,9 +113,25 @@ class Trader:
                 print(f"path '{p}' dosen't exists. Using {os.path.abspath(p)}")
             self.db = os.path.join(p, f)
         # make sure file is corrcet, also create if missing
-        if not sql.check_sql(self.db) and update_symbols:
+        # (layout 2 is compact DB, used only when new file is created)
+        if not sql.check_sql(self.db, layout=layout) and update_symbols:
             self.__update_sql__()
 
+    def __enter__(self) -> Self:
+        return self.open()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def open(self) -> Self:
+        """open (pooled) connection to db, reused by all queries"""
+        sql.connect(self.db)
+        return self
+
+    def close(self) -> None:
+        """close connections to db, next query will reopen"""
+        sql.close(self.db)
+
     def __join__(self, arg: Union[list, str, bool, date]) -> Union[bool, str, date]:
         return ";".join(arg) if isinstance(arg, list) else arg
 
@@ -162,6 +193,8 @@ class Trader:
             if not resp:
                 sys.exit(f"FATAL: wrong data for {region}")
             # get components for index
+            from alive_progress import alive_bar
+
             with alive_bar(len(dat.index)) as bar:
                 for row in dat.itertuples(index=False):
                     datComp = api.stooq(
@@ -193,11 +226,20 @@ class Trader:
             sys.exit(str(err))
         return address
 
-    def __escape_regex__(self, arg: str) -> str:
+    def __is_opt__(self, arg: str, opts: List[str]) -> bool:
         """
-        escape regex special characters
+        check if arg is in sorted opts
         """
-        return re.sub(r"([.^$*+?{}()|[\]\\])", r"\\\1", arg)
+        i = bisect.bisect_left(opts, arg)
+        return i < len(opts) and opts[i] == arg
+
+    def __prefix_match__(self, arg: str, opts: List[str]) -> List[str]:
+        """
+        all opts starting with arg, opts must be sorted
+        """
+        lo = bisect.bisect_left(opts, arg)
+        hi = bisect.bisect_left(opts, arg + chr(0x10FFFF), lo=lo)
+        return opts[lo:hi]
 
     def __check_arg__(
         self,
@@ -238,27 +280,20 @@ class Trader:
         if tab != "GEO":
             tab += "_DESC"
         # collect options
-        if not opts_direct:
-            cols = opts
-            opts = [
-                v[k].to_list()
-                for k, v in sql.get(
-                    db_file=self.db, tab=tab, get=cols, search=["%"], where=cols
-                ).items()
-                if not v.empty
-            ]
-            opts = list(itertools.chain(*opts))  # flatten list
-        # make sure the opts are unique
-        opts = list(set(opts))
-        opts = [o.upper() for o in opts]
+        if opts_direct:
+            opts = sorted({o.upper() for o in opts})
+        else:
+            # sorted and cached in sql
+            opts = sql.options(db_file=self.db, tab=tab, cols=opts)
         if arg == "?":
             raise (ValueError(f"Possible values are: {opts}"))
 
         args_checked = []
         for arg in args:
-            arg = self.__escape_regex__(arg)
-            r = re.compile(arg + "$") if strict else re.compile(arg + ".*$")
-            match = list(filter(r.match, opts))
+            if strict:
+                match = [arg] if self.__is_opt__(arg, opts) else []
+            else:
+                match = self.__prefix_match__(arg, opts)
             if arg in match:  # we have direct match, possibly also others
                 args_checked += [arg]
                 continue
@@ -381,7 +416,7 @@ class Trader:
         opts += sql.tab_columns(tab=self.tab + "_DESC", db_file=self.db)
         if self.tab == "STOCK":
             opts += ["indexes"]
-        opts = [c for c in opts if c not in ["hash"]]
+        opts = [c for c in opts if c not in sql.HIDDEN_COLS]
         # add candle pattern columns
         opts += list(self.cp_cols.values())     
         argL = arg.split(";")
@@ -409,6 +444,14 @@ class Trader:
             tab="CURRENCY",
         )[0]
 
+    def __arg_period__(self, arg: str) -> None:
+        self.period = self.__check_arg__(
+            arg=arg,
+            arg_name="period",
+            opts=list(resample.PERIODS),
+            opts_direct=True,
+        )[0].lower()
+
     def get(self, **kwargs) -> Self:
         """get requested data from db or from web if missing in db
 
@@ -437,17 +480,101 @@ class Trader:
 
             str[columns]: limit result to selected columns, defoult all
             str[currency]: by defoult return value in country currency
+                        rate as of date (last ECB fixing), for period
+                        other then daily: as of last day of period
+                        (OHLCV of period is converted, not daily values)
             Date[start_date]: start date for search
             Date[end_date]: end date for search
             str[date_format]: python strftime format, defoult is '%d-%m-%Y'
+            str[period]: daily, weekly, monthly, quarterly, defoult daily
+                        read from rollup table if declared in sql_scheme
+                        (i.e. STOCK_M), other way daily data are resampled
+                        date is the last day of period
+        """
+        if not self.__prepare__(kwargs):
+            return self
+
+        self.data = sql.query(
+            db_file=self.db,
+            tab=self.tab,
+            symbol=self.symbol,
+            from_date=self.start_date,
+            to_date=self.end_date,
+            period=self.period,
+        )
+
+        # whole periods are converted, with rate as of last day of period
+        self.__period__()
+        self.__update_currency__()
+        self.__convert_currency__()
+        if self.candle_pattern_kwargs:
+            self.candle_pattern(**self.candle_pattern_kwargs)
+        if not self.update_dates and self.data.empty:
+            print("No data found in local DB. Consider setting update_dates=True")
+        return self
+
+    def load_dump(self, source: str, allow_unknown=False, workers=None) -> Self:
+        """load stooq bulk dump (https://stooq.com/db/h/) into db
+        much faster then downloading symbol by symbol
+        Args:
+            source: zip file or directory with dump
+            allow_unknown: also symbols not yet in db
+                (name=symbol, country unknown)
+            workers: number of processes parsing files
         """
+        dump.load(
+            source=source, db_file=self.db, allow_unknown=allow_unknown, workers=workers
+        )
+        return self
+
+    def iter_get(self, chunk_rows=100_000, **kwargs) -> Iterator[pd.DataFrame]:
+        """same as get(), but yields data in chunks instead of keeping
+        all in self.data (which holds only the last chunk).
+        Each chunk holds all rows of its symbols, so currency conversion
+        and candle patterns are calculated chunk by chunk.
+        Memory use is limited by chunk_rows (rows read from db at once)
+
+        for dat in trader.iter_get(tab="STOCK", region="europe"):
+            ...
+        """
+        if not self.__prepare__(kwargs):
+            return
+        for chunk in sql.query_iter(
+            db_file=self.db,
+            tab=self.tab,
+            symbol=self.symbol,
+            from_date=self.start_date,
+            to_date=self.end_date,
+            chunk_rows=chunk_rows,
+            by_symbol=True,
+            period=self.period,
+        ):
+            self.data = chunk
+            self.__period__()
+            self.__update_currency__()
+            self.__convert_currency__()
+            if self.candle_pattern_kwargs:
+                self.candle_pattern(**self.candle_pattern_kwargs)
+            yield self.data
+
+    def __period__(self) -> None:
+        """resample daily data to requested period,
+        when tab has no rollup table for it"""
+        if self.tab == "GEO" or resample.period(self.period) == "D":
+            return
+        if not sql.rollup(self.tab, self.period):
+            self.resample(self.period)
+
+    def __prepare__(self, kwargs: Dict) -> bool:
+        """check arguments and update db (see get())
+        return False if nothing to query"""
         if not kwargs:
             kwargs = self.kwargs
         else:
             self.kwargs = kwargs
         if not kwargs and not self.kwargs:
             print(self.get.__doc__)
-            return self
+            return False
         self.is_pivot = False
         # trick to not duplicate info
         self.date_change_print = True
@@ -457,7 +584,7 @@ class Trader:
         for a in kwargs.keys():
             try:
                 idx = list(self.args.keys()).index(a)
-                args += [a] if a in kwargs.keys() and idx > 7 else []
+                args += [a] if a in kwargs.keys() and idx > 8 else []
             except ValueError:
                 print(f"Unknown argument '{a}'. Ignoring")
         if len(args) > 1:
@@ -499,9 +626,12 @@ class Trader:
 
             # currency
             self.__arg_currency__(arg=kwargs.get("currency", self.currency))
+
+            # period
+            self.__arg_period__(arg=kwargs.get("period", self.period))
         except ValueError as e:
             print(e)
-            return self
+            return False
 
         self.update_symbols = kwargs.get("update_symbols", False)
         # block dates updating when not symbol or name selected
@@ -542,22 +672,7 @@ class Trader:
                     db_file=self.db, tab=self.tab, search=self.region, what=["region"]
                 )
                 self.update_dates = False
-
-        self.data = sql.query(
-            db_file=self.db,
-            tab=self.tab,
-            symbol=self.symbol,
-            from_date=self.start_date,
-            to_date=self.end_date,
-        )
-
-        self.__update_currency__()
-        self.__convert_currency__()
-        if self.candle_pattern_kwargs:
-            self.candle_pattern(**self.candle_pattern_kwargs)
-        if not self.update_dates and self.data.empty:
-            print("No data found in local DB. Consider setting update_dates=True")
-        return self
+        return True
 
     def to_str(self, col_name: str) -> Union[None, str]:
         """return column as string with ';' as separator"""
@@ -583,6 +698,12 @@ class Trader:
     def plot(self, normalize=True, xticks = 20) -> None:
         if self.data.empty:
             return
+        # import matplotlib
+        # matplotlib.use("Agg")  # necessery for debuging plot in VS code (not-interactive mode)
+        from matplotlib import pyplot as plt
+        import matplotlib.dates as mdate
+        from sklearn import preprocessing as prep
+
         dat = self.pivot()
         
         dates=dat.reset_index("date").loc[:,"date"]
@@ -646,28 +767,6 @@ class Trader:
         plt.xticks(rotation=55)
         plt.show()
 
-    def __date_resample__(self, df: pd.DataFrame, date_period: str) -> pd.DataFrame:
-        """recalculate OLHCV data to new period
-        assume input data is daily
-        can translate to weekly and monthly
-        """
-        periods = {"daily": "D", "weekly": "W", "monthly": "ME"}
-        if date_period.lower() in periods.keys():
-            date_period = periods[date_period.lower()]
-
-        resample_agg = {
-            "open": "first",
-            "high": "max",
-            "low": "min",
-            "val": "last",
-            "vol": "sum",
-        }
-
-        df = df.resample(rule=date_period, on="date").agg(resample_agg)  # type: ignore
-        df.reset_index(inplace=True)
-
-        return df
-
     def candle_pattern(self, date_period="daily", file = "", **kwargs) -> Self:
         """recognize canadle pattern and add column with prediction:
         - bullish are positive number (the higher value the more bullish)
@@ -678,12 +777,13 @@ class Trader:
         - columns: columns to display
         using technical-analysis library
         https://github.com/trevormcguire/technical-analysis
+        patterns are cached in db (per symbol, date_period and pattern file),
+        only new periods are calculated
         """
         if self.data.empty:
             return self
         
         req_cols = ["open", "high", "low", "val", "vol", "symbol", "date"]
-        cp_cols = ["symbol", "date"] + list(self.cp_cols.values())
         
         if not all([c in self.data.columns for c in req_cols]):
             print("candle pattern requires open, high, low, close, volume")
@@ -701,55 +801,49 @@ class Trader:
         self.__arg_columns__(arg=kwargs.get("columns", ";".join(self.columns)))
         
         self.data["date"] = pd.to_datetime(self.data["date"])
-        candle_pattern = read_json(file=self.candle_pattern_file)
-
-        def calc_cp(grp):
-            symbol = grp.iloc[0]["symbol"]
-            grp = self.__date_resample__(grp, date_period)
-            grp[self.cp_cols['CP']] = 0
-            grp[self.cp_cols['CF']] = ""
-            for cp, cv in candle_pattern.items():
-                ta_func = getattr(candles, cp)
-                cp_rows = ta_func(
-                    open=grp["open"],
-                    low=grp["low"],
-                    high=grp["high"],
-                    close=grp["val"],
-                    **cv["kwargs"],
-                )
-                grp.loc[cp_rows, self.cp_cols['CP']] += cv["ind"]  # type: ignore
-                grp.loc[cp_rows, self.cp_cols['CF']] = cp
-            grp[self.cp_cols['CP']] = grp[self.cp_cols['CP']].cumsum()
-            grp["symbol"] = symbol
-            return grp
-
-        self.data.sort_values(by=["symbol", "date"], inplace=True)
-        cp_DF = (
-            self.data
-            .reindex(columns=req_cols)
-            .drop_duplicates()
-            .groupby("symbol", group_keys=False)
-            .apply(calc_cp)
+        # all symbols at once, cached in CANDLES table (see workers/candle.py)
+        self.data = candle.candle_pattern(
+            dat=self.data,
+            date_period=date_period,
+            file=self.candle_pattern_file,
+            cp_cols=self.cp_cols,
+            db_file=self.db,
         )
-        # both DFs must be sorted before merge_asof
-        self.data.sort_values(by=["date"], inplace=True)
-        cp_DF.sort_values(by=["date"], inplace=True)
-        
-        self.data = pd.merge_asof(
-            left=self.data,
-            right=cp_DF.reindex(columns=cp_cols),
-            on="date",
-            by="symbol",
+        return self
+
+    def resample(self, period="weekly") -> Self:
+        """resample OHLCV data of all symbols to longer period
+        all symbols aggregated at once (see workers/resample.py):
+        open - first, high - max, low - min, val - last, vol - sum
+        (only columns present in data)
+        other columns (name, country, currency...) take first value of symbol
+        args:
+        - period: daily, weekly, monthly, quarterly
+        date is the end of period, periods without data are dropped
+        """
+        if self.data.empty:
+            return self
+        if not all([c in self.data.columns for c in ["symbol", "date", "val"]]):
+            print("resample requires symbol, date and close")
+            return self
+        if not resample.period(period):
+            print(f"Wrong period '{period}'. Possible: {list(resample.PERIODS)}")
+            return self
+
+        req_cols = ["symbol", "date"] + resample.OHLCV
+        info_cols = [
+            c
+            for c in self.data.columns
+            if c not in req_cols and c not in self.cp_cols.values()
+        ]
+        info = self.data.groupby("symbol", sort=False)[info_cols].first()
+        dat = resample.ohlcv(self.data, date_period=period, empty=False)
+        if not pd.api.types.is_datetime64_any_dtype(self.data["date"]):
+            # as read from db
+            dat["date"] = dat["date"].dt.date
+        self.data = dat.join(info, on="symbol").reindex(
+            columns=[c for c in self.data.columns if c not in self.cp_cols.values()]
         )
-        self.data.sort_values(by=["symbol", "date"], inplace=True, ignore_index=True)
-        # fill missing candle_pattern values with last available value
-        self.data["candle_pattern"] = (
-                        self.data
-                        .groupby("symbol")[self.cp_cols['CP']]
-                        .ffill())
-        # may left NaN at begining  if date_period != 'daily'
-        self.data[self.cp_cols['CP']] = self.data[self.cp_cols['CP']].fillna(0)
-        self.data[self.cp_cols['CF']] = self.data[self.cp_cols['CF']].fillna("")
         return self
 
     def pivot(self, **kwargs) -> pd.DataFrame:
@@ -793,48 +887,25 @@ class Trader:
         return dat.reset_index(drop=True)
 
     def __convert_currency__(self) -> None:
+        """convert prices to self.currency with rate as of date
+        (last ECB fixing, also on days without fixing), see workers/fx.py"""
         if self.currency == "%" or self.data.empty:
             return
-
-        def get_currency_rate(column_symb: str, column_val: str) -> pd.DataFrame:
-            return sql.currency_rate(
-                db_file=self.db,
-                dat=self.data[[column_symb, "date"]].rename(
-                    columns={column_symb: "symbol"}
-                ),
-            ).rename(columns={"val": column_val, "symbol": column_symb})
-
-        def get_currency_of_country():
-            return sql.currency_of_country(
-                db_file=self.db, country=set(self.data["country"].to_list())
-            ).rename(columns={"symbol": "cur_from"})
-
-        cols = self.data.columns  # so we can restore
-        curFrom = get_currency_of_country()
-        self.data = self.data.merge(
-            curFrom, left_on="country", right_on="iso2", how="left", suffixes=("", "_y")
-        )
-        self.data["cur_to"] = self.currency
-        self.data = self.data.merge(
-            get_currency_rate(column_symb="cur_to", column_val="val_to"),
-            on=["date", "cur_to"],
-            how="left",
+        cur_from = sql.currency_of_country(
+            db_file=self.db, country=set(self.data["country"].to_list())
         )
-        self.data = self.data.merge(
-            get_currency_rate(column_symb="cur_from", column_val="val_from"),
-            on=["date", "cur_from"],
-            how="left",
+        cur_from = self.data["country"].map(
+            cur_from.drop_duplicates(subset="iso2").set_index("iso2")["symbol"]
+            if not cur_from.empty
+            else {}
         )
-
-        for col in ["val", "low", "high", "open", "vol"]:
-            if col in cols:
-                self.data[col] = (
-                    pd.to_numeric(self.data[col], errors="coerce")
-                    / self.data["val_from"]
-                    * self.data["val_to"]
-                )
-
-        self.data = self.data.reindex(columns=cols)
+        self.data = fx.convert(
+            db_file=self.db,
+            dat=self.data,
+            cur_from=cur_from,
+            cur_to=[self.currency],
+            cols=["val", "low", "high", "open", "vol"],
+        )[self.currency.upper()]
         return
 
     def __set_dates__(self, kwargs: Dict) -> None:
@@ -883,29 +954,62 @@ class Trader:
             return
 
     def __missing_dates__(
-        self, dat: pd.DataFrame, date_source="self_date"
+        self, dat: pd.DataFrame, date_source="self_date", lead=0
     ) -> pd.DataFrame:
-        # compare avialable date range with requested dates
-        # requested dates can come from 'self_date' or 'self_data'
-        # leave only symbols that needs update
+        """plan downloads: compare stored periods (COVERAGE) with requested dates
+        requested dates can come from 'self_date' or 'self_data'
+        lead: business days asked also before start (i.e. previous fixing)
+        for each symbol only missing parts of period are requested
+        dat must have 'hash' column
+        return row per request (symbol can have more)
+        with from_date and to_date of request
+        """
         if date_source == "self_data" and not self.data.empty:
             start_date = self.data["date"].min()
             end_date = self.data["date"].max()
         else:
             start_date = self.start_date
             end_date = self.end_date
-        min_dates = dat["from_date"] > start_date
-        max_dates = dat["to_date"] < end_date
-        dat = dat.loc[min_dates | max_dates]
-        # avoid 'holes' in date series
-        # adjust from_date or to_date to begining/end existing period
-        dat.loc[:, "from_date"] = min(dat["from_date"].to_list() + [start_date])
-        dat.loc[:, "to_date"] = max(dat["to_date"].to_list() + [end_date])
-
-        # remove symbols if start date before start_quote
+        if lead:
+            start_date = (pd.Timestamp(start_date) - pd.offsets.BDay(lead)).date()
+        # no data in future (period labels can be in future)
+        end_date = min(pd.Timestamp(end_date), pd.Timestamp(date.today())).date()
+        if dat.empty:
+            return dat
+        dat = dat.drop_duplicates(subset="hash").reset_index(drop=True)
+        start = pd.Series(pd.Timestamp(start_date), index=dat.index)
         if "start_quote" in dat.columns:
-            dat = dat.loc[dat["start_quote"] <= start_date]
-        return dat
+            # no quotes before start_quote
+            quote = pd.to_datetime(dat["start_quote"], errors="coerce")
+            start = start.where(~(quote > start), quote)
+        windows = pd.DataFrame(
+            {"hash": dat["hash"], "from_date": start.dt.date, "to_date": end_date}
+        ).loc[start <= pd.Timestamp(end_date)]
+        # what is not yet in db (see COVERAGE table)
+        gaps = sql.missing_periods(db_file=self.db, windows=windows)
+        if gaps.empty:
+            return dat.iloc[0:0]
+        # short stored period between gaps: one request is enough
+        prev_to = pd.to_datetime(gaps["to_date"]).groupby(gaps["hash"]).shift()
+        join = pd.to_datetime(gaps["from_date"]) - prev_to <= pd.Timedelta(
+            days=self.COALESCE_DAYS + 1
+        )
+        gaps = gaps.groupby((~join).cumsum()).agg(
+            hash=("hash", "first"), from_date=("from_date", "min"), to_date=("to_date", "max")
+        )
+        plan = dat.drop(columns=["from_date", "to_date"], errors="ignore").merge(
+            gaps, on="hash"
+        )
+
+        rows = np.busday_count(
+            plan["from_date"].to_numpy(dtype="datetime64[D]"),
+            plan["to_date"].to_numpy(dtype="datetime64[D]") + 1,
+        ).sum()
+        print(
+            f"...planned {len(plan)} requests for {plan['hash'].nunique()} symbols, "
+            f"~{rows} rows (~{rows * self.BYTES_PER_ROW / 1024:.0f}kB)"
+        )
+        return plan
 
     def __update_dates__(self) -> None:
         # download missing data
@@ -919,41 +1023,155 @@ class Trader:
             where=["symbol"],
             db_file=self.db,
         )
+        symbolDF = self.__latest_session__(symbolDF)
         symbolDF = self.__missing_dates__(symbolDF)
 
-        if not symbolDF.empty:
-            info = True
-            with alive_bar(len(symbolDF)) as bar:
-                for row in symbolDF.itertuples(index=False):
-                    if info:
-                        print("...updating dates")
-                        info = False
-                    dat = api.stooq(
-                        from_date=row.from_date,  # type: ignore
-                        to_date=row.to_date,  # type: ignore
-                        symbol=str(row.symbol),
-                    )
-                    if dat.empty:
-                        print("no data on web")  # DEBUG
-                        continue
+        if symbolDF.empty:
+            return
+        print("...updating dates")
+        from alive_progress import alive_bar
+
+        rate_limit("stooq.com", rate=self.rate)
+        # download in threads, but write to db only here (single writer)
+        with alive_bar(len(symbolDF)) as bar, ThreadPoolExecutor(
+            max_workers=self.workers
+        ) as pool:
+
+            def submit(row):
+                return pool.submit(
+                    api.stooq,
+                    from_date=row.from_date,  # type: ignore
+                    to_date=row.to_date,  # type: ignore
+                    symbol=str(row.symbol),
+                )
 
-                    if dat.iloc[0, 0] == "asset removed":
-                        sql.rm_all(
-                            tab=self.tab, symbol=str(row.symbol), db_file=self.db
-                        )
-                        print("symbol removed")  # DEBUG
+            jobs = {submit(row): row for row in symbolDF.itertuples(index=False)}
+            # asked again (after captcha) are collected in next round
+            while jobs:
+                for job in as_completed(list(jobs)):
+                    row = jobs.pop(job)
+                    dat = job.result()
+                    if not dat.empty and dat.iloc[0, 0] == api.INTERACTIVE:
+                        # captcha/GDPR window only in main thread
+                        api.solve_pending()
+                        jobs[submit(row)] = row
                         continue
-
-                    dat = self.__describe_table__(
-                        dat=dat,
-                        tab=self.tab,
-                        description=row._asdict(),  # type: ignore
-                    )
-                    resp = sql.put(dat=dat, tab=self.tab, db_file=self.db)
-                    if not resp:
+                    if not self.__store_dates__(dat, row):
+                        pool.shutdown(wait=False, cancel_futures=True)
                         sys.exit(f"FATAL: wrong data for '{row.name}'")
                     bar()
 
+    def __store_dates__(self, dat: pd.DataFrame, row) -> bool:
+        """write downloaded data of symbol (row of __missing_dates__ plan) to db
+        window is stored as covered up to the last bar (or whole window
+        if closed, see __cover_to__), so today is asked again until published
+        return False if data not accepted by db"""
+        if not dat.empty and dat.iloc[0, 0] == api.FAILED:
+            print("request failed")  # DEBUG
+            return True
+
+        if dat.empty:
+            print("no data on web")  # DEBUG
+            if row.to_date >= date.today():
+                return True
+            # period is known to be empty, not requested again
+            return sql.put_cover(
+                db_file=self.db,
+                hashes=[str(row.hash)],
+                cover=(row.from_date, row.to_date),  # type: ignore
+            )
+
+        if dat.iloc[0, 0] == "asset removed":
+            sql.rm_all(tab=self.tab, symbol=str(row.symbol), db_file=self.db)
+            print("symbol removed")  # DEBUG
+            return True
+
+        dat = self.__describe_table__(
+            dat=dat,
+            tab=self.tab,
+            description=row._asdict(),  # type: ignore
+        )
+        return bool(
+            sql.put(
+                dat=dat,
+                tab=self.tab,
+                db_file=self.db,
+                cover=self.__cover_to__(dat, row.from_date, row.to_date),  # type: ignore
+            )
+        )
+
+    def __cover_to__(self, dat: pd.DataFrame, from_date: date, to_date: date):
+        """period of request stored as covered: whole window if it ended
+        before today, other way up to the last bar received
+        (today's session or fixing may be published later)"""
+        if to_date < date.today():
+            return (from_date, to_date)
+        last = pd.to_datetime(dat["date"]).max().date()
+        return (from_date, min(last, to_date))
+
+    def __latest_session__(self, symbolDF: pd.DataFrame) -> pd.DataFrame:
+        """symbols missing only last session are updated from listing pages
+        (sector table for INDEXES, index components for STOCK),
+        one page lists ~100 symbols, so much less requests than csv per symbol
+        return symbols still to update
+        """
+        if symbolDF.empty:
+            return symbolDF
+        prev = (pd.Timestamp(self.end_date) - pd.offsets.BDay(1)).date()
+        lag = (symbolDF["to_date"] == prev) & (symbolDF["from_date"] <= self.start_date)
+        if not lag.any():
+            return symbolDF
+        sources = self.__listings__(symbolDF.loc[lag, "symbol"].to_list())
+        if not sources or len(sources) >= lag.sum():
+            return symbolDF
+
+        print("...updating last session")
+        listing = pd.concat(
+            [api.stooq(**src) for src in sources], ignore_index=True
+        )
+        if "symbol" not in listing.columns:
+            return symbolDF
+        cols = [c for c in ["val", "open", "high", "low", "vol"] if c in listing.columns]
+        listing = listing.loc[listing["date"] == self.end_date, ["symbol", "date"] + cols]
+        listing[cols] = listing[cols].apply(pd.to_numeric, errors="coerce")
+        listing = listing.dropna(subset=["val"])
+        listing["symbol"] = listing["symbol"].str.upper()
+        listing = listing.drop_duplicates(subset="symbol")
+
+        dat = symbolDF.loc[lag].assign(symbol=lambda x: x["symbol"].str.upper())
+        dat = dat.merge(listing, how="inner", on="symbol")
+        if dat.empty:
+            return symbolDF
+        dat["to_date"] = self.end_date
+        # only new session, downloaded bars are not overwritten
+        resp = sql.put(dat=dat, tab=self.tab, db_file=self.db, upsert=True)
+        if not resp:
+            sys.exit(f"FATAL: wrong data in listing for '{self.tab}'")
+        return symbolDF.loc[~symbolDF["hash"].isin(dat["hash"])]
+
+    def __listings__(self, symbols: List[str]) -> List[Dict]:
+        """api.stooq() arguments for listing pages with symbols"""
+        if self.tab == "INDEXES":
+            sector_dat = self.SECTORS["INDEXES"]["data"]
+            return [
+                {"sector_id": v["api"]["id"], "sector_grp": v["api"]["group"]}  # type: ignore
+                for v in sector_dat.values()  # type: ignore
+                if "%" in self.region or v["description"]["region"] in self.region  # type: ignore
+            ]
+        if self.tab == "STOCK":
+            idx = sql.stock_index(db_file=self.db, search=symbols)
+            if idx is None:
+                return []
+            idx_symbols = sql.getL(
+                db_file=self.db,
+                tab="INDEXES_DESC",
+                get=["symbol"],
+                search=list(set(idx["indexes"])),
+                where=["name"],
+            )
+            return [{"component": s} for s in idx_symbols]
+        return []
+
     def __update_currency__(self) -> None:
         # download missing data
         # assume all symbols are already in sql db
@@ -972,27 +1190,59 @@ class Trader:
         curDF = pd.concat(
             [curDF, curDest.reindex(columns=curDF.columns)], ignore_index=True
         )
-        curDF = self.__missing_dates__(curDF, date_source="self_data")
-
-        if not curDF.empty:
-            info = True
-            with alive_bar(len(curDF)) as bar:
-                for row in curDF.itertuples(index=False):
-                    if info:
-                        print("...updating currency")
-                        info = False
-                    cur_val = api.ecb(
-                        from_date=row.from_date, end_date=row.to_date, symbol=row.symbol  # type: ignore
-                    )
+        curDF["hash"] = hash_table(curDF, "CURRENCY")
+        # daily rows need rates of own dates, period (labeled with last day)
+        # needs rates as of label, so fixings from start of first period
+        # rate is as of date, so also last fixing before first date
+        # (weekend, holiday or before fixing time)
+        daily = resample.period(self.period) == "D"
+        curDF = self.__missing_dates__(
+            curDF, date_source="self_data" if daily else "self_date", lead=sql.COVER_GAP
+        )
+
+        if curDF.empty:
+            return
+        print("...updating currency")
+        from alive_progress import alive_bar
+
+        with alive_bar(len(curDF)) as bar:
+            # one ECB request for all currencies with the same window
+            for (from_date, to_date), rows in curDF.groupby(
+                ["from_date", "to_date"], sort=False
+            ):
+                cur_vals = api.ecb_batch(
+                    from_date=from_date,  # type: ignore
+                    end_date=to_date,  # type: ignore
+                    symbols=rows["symbol"].to_list(),
+                )
+                for row in rows.itertuples(index=False):
+                    cur_val = cur_vals[row.symbol]  # type: ignore
+                    if cur_val.empty:
+                        # no fixings, covered only if window is closed
+                        if to_date < date.today() and not sql.put_cover(
+                            db_file=self.db,
+                            hashes=[str(row.hash)],
+                            cover=(from_date, to_date),  # type: ignore
+                        ):
+                            sys.exit(f"FATAL: wrong data for '{row.name}'")
+                        bar()
+                        continue
                     cur_val = self.__describe_table__(
                         dat=cur_val,
                         tab="CURRENCY",
                         description=row._asdict(),  # type: ignore
                     )
-                    resp = sql.put(dat=cur_val, tab="CURRENCY", db_file=self.db)
+                    resp = sql.put(
+                        dat=cur_val,
+                        tab="CURRENCY",
+                        db_file=self.db,
+                        cover=self.__cover_to__(cur_val, from_date, to_date),  # type: ignore
+                    )
                     if not resp:
-                        sys.exit(f"FATAL: wrong data for '{row.symbol}'")
-                bar()
+                        sys.exit(f"FATAL: wrong data for '{row.name}'")
+                    # new rates, read again when converting
+                    fx.invalidate(db_file=self.db, currencies=[row.symbol])
+                    bar()
 
     def __describe_table__(
         self, dat: pd.DataFrame, tab: str, description: dict
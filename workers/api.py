@@ -2,23 +2,29 @@ import re
 import sys
 import os
 import asyncio
-from typing import Union
+from typing import TYPE_CHECKING, Dict, List, Tuple, Union
+from functools import lru_cache
 
 from datetime import datetime as dt
 from datetime import date
 import time
-import tkinter as tk
-from PIL import Image, ImageTk
+import threading
 import io
 
 import pandas as pd
-import pandasdmx as sdmx
 import requests as rq
+from requests.adapters import HTTPAdapter
+from http.cookiejar import DefaultCookiePolicy
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup as bs
-from playwright.async_api import async_playwright
 
-from workers.common import set_header, convert_date
+from workers.common import set_header, convert_date, rate_limit
+from workers import cache
+
+# scraping, SDMX and captcha GUI libs are slow to import,
+# so are imported when first used
+if TYPE_CHECKING:
+    import pandasdmx as sdmx
+    from bs4 import BeautifulSoup as bs
 
 """function to manage apis:
     - stooq: not really an API, but web scrapping
@@ -28,6 +34,25 @@ from workers.common import set_header, convert_date
 
 STOOQ_HEADER = "./assets/header_stooq.jsonc"
 header = set_header(STOOQ_HEADER)
+# captcha and GDPR need user/browser, so only one thread at a time
+# session_gen changes each time cookies are renewed, so other threads
+# hitting the same problem know it's solved already
+__interactive__ = threading.Lock()
+__session_gen__ = 0
+# Tk window and playwright run only in main thread, worker thread
+# records captcha/GDPR here and stooq() returns [INTERACTIVE],
+# main thread calls solve_pending() and asks again
+INTERACTIVE = "captcha required"
+# symbol request failed (not 200), nothing known about the window
+FAILED = "request failed"
+__pending__: Dict = {}
+# one session for whole process: keep-alive connections are reused
+# cookies are managed in header (set_header), so session jar stays empty
+__session__ = rq.Session()
+__session__.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+__session__.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+# ECB code lists change rarely
+EXR_STRUCT_TTL = 7 * 24 * 3600
 
 
 def stooq(
@@ -47,6 +72,9 @@ def stooq(
         symbol: symbol name
         from_date: start date for search, is ignored for sector search
         end_date: end date for search, is ignored for sector search
+    Returns [INTERACTIVE] if captcha/GDPR hit in worker thread,
+    solve_pending() in main thread and call again
+    Returns [FAILED] if symbol request failed (empty: no quotes in window)
     """
     data = pd.DataFrame([""])
     # convert dates
@@ -60,18 +88,20 @@ def stooq(
         # f: show/hide favourite column
         # l: page number for very long tables (table has max 100 rows)
         # u: show/hide if change empty (not rated today)
-        data = __scrap_stooq__(url)
+        data, _ = __scrap_cached__(url)
         if sector_grp != "":
             data = __split_groups__(data, sector_grp)
 
     elif symbol:  # or we search particular item
         url = f"https://stooq.com/q/d/l/?s={symbol}&d1={from_dateS}&d2={to_dateS}&l=%page%&i=d"
         # i: download data as csv
-        data = __scrap_stooq__(url, n=2)
+        data, complete = __scrap_cached__(url, n=2, to_date=to_date)
+        if data.empty and not complete:
+            data = pd.DataFrame([FAILED])
     elif component:
         url = f"https://stooq.com/q/i/?s={component}&i=0&l=%page%"
         # i: show indicators
-        data = __scrap_stooq__(url)
+        data, _ = __scrap_cached__(url)
 
     return data
 
@@ -93,52 +123,151 @@ def ecb(
     <Dimension EXR_SUFFIX>,
     <TimeDimension TIME_PERIOD>
     """
-    if symbol == "EUR":
-        date_range = pd.date_range(from_date, end_date)
-        dat = pd.DataFrame({"date": date_range, "val": 1})
-        dat.date = dat.date.dt.date
-        return dat
-    ecb = sdmx.Request("ECB")
-
-    # available symbols
-    exrDSD = ecb.dataflow("EXR").dataflow.EXR.structure  # type: ignore
-    exrCMP = exrDSD.dimensions.components
-    all_symbols = sdmx.to_pandas(
-        exrCMP[1].local_representation.enumerated
-    ).index.to_list()
-    if symbol not in all_symbols:
-        print(f"Unknonw symbol: '{symbol}'")
-        return pd.DataFrame([""])
-
-    key = ".".join(["D", symbol, "", "", ""])  # D stands for daily
+    return ecb_batch(from_date, end_date, [symbol])[symbol]
+
+
+def ecb_batch(from_date: dt, end_date: dt, symbols: List[str]) -> Dict[str, pd.DataFrame]:
+    """as ecb(), but many currencies with one request (key 'D.USD+PLN+...')
+    returns {symbol: DataFrame[date, val]}
+    """
+    resp = {}
+    missing = []
+    for symbol in dict.fromkeys(symbols):
+        if symbol == "EUR":
+            date_range = pd.date_range(from_date, end_date)
+            dat = pd.DataFrame({"date": date_range, "val": 1})
+            dat.date = dat.date.dt.date
+            resp[symbol] = dat
+            continue
+        dat = cache.get(__ecb_key__(from_date, end_date, symbol))
+        if dat is not None:
+            resp[symbol] = dat
+        elif symbol not in __exr_symbols__():
+            print(f"Unknonw symbol: '{symbol}'")
+            resp[symbol] = pd.DataFrame([""])
+        else:
+            missing.append(symbol)
+    if not missing:
+        return resp
+
+    key = ".".join(["D", "+".join(missing), "", "", ""])  # D stands for daily
     params = {
         "startPeriod": dt.strftime(from_date, "%Y-%m-%d"),
         "endPeriod": dt.strftime(end_date, "%Y-%m-%d"),
     }
-    datEXR = ecb.data("EXR", key=key, params=params)
+    import pandasdmx as sdmx
+
+    datEXR = __ecb_request__().data("EXR", key=key, params=params)
     dat = sdmx.to_pandas(datEXR).reset_index()
+    split = split_currency(dat)
+    for symbol in missing:
+        resp[symbol] = split.get(symbol, pd.DataFrame(columns=["date", "val"]))
+        cache.put(
+            __ecb_key__(from_date, end_date, symbol),
+            resp[symbol],
+            to_date=__day__(end_date),
+        )
+    return resp
+
+
+def split_currency(dat: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """split SDMX EXR data (as from sdmx.to_pandas().reset_index())
+    into {currency: DataFrame[date, val]}
+    """
+    dat = dat.rename(columns={"TIME_PERIOD": "date", "value": "val"})
+    dat["date"] = pd.to_datetime(dat["date"]).dt.date
+    return {
+        str(cur): d[["date", "val"]].reset_index(drop=True)
+        for cur, d in dat.groupby("CURRENCY", sort=False)
+    }
+
+
+def __ecb_key__(from_date: dt, end_date: dt, symbol: str) -> str:
+    return f"ECB/EXR/D.{symbol}/{from_date:%Y-%m-%d}/{end_date:%Y-%m-%d}"
+
 
-    # df cleaning
-    dat["TIME_PERIOD"] = pd.to_datetime(dat["TIME_PERIOD"]).dt.date
-    dat.rename(columns={"TIME_PERIOD": "date", "value": "val"}, inplace=True)
-    return dat[["date", "val"]]
+@lru_cache(maxsize=1)
+def __ecb_request__() -> "sdmx.Request":
+    import pandasdmx as sdmx
+
+    return sdmx.Request("ECB")
+
+
+@lru_cache(maxsize=1)
+def __exr_symbols__() -> List[str]:
+    """currencies available in ECB EXR dataflow
+    kept for process and on disk (EXR_STRUCT_TTL)
+    """
+    key = "ECB/EXR/structure/CURRENCY"
+    symbols = cache.get(key)
+    if symbols is None:
+        import pandasdmx as sdmx
+
+        exrDSD = __ecb_request__().dataflow("EXR").dataflow.EXR.structure  # type: ignore
+        exrCMP = exrDSD.dimensions.components
+        symbols = pd.DataFrame(
+            {
+                "symbol": sdmx.to_pandas(
+                    exrCMP[1].local_representation.enumerated
+                ).index.to_list()
+            }
+        )
+        cache.put(key, symbols, ttl_sec=EXR_STRUCT_TTL)
+    return symbols["symbol"].to_list()
 
 
-def __captcha__(page: bs) -> bool:
+class __Interactive__(Exception):
+    """captcha or GDPR hit in worker thread, left to main thread"""
+
+
+def __captcha__(page: "bs", gen: int) -> bool:
     # check if we have captcha
     # captcha is trigered with bandwith limit or hit limit
-    global header
-    
     if all(
         page.find(string=txt) is None
         for txt in ["The data has been hidden", "Dane zostały ukryte"]
     ):
         return False
+    __interactive_once__(kind="captcha", url="", gen=gen)
+    return True
+
+
+def __interactive_once__(kind: str, url: str, gen: int):
+    # solve captcha/GDPR only in one thread, skip if cookies renewed meanwhile
+    # worker thread only records it for main thread (see solve_pending())
+    global __session_gen__
+    with __interactive__:
+        if gen != __session_gen__:
+            return
+        if threading.current_thread() is not threading.main_thread():
+            __pending__.update(kind=kind, url=url, gen=gen)
+            raise __Interactive__(kind)
+        __pending__.clear()
+        if kind == "GDPR":
+            asyncio.run(__GDPR__(url=url))
+            __session_gen__ += 1
+        else:
+            __solve_captcha__()
+
+
+def solve_pending() -> None:
+    """solve captcha/GDPR hit by worker threads (stooq() returned [INTERACTIVE])
+    must be called from main thread, nothing to do if already solved
+    """
+    with __interactive__:
+        pending = __pending__.copy()
+    if pending:
+        __interactive_once__(**pending)
+
+
+def __solve_captcha__():
+    global header, __session_gen__
+    from PIL import Image
 
     while True:
         # display captcha
         url = f"https://stooq.com/q/l/s/i/?{int(time.time()*1000)}"
-        resp = rq.get(url=url, headers=header)
+        resp = __get__(url=url, headers=header)
         header = set_header(
             file=STOOQ_HEADER,
             upd_header={"cookie": resp.headers.get("set-cookie", "")},
@@ -152,14 +281,15 @@ def __captcha__(page: bs) -> bool:
             sys.exit(f"\nFATAL: user interuption")
 
         url = f"https://stooq.com/q/l/s/?t={captcha_txt}"
-        resp = rq.get(url=url, headers=header)
+        resp = __get__(url=url, headers=header)
         header = set_header(
             file=STOOQ_HEADER,
             upd_header={"cookie": resp.headers.get("set-cookie", "")},
         )
 
         if resp.content:
-            return True
+            __session_gen__ += 1
+            return
         print("captcha not accepted, try again")
 
 
@@ -168,6 +298,8 @@ async def __GDPR__(url: str):
     # GDPR stands for: GeneralDataProtectionRegulation
     # simulate browser behaviour: click consent button
     # to collect all headers, but more important cookies
+    from playwright.async_api import async_playwright
+
     print("Setting https connection...\n")
 
     # we need to install playwright for the first time
@@ -220,21 +352,57 @@ async def __GDPR__(url: str):
         await page.reload()
 
 
-def __scrap_stooq__(url: str, n=100) -> pd.DataFrame:
+def __scrap_cached__(
+    url: str, n=100, to_date: Union[date, None] = None
+) -> Tuple[pd.DataFrame, bool]:
+    """__scrap_stooq__ with response cache (to_date=None: current data)
+    only complete responses are cached, [INTERACTIVE] (not complete)
+    if captcha/GDPR hit in worker thread
+    returns (data, complete)"""
+    key = cache.normalize_url(url)
+    dat = cache.get(key)
+    if dat is not None:
+        return dat, True
+    try:
+        dat, complete = __scrap_stooq__(url, n=n)
+    except __Interactive__:
+        return pd.DataFrame([INTERACTIVE]), False
+    if complete:
+        cache.put(key, dat, to_date=to_date)
+    return dat, complete
+
+
+def __day__(d: Union[dt, date]) -> date:
+    return d.date() if isinstance(d, dt) else d
+
+
+def __get__(url: str, **kwargs) -> rq.Response:
+    """GET with shared session, waits for rate limit of the host"""
+    rate_limit(urlparse(url).netloc).acquire()
+    return __session__.get(url=url, **kwargs)
+
+
+def __scrap_stooq__(url: str, n=100) -> Tuple[pd.DataFrame, bool]:
+    """all pages of url (%page% replaced with page number)
+    returns (data, complete), not complete if any page failed
+    (data has pages read before, or ["asset removed"] if redirected)"""
     global header
+    from bs4 import BeautifulSoup as bs
+
     blank_header=False
     data = pd.DataFrame()
     for i in range(1, n):
         urli = re.sub("%page%", str(i), url).lower()
         while True:
-            resp = rq.get(url=urli, headers=header, allow_redirects=False)
+            gen = __session_gen__
+            resp = __get__(url=urli, headers=header, allow_redirects=False)
 
             if resp.status_code != 200:
                 if resp.status_code == 302:  # redirection
                     # means the asset no longer available
                     # remove from DB as not usefulle to predict future anymore
-                    data = pd.DataFrame(["asset removed"])
-                return data
+                    return pd.DataFrame(["asset removed"]), False
+                return __clean_tab__(data), False
             # set cooki
             # for the first time just write basc header and try again
             if header=={}:
@@ -253,11 +421,11 @@ def __scrap_stooq__(url: str, n=100) -> pd.DataFrame:
                 # GDPR dialog
                 # when no cookies present, first time use
                 # will set proper headers and cookies
-                asyncio.run(__GDPR__(url=urli))
+                __interactive_once__(kind="GDPR", url=urli, gen=gen)
                 continue
 
             # do we have captcha?
-            if __captcha__(page):
+            if __captcha__(page, gen):
                 continue
             break
 
@@ -273,7 +441,7 @@ def __scrap_stooq__(url: str, n=100) -> pd.DataFrame:
             break
 
         data = pd.concat([data, pdTab], ignore_index=True)
-    return __clean_tab__(data)
+    return __clean_tab__(data), True
 
 
 def __clean_tab__(pdTab: pd.DataFrame) -> pd.DataFrame:
@@ -350,6 +518,9 @@ def __captcha_gui__() -> str:
     Displays a GUI with a captcha pic
     and a text box to enter the answer
     """
+    import tkinter as tk
+    from PIL import Image, ImageTk
+
     ans = ""
 
     def submit(txt):
@@ -0,0 +1,155 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, Union
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import pandas as pd
+from cachetools import TLRUCache
+from shelved_cache import PersistentCache
+
+"""cache for web responses (stooq pages, ECB series)
+kept in memory and on disk (shelve), so survives crash or restart
+    - windows fully in the past never change: kept until evicted
+    - windows including today: kept for TTL_TODAY seconds
+size limited to MAX_BYTES (least recently used removed first)
+"""
+
+CACHE_FILE = "./assets/web_cache"
+MAX_BYTES = 256 * 2**20
+TTL_TODAY = 15 * 60
+# window ending at least HISTORY_LAG days ago is historical
+# (gives time for last sessions to be published)
+HISTORY_LAG = 2
+
+__lock__ = threading.Lock()
+__cache__: Union[PersistentCache, None] = None
+__stats__ = {"hits": 0, "misses": 0}
+
+
+class __Shelved__(PersistentCache):
+    # python hash() of str changes between processes,
+    # so entries saved by other run could not be removed from disk
+    @staticmethod
+    def hash_key(key):
+        return hashlib.md5(str(key).encode("utf-8")).hexdigest()
+
+
+def __ttu__(key, value, now) -> float:
+    # value is (stored, ttl, data), so expiry is the same after reload from disk
+    stored, ttl, _ = value
+    return stored + ttl
+
+
+def __sizeof__(value) -> int:
+    dat = value[2]
+    return int(dat.memory_usage(deep=True).sum()) + 1
+
+
+def __open__() -> PersistentCache:
+    global __cache__
+    if __cache__ is None:
+        __cache__ = __Shelved__(
+            TLRUCache,
+            CACHE_FILE,
+            maxsize=MAX_BYTES,
+            ttu=__ttu__,
+            timer=time.time,
+            getsizeof=__sizeof__,
+        )
+        __cache__.initialize_if_not_initialized()
+        # expired entries are skipped when loading, remove them also from disk
+        disk = __cache__.persistent_dict
+        if disk is not None:
+            for hkey in [h for h, (k, _) in disk.items() if k not in __cache__.wrapped]:
+                del disk[hkey]
+            disk.sync()
+    return __cache__
+
+
+def configure(file=CACHE_FILE, max_bytes=MAX_BYTES, ttl_today=TTL_TODAY) -> None:
+    """change cache file, size or TTL
+    file='' keeps cache only in memory
+    """
+    global __cache__, CACHE_FILE, MAX_BYTES, TTL_TODAY
+    with __lock__:
+        if __cache__ is not None:
+            __cache__.close()
+            __cache__ = None
+        CACHE_FILE, MAX_BYTES, TTL_TODAY = file, max_bytes, ttl_today
+
+
+def normalize_url(url: str) -> str:
+    """same url regardless of letter case of host or order of parameters"""
+    u = urlparse(url)
+    query = urlencode(sorted(parse_qsl(u.query, keep_blank_values=True)), safe="%")
+    return urlunparse(
+        (u.scheme.lower(), u.netloc.lower(), u.path, u.params, query, "")
+    )
+
+
+def ttl(to_date: Union[date, None]) -> float:
+    """seconds to keep response for window ending at to_date
+    None means current data (i.e. listings)
+    """
+    if to_date is None:
+        return TTL_TODAY
+    if to_date <= date.today() - timedelta(days=HISTORY_LAG):
+        return math.inf
+    return TTL_TODAY
+
+
+def cached(
+    key: str, fetch: Callable[[], pd.DataFrame], to_date: Union[date, None] = None
+) -> pd.DataFrame:
+    """return response for key from cache or call fetch() and store result
+    empty responses are not stored
+    Args:
+        key: i.e. normalized url
+        fetch: function getting the data from web
+        to_date: end of requested window, decides TTL
+    """
+    dat = get(key)
+    if dat is None:
+        dat = fetch()
+        put(key, dat, to_date)
+    return dat
+
+
+def get(key: str) -> Union[pd.DataFrame, None]:
+    """cached response for key or None"""
+    with __lock__:
+        hit = __open__().get(key)
+        __stats__["hits" if hit is not None else "misses"] += 1
+    return None if hit is None else hit[2].copy()
+
+
+def put(
+    key: str,
+    dat: pd.DataFrame,
+    to_date: Union[date, None] = None,
+    ttl_sec: Union[float, None] = None,
+) -> None:
+    """store response for key, TTL from to_date (see ttl()) or ttl_sec
+    empty responses are not stored
+    """
+    if dat.empty:
+        return
+    with __lock__:
+        try:
+            __open__()[key] = (
+                time.time(),
+                ttl(to_date) if ttl_sec is None else ttl_sec,
+                dat.copy(),
+            )
+        except ValueError:
+            pass  # bigger than whole cache
+
+
+def stats() -> Dict[str, int]:
+    """hits, misses, entries and size of cache"""
+    with __lock__:
+        c = __open__()
+        return {**__stats__, "entries": len(c.wrapped), "bytes": int(c.currsize)}
@@ -0,0 +1,295 @@
+import hashlib
+import inspect
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from workers import sql, resample
+from workers.common import read_json
+
+"""candle patterns for many symbols at once
+all symbols are resampled (see resample.py) into one contiguous OHLC array:
+each symbol gets a block covering all its periods (empty periods are NaN),
+blocks are separated with NaN padding, so shift() and rolling() used by
+technical_analysis.candles never reach other symbol
+    [pad | symbol A periods | pad | symbol B periods | ...]
+every pattern is called once for whole array
+
+indicator of each period is cached in CANDLES table, keyed by
+(symbol, period, digest of pattern file). Only periods from the last cached
+one are recalculated (with enough earlier periods for pattern lookback)
+"""
+
+# periods used by pattern besides its int arguments (i.e. shift(2))
+MIN_DEPTH = 5
+# ordinal of cached date which is not a period label (smaller than any period)
+NO_PERIOD = np.iinfo(np.int64).min
+
+__patterns__: Dict[Tuple[str, int], Tuple[str, List[Tuple]]] = {}
+
+
+def patterns(file: str) -> List[Tuple]:
+    """candle patterns from json file as [(name, function, kwargs, ind, depth)]
+    depth is number of periods pattern looks back
+    kept until file modification time changes
+    """
+    return __load__(file)[1]
+
+
+def digest(file: str) -> str:
+    """md5 of candle pattern file"""
+    return __load__(file)[0]
+
+
+def __load__(file: str) -> Tuple[str, List[Tuple]]:
+    try:
+        key = (file, os.stat(file).st_mtime_ns)
+    except OSError:
+        raise Exception(f"FATAL: '{file}' is missing")
+    if key not in __patterns__:
+        from technical_analysis import candles
+
+        cps = []
+        for cp, cv in read_json(file=file).items():
+            func = getattr(candles, cp)
+            kwargs = cv.get("kwargs", {})
+            cps.append((cp, func, kwargs, cv["ind"], __depth__(func, kwargs)))
+        with open(file, "rb") as f:
+            __patterns__[key] = (hashlib.md5(f.read()).hexdigest(), cps)
+    return __patterns__[key]
+
+
+def __depth__(func, kwargs: Dict) -> int:
+    # patterns nest lookbacks (i.e. trend over 'lookback' of shifted candles),
+    # so sum of all int arguments is safe bound
+    args = inspect.signature(func).bind_partial(**kwargs)
+    args.apply_defaults()
+    ints = [
+        v for v in args.arguments.values() if isinstance(v, int) and not isinstance(v, bool)
+    ]
+    return sum(ints) + MIN_DEPTH
+
+
+def candle_pattern(
+    dat: pd.DataFrame,
+    date_period: str,
+    file: str,
+    cp_cols: Dict[str, str],
+    db_file="",
+) -> pd.DataFrame:
+    """add candle pattern columns to dat (sorted by symbol and date)
+    the same as resampling each symbol separately and merging back with merge_asof:
+    each row gets value of last period starting (labeled) not later than row date
+    Args:
+        dat: DataFrame with symbol, date (datetime), open, high, low, val, vol
+        date_period: daily, weekly, monthly, quarterly
+        file: json with candle patterns {name: {"ind": x, "kwargs": {}}}
+        cp_cols: {"CP": cumulated indicator column, "CF": formation column}
+        db_file: sql file with CANDLES cache, no cache if empty
+    """
+    per = resample.period(date_period)
+    if not per:
+        print(f"Wrong date_period '{date_period}'. Possible: {list(resample.PERIODS)}")
+        return dat
+    cps = patterns(file)
+    pad = 2 * max([cp[4] for cp in cps], default=MIN_DEPTH)
+    panel = __panel__(dat, per, pad)
+    if db_file:
+        inc, form = __cached__(panel, cps, pad, db_file, per, digest(file))
+    else:
+        inc, form = __evaluate__(panel, cps)
+    # cumulated separately for each symbol (the same float rounding as per symbol)
+    ind = pd.Series(inc).groupby(panel["block"]).cumsum().to_numpy()
+
+    dat = dat.sort_values(by=["symbol", "date"], ignore_index=True)
+    # last period labeled not later than the row date
+    code = pd.Index(panel["symbols"]).get_indexer(dat["symbol"])
+    k = resample.ordinal(dat["date"], per)
+    k -= resample.label(k, per) > dat["date"].to_numpy(dtype="datetime64[ns]")
+    first = panel["first"][code]
+    matched = (code >= 0) & (k >= first)
+    pos = np.where(matched, panel["start"][code] + pad + k - first, 0)
+    names = np.array([cp[0] for cp in cps] + [""], dtype=object)
+
+    cp = pd.Series(ind[pos], index=dat.index)
+    if not matched.all():
+        # the same dtype as after merge_asof with missing rows
+        cp = cp.astype(float).where(matched).fillna(0)
+    dat[cp_cols["CP"]] = cp
+    dat[cp_cols["CF"]] = np.where(matched, names[form[pos]], "")
+    return dat
+
+
+def __panel__(dat: pd.DataFrame, per: str, pad: int) -> Dict:
+    """OHLC of all symbols in one padded array
+    returns dict with:
+        open, high, low, val: arrays, NaN in empty periods and padding
+        block: symbol number for each position (-1 for padding)
+        symbols: sorted symbols
+        first, last: first and last period (ordinal) of symbol
+        start: start of symbol block (before padding)
+    """
+    grp = resample.groups(dat, per)
+    code, ordn, symbols = grp["code"], grp["ordinal"], grp["symbols"]
+    first, last = resample.bounds(code, ordn, len(symbols))
+    size = last - first + 1 + pad
+    start = np.concatenate([[0], np.cumsum(size)[:-1]])
+    pos = start[code] + pad + ordn - first[code]
+
+    panel = {
+        "symbols": np.asarray(symbols),
+        "first": first,
+        "last": last,
+        "start": start,
+        "block": np.repeat(np.arange(len(symbols)), size),
+    }
+    for c in ["open", "high", "low", "val"]:
+        arr = np.full(size.sum(), np.nan)
+        arr[pos] = grp[c]
+        panel[c] = arr
+    # padding at the beginning of each block
+    offset = np.arange(size.sum()) - np.repeat(start, size)
+    panel["block"][offset < pad] = -1
+    return panel
+
+
+def __evaluate__(panel: Dict, cps: List[Tuple]) -> Tuple[np.ndarray, np.ndarray]:
+    # indicator of each period and last recognized pattern (index in cps, -1 none)
+    o, h, l, c = (pd.Series(panel[col]) for col in ["open", "high", "low", "val"])
+    dtype = np.asarray([0] + [cp[3] for cp in cps]).dtype
+    inc = np.zeros(len(o), dtype=dtype)
+    form = np.full(len(o), -1)
+    for n, (_, func, kwargs, ind, _) in enumerate(cps):
+        rows = func(open=o, low=l, high=h, close=c, **kwargs)
+        rows = np.asarray(rows.to_numpy(dtype=bool, na_value=False))
+        inc[rows] += ind
+        form[rows] = n
+    pad = panel["block"] < 0
+    inc[pad] = 0
+    form[pad] = -1
+    return inc, form
+
+
+def __cached__(
+    panel: Dict, cps: List[Tuple], pad: int, db_file: str, period: str, dig: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    # __evaluate__ with CANDLES cache
+    # periods before the last cached one are taken from cache, if cache starts
+    # with the same period and sum of close before last cached period is the same
+    # (data not changed). Rest is recalculated, with 'pad' earlier periods for lookback
+    symbols = panel["symbols"]
+    first, last, start = panel["first"], panel["last"], panel["start"]
+    dtype = np.asarray([0] + [cp[3] for cp in cps]).dtype
+    inc = np.zeros(len(panel["block"]), dtype=dtype)
+    form = np.full(len(panel["block"]), -1)
+    names = np.array([cp[0] for cp in cps] + [""], dtype=object)
+    # sum of close from first period of symbol, padding adds 0.0 (exact)
+    csum = pd.Series(np.nan_to_num(panel["val"])).groupby(panel["block"]).cumsum()
+    csum = csum.to_numpy()
+
+    def checksum(code: np.ndarray, k: np.ndarray) -> np.ndarray:
+        # sum of close of periods before k
+        inside = (k > first[code]) & (k <= last[code])
+        p = np.where(inside, start[code] + pad + k - first[code] - 1, 0)
+        return np.where(inside, csum[p], 0.0)
+
+    state = sql.candles_state(db_file, list(symbols), period, dig)
+    code = pd.Index(symbols).get_indexer(state["symbol"])
+    state, code = state.loc[code >= 0], code[code >= 0]
+    k_from = __ordinal__(state["from_date"], period)
+    k_to = __ordinal__(state["to_date"], period)
+    ok = (k_from == first[code]) & (k_to >= first[code]) & (k_to <= last[code])
+    ok &= checksum(code, k_to) == state["checksum"].to_numpy(dtype=float)
+    # first period to recalculate
+    from_ = first.copy()
+    from_[code[ok]] = k_to[ok]
+    # cached up to last period, so only last period is recalculated
+    same = np.zeros(len(symbols), dtype=bool)
+    same[code[ok]] = k_to[ok] == last[code[ok]]
+
+    stored = sql.candles(db_file, list(symbols[(from_ > first) | same]), period, dig)
+    code = pd.Index(symbols).get_indexer(stored["symbol"])
+    k = __ordinal__(stored["date"], period)
+    # stored periods which are recalculated
+    again = code >= 0
+    again[again] &= k[again] >= from_[code[again]]
+    use = code >= 0
+    use[use] &= (k[use] >= first[code[use]]) & (k[use] < from_[code[use]])
+    pos = start[code[use]] + pad + k[use] - first[code[use]]
+    inc[pos] = stored["ind"].to_numpy()[use].astype(dtype)
+    form_idx = {n: i for i, n in enumerate(names[:-1])}
+    form[pos] = stored["formation"].map(form_idx).fillna(-1).to_numpy(dtype=int)[use]
+
+    # recalculate from 'from_' (and 'pad' periods before)
+    c = np.maximum(first, from_ - pad)
+    m = last - c + 1
+    sym = np.repeat(np.arange(len(symbols)), m)
+    off = np.arange(m.sum()) - np.repeat(np.cumsum(m) - m, m)
+    start2 = np.concatenate([[0], np.cumsum(m + pad)[:-1]])
+    src = start[sym] + pad + (c - first)[sym] + off
+    dst = start2[sym] + pad + off
+    sub = {"block": np.full((m + pad).sum(), -1)}
+    sub["block"][dst] = sym
+    for col in ["open", "high", "low", "val"]:
+        sub[col] = np.full(len(sub["block"]), np.nan)
+        sub[col][dst] = panel[col][src]
+    inc2, form2 = __evaluate__(sub, cps)
+    new = c[sym] + off >= from_[sym]
+    inc[src[new]] = inc2[dst[new]]
+    form[src[new]] = form2[dst[new]]
+
+    # last period may be incomplete, so is always recalculated
+    n = np.arange(len(symbols))
+    state = pd.DataFrame(
+        {
+            "symbol": symbols,
+            "from_date": __date__(first, period),
+            "to_date": __date__(last, period),
+            "checksum": checksum(n, last),
+            "recalc_date": __date__(from_, period),
+        }
+    )
+    w = new & ((inc[src] != 0) | (form[src] >= 0))
+    rows = pd.DataFrame(
+        {
+            "symbol": symbols[sym[w]],
+            "date": __date__((c[sym] + off)[w], period),
+            "ind": inc[src[w]],
+            "formation": names[form[src[w]]],
+        }
+    )
+    if same.all() and __unchanged__(stored.loc[again], rows):
+        # nothing to write, i.e. get() of data already cached
+        return inc, form
+    sql.put_candles(rows, state, db_file, period, dig)
+    return inc, form
+
+
+def __unchanged__(old: pd.DataFrame, new: pd.DataFrame) -> bool:
+    # the same rows [symbol, date, ind, formation] (in any order)
+    if len(old) != len(new):
+        return False
+    cols = ["symbol", "date", "ind", "formation"]
+    old, new = (
+        d.loc[:, cols]
+        .assign(date=pd.to_datetime(d["date"]))
+        .sort_values(["symbol", "date"], ignore_index=True)
+        for d in [old, new]
+    )
+    return all((old[c].to_numpy() == new[c].to_numpy()).all() for c in cols)
+
+
+def __ordinal__(dates: pd.Series, per: str) -> np.ndarray:
+    # period of period labels, NO_PERIOD if not a label
+    if dates.empty:
+        return np.array([], dtype=np.int64)
+    dates = pd.to_datetime(dates).to_numpy(dtype="datetime64[ns]")
+    k = resample.ordinal(dates, per)
+    return np.where(resample.label(k, per) == dates, k, NO_PERIOD)
+
+
+def __date__(ordn: np.ndarray, per: str) -> np.ndarray:
+    # label of periods as date
+    return pd.DatetimeIndex(resample.label(ordn, per)).date
@@ -1,12 +1,16 @@
-import locale
+import os
+import copy
+import atexit
 import json
 import sys
 import hashlib
+import threading
+import time
 from typing import Dict, Union, Tuple
 import re
 import pandas as pd
 
-from contextlib import contextmanager
+from functools import lru_cache
 
 from datetime import date, timedelta
 from datetime import datetime as dt
@@ -15,9 +19,28 @@ import json
 from json import JSONDecodeError
 
 
+# parsed json files: {path: (mtime, content)}
+__json_cache__: Dict[str, Tuple[int, Dict]] = {}
+
+
 def read_json(file: str) -> Dict:
     """read json file
-    ignores comments: everything from '//**' to eol"""
+    ignores comments: everything from '//**' to eol
+    parsed file is cached until file modification time changes
+    """
+    try:
+        mtime = os.stat(file).st_mtime_ns
+    except OSError:
+        raise Exception(f"FATAL: '{file}' is missing")
+    cached = __json_cache__.get(file)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, __parse_json__(file))
+        __json_cache__[file] = cached
+    # callers are free to modify returned dict
+    return copy.deepcopy(cached[1])
+
+
+def __parse_json__(file: str) -> Dict:
     try:
         with open(file, "r") as f:
             json_f = re.sub(
@@ -34,10 +57,88 @@ def read_json(file: str) -> Dict:
         raise Exception(f"FATAL: '{file}' json parse error.")
 
 
+# header file is process wide, so guard it when used from threads
+__header_lock__ = threading.Lock()
+# headers (with cookies) kept in memory: {file: header}
+# written to file at most every HEADER_FLUSH seconds and at exit
+__headers__: Dict[str, Dict] = {}
+__headers_dirty__: Dict[str, float] = {}  # {file: time of first unsaved change}
+HEADER_FLUSH = 30
+# rate limits per host: {host: RateLimit}
+__limits__: Dict[str, "RateLimit"] = {}
+
+
+class RateLimit:
+    """token bucket: 'rate' requests per second, up to 'burst' at once
+    thread safe: acquire() blocks until token is available
+    rate <= 0 means no limit
+    """
+
+    def __init__(self, rate: float, burst=1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            # reserve token, even if not yet available: waiting threads queue up
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def rate_limit(host: str, rate: Union[float, None] = None, burst=1) -> RateLimit:
+    """shared RateLimit for host (created with rate=1/s if missing)
+    if rate is given, limit is updated
+    """
+    with __header_lock__:
+        lim = __limits__.setdefault(host, RateLimit(rate or 1.0, burst))
+        if rate is not None:
+            lim.rate = rate
+            lim.burst = burst
+    return lim
+
+
 def set_header(file: str, upd_header={}) -> dict:
-    # read / write headers to file
-    # including cookies
-    header = read_json(file)
+    # read / update headers, including cookies
+    # kept in memory, file is updated by flush_headers()
+    with __header_lock__:
+        header = __headers__.get(file)
+        if header is None:
+            header = __headers__[file] = read_json(file)
+        if upd_header != {}:
+            __update_header__(header, upd_header)
+            __headers_dirty__.setdefault(file, time.monotonic())
+            if time.monotonic() - __headers_dirty__[file] > HEADER_FLUSH:
+                __flush_header__(file)
+        return dict(header)
+
+
+def flush_headers():
+    """write all changed headers to files"""
+    with __header_lock__:
+        for file in list(__headers_dirty__):
+            __flush_header__(file)
+
+
+atexit.register(flush_headers)
+
+
+def __flush_header__(file: str):
+    with open(file, "w") as f:
+        json.dump(__headers__[file], f)
+    __headers_dirty__.pop(file, None)
+
+
+def __update_header__(header: dict, upd_header: dict):
     cookies = header.get("cookie", "")
 
     def cookie2str(cookie: dict) -> str:
@@ -50,19 +151,12 @@ def set_header(file: str, upd_header={}) -> dict:
             k: v for k, v in [cookie.split("=", 1) for cookie in cookie.split("; ")]
         }
 
-    if upd_header != {}:
-        upd_cookies = upd_header.get("cookie", "")
-        header.update(upd_header)
-        # cookies we add, not override
-        c2d = cookie2dict(cookies)
-        c2d.update(cookie2dict(upd_cookies))
-        cookies = cookie2str(c2d)
-        header["cookie"] = cookies
-
-        with open(file, "w") as f:
-            json.dump({**header, **{"cookie": cookies}}, f)
-
-    return header
+    upd_cookies = upd_header.get("cookie", "")
+    header.update(upd_header)
+    # cookies we add, not override
+    c2d = cookie2dict(cookies)
+    c2d.update(cookie2dict(upd_cookies))
+    header["cookie"] = cookie2str(c2d)
 
 
 def biz_date(
@@ -86,62 +180,83 @@ def biz_date(
     return date_chk.date()
 
 
+# month names (english and polish), first 3 letters in lower case
+MONTHS = {
+    **{m: i + 1 for i, m in enumerate(["jan", "feb", "mar", "apr", "may", "jun",
+                                       "jul", "aug", "sep", "oct", "nov", "dec"])},
+    **{m: i + 1 for i, m in enumerate(["sty", "lut", "mar", "kwi", "maj", "cze",
+                                       "lip", "sie", "wrz", "paź", "lis", "gru"])},
+    "paz": 10,
+}
+
+
 def convert_date(dates: pd.Series) -> pd.Series:
     # set date: it's in 'mmm d'(ENG) or 'd mmm'(PL) or 'hh:ss' for today and some more
-    # return '' if format not known
-    @contextmanager
-    def setlocale(*args, **kwargs):
-        # temporary change locale
-        saved = locale.setlocale(locale.LC_ALL)
-        yield locale.setlocale(*args, **kwargs)
-        locale.setlocale(locale.LC_ALL, saved)
-
-    def date_locale(date: pd.Series, local: str, format: str) -> pd.Series:
-        with setlocale(locale.LC_ALL, local):  # type: ignore
-            return pd.to_datetime(date, errors="coerce", format=format)
-
-    year = dt.today().strftime("%Y")
-    today = dt.today().strftime("%d %b %Y ")
+    # formats: 'hh:mm' (today), 'd mmm', 'mmm d', 'd mmm yyyy', 'yyyy-mm-dd'
+    # month in english or polish, current year if missing
+    # one pass, no locale (so safe to use in threads)
+    # exit if format not known
+    today = date.today()
+    # same dates repeat, so parse only unique
+    codes, uniq = pd.factorize(dates.astype("string").str.strip(), use_na_sentinel=False)
+    txt = pd.Series(uniq, dtype="string")
+    month = r"(?P<mon>[^\W\d_]{3})[^\W\d_]*\.?"
+    year = r"(?:,?\s+(?P<year>\d{4}))?"
+    d_m = txt.str.extract(rf"^(?P<day>\d{{1,2}})\s+{month}{year}$")
+    m_d = txt.str.extract(rf"^{month}\s+(?P<day>\d{{1,2}}){year}$")
+    iso = txt.str.extract(r"^(?P<year>\d{4})-(?P<mon>\d{1,2})-(?P<day>\d{1,2})$")
+
+    ymd = pd.DataFrame(index=txt.index, columns=["year", "month", "day"], dtype=float)
+    for ext in [d_m, m_d]:
+        mon = ext["mon"].str.lower().map(MONTHS)
+        found = ymd["month"].isna() & mon.notna()
+        ymd.loc[found, "month"] = mon[found]
+        ymd.loc[found, "day"] = ext.loc[found, "day"].astype(float)
+        ymd.loc[found, "year"] = ext.loc[found, "year"].astype(float).fillna(today.year)
+    found = ymd["month"].isna() & iso["mon"].notna()
+    ymd.loc[found] = iso.loc[found, ["year", "mon", "day"]].astype(float).to_numpy()
+    # 'hh:mm' is today
+    found = txt.str.fullmatch(r"\d{1,2}:\d{2}").fillna(False).astype(bool)
+    ymd.loc[found] = [today.year, today.month, today.day]
     # ignore if no digits in date, probably group name
     # possibly also nan
-    dates = dates.apply(lambda x: x if not pd.isna(x) else "1 Sty 1900")
-    dates = dates.apply(lambda x: x if re.search(r"[0-9]", x) else "1 Sty 1900")
-
-    d1 = date_locale(today + " " + dates, "en_GB.utf8", r"%d %b %Y %H:%M")  # hh:ss
-    d2 = date_locale(year + " " + dates, "en_GB.utf8", r"%Y %d %b")  # 24 Feb
-    d3 = date_locale(year + " " + dates, "en_GB.utf8", r"%Y %b %d")  # Jan 22
-    d4 = date_locale(year + " " + dates, "en_GB.utf8", r"%Y %d %b")  # 25 Jan
-    d5 = date_locale(dates, "en_GB.utf8", r"%d %b %Y")  # 25 Jan 2023
-    d6 = date_locale(year + " " + dates, "pl_PL.utf8", r"%Y %d %b")  # 22 Lut
-    d7 = date_locale(dates, "pl_PL.utf8", r"%d %b %Y")  # 22 Lut 2023
-    d8 = date_locale(dates, "pl_PL.utf8", r"%Y-%m-%d")  # 2023-10-20
-
-    d1 = d1.fillna(d2)
-    d1 = d1.fillna(d3)
-    d1 = d1.fillna(d4)
-    d1 = d1.fillna(d5)
-    d1 = d1.fillna(d6)
-    d1 = d1.fillna(d7)
-    d1 = d1.fillna(d8)
-    d1 = d1.dt.date
-    d1 = d1.fillna(" ")
+    found = ~txt.str.contains(r"[0-9]").fillna(False).astype(bool)
+    ymd.loc[found] = [1900, 1, 1]
+
+    d1 = pd.Series(
+        pd.to_datetime(ymd, errors="coerce").to_numpy()[codes], index=dates.index
+    )
     # if date not recognized
-    if not d1.loc[d1 == " "].empty:
-        sys.exit(f'FATAL: date format not recognized:\n{dates.loc[d1==" "]}')
-    return d1
+    if d1.isna().any():
+        sys.exit(f"FATAL: date format not recognized:\n{dates.loc[d1.isna()]}")
+    return d1.dt.date.astype(object)
 
 
 def hash_table(dat: pd.DataFrame, tab: str) -> Union[pd.Series, None]:
+    """md5 of symbol+name+tab for each row
+    hashed are only unique (symbol, name) pairs, result is broadcasted
+    back to rows (index of dat is kept)
+    raises ValueError if symbol or name is missing in any row
+    """
     if not all(el in dat.columns for el in ["symbol", "name"]):
         print("no columns to hash")
         return None
-    d = dat.copy(deep=True)
-    d["tab"] = tab
-    d["hash"] = [
-        hashlib.md5("".join(r).encode("utf-8")).hexdigest()
-        for r in d.loc[:, ["symbol", "name", "tab"]].to_records(index=False)
-    ]
-    return d["hash"]
+    if dat.empty:
+        return pd.Series(index=dat.index, name="hash", dtype=object)
+    missing = dat.loc[:, ["symbol", "name"]].isna().any(axis=1)
+    if missing.any():
+        raise ValueError(
+            f"missing symbol or name, can't hash {tab} rows: {list(dat.index[missing][:5])}"
+        )
+    codes, uniq = pd.MultiIndex.from_frame(dat.loc[:, ["symbol", "name"]]).factorize()
+    hashes = pd.Series([__hash_key__(s, n, tab) for s, n in uniq], dtype=object)
+    return pd.Series(hashes.to_numpy()[codes], index=dat.index, name="hash")
+
+
+@lru_cache(maxsize=2**16)
+def __hash_key__(symbol: str, name: str, tab: str) -> str:
+    """memoized md5 of single key, same for whole process"""
+    return hashlib.md5((symbol + name + tab).encode("utf-8")).hexdigest()
 
 
 def read_currency(file: str) -> pd.DataFrame:
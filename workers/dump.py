@@ -0,0 +1,194 @@
+import io
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Union
+
+import pandas as pd
+
+from workers import sql
+from workers.common import hash_table
+
+"""load stooq bulk dumps (https://stooq.com/db/h/) into db
+dump is zip file (or unpacked directory) with one csv file per ticker:
+    <TICKER>,<PER>,<DATE>,<TIME>,<OPEN>,<HIGH>,<LOW>,<CLOSE>,<VOL>,<OPENINT>
+    KGH,D,20230102,000000,114.1,117.0,113.5,116.8,512345,0
+directory tells the table, i.e. 'data/daily/pl/wse stocks/kgh.txt'
+files are parsed in worker processes, written to db in main process
+"""
+
+# directory name ending -> table
+DUMP_TABS = {"stocks": "STOCK", "indices": "INDEXES", "etfs": "ETF"}
+DUMP_COLS = {
+    "<TICKER>": "symbol",
+    "<PER>": "per",
+    "<DATE>": "date",
+    "<OPEN>": "open",
+    "<HIGH>": "high",
+    "<LOW>": "low",
+    "<CLOSE>": "val",
+    "<VOL>": "vol",
+}
+
+
+def load(
+    source: str,
+    db_file: str,
+    allow_unknown=False,
+    workers: Union[int, None] = None,
+    batch=200,
+) -> Dict[str, int]:
+    """parse dump and write to db
+    name and country of symbol are taken from *_DESC table,
+    symbols not in db are skipped unless allow_unknown
+    (then name=symbol and country unknown)
+    Args:
+        source: zip file or directory
+        db_file: sql file
+        allow_unknown: add symbols not yet in db
+        workers: number of processes (defoult: number of cpus)
+        batch: files parsed by worker at once
+    returns rows loaded per table
+    """
+    from alive_progress import alive_bar
+
+    if not sql.check_sql(db_file):
+        return {}
+    files = dump_files(source)
+    if not files:
+        print(f"No stooq files in '{source}'")
+        return {}
+    desc = {tab: __desc__(db_file, tab) for tab in files}
+    unknown = sql.getL(
+        db_file=db_file, tab="GEO", get=["iso2"], search=["UNKNOWN"], where=["country"]
+    )
+    rows = {tab: 0 for tab in files}
+    start = time.perf_counter()
+    print(f"...loading {sum(len(f) for f in files.values())} files from {source}")
+    with ProcessPoolExecutor(max_workers=workers) as pool, alive_bar(
+        sum(len(f) for f in files.values())
+    ) as bar:
+        jobs = {
+            pool.submit(parse, source, names[i : i + batch]): (tab, len(names[i : i + batch]))
+            for tab, names in files.items()
+            for i in range(0, len(names), batch)
+        }
+        for job in as_completed(jobs):
+            tab, n = jobs[job]
+            dat = describe(
+                dat=job.result(),
+                tab=tab,
+                desc=desc[tab],
+                country=unknown[0] if allow_unknown and unknown else "",
+            )
+            if not dat.empty:
+                if not sql.put(dat=dat, tab=tab, db_file=db_file, upsert=True):
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    sys.exit(f"FATAL: wrong data in dump for '{tab}'")
+                rows[tab] += len(dat)
+            bar(n)
+    sec = time.perf_counter() - start
+    total = sum(rows.values())
+    print(f"{total} rows loaded in {sec:.1f}s ({total / max(sec, 1e-9):.0f} rows/s)")
+    return rows
+
+
+def dump_files(source: str) -> Dict[str, List[str]]:
+    """files in zip or directory grouped by table {tab: [files]}
+    files in not known directories are ignored
+    """
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as z:
+            names = [n for n in z.namelist() if not n.endswith("/")]
+    else:
+        names = [
+            os.path.join(root, f) for root, _, fs in os.walk(source) for f in fs
+        ]
+    files = {}
+    for name in sorted(names):
+        tab = dump_tab(name)
+        if tab and name.lower().endswith((".txt", ".csv")):
+            files.setdefault(tab, []).append(name)
+    return files
+
+
+def dump_tab(name: str) -> str:
+    """table for file, based on its directory ('' if unknown)"""
+    # big directories are split into numbered subdirectories ('nasdaq stocks/1/')
+    for part in reversed(name.replace("\\", "/").lower().split("/")[:-1]):
+        for k, tab in DUMP_TABS.items():
+            if part.endswith(k):
+                return tab
+    return ""
+
+
+def parse(source: str, names: List[str]) -> pd.DataFrame:
+    """read stooq files (from zip or directory) into one DataFrame
+    only daily data is kept, columns as in db
+    """
+    dats = []
+    z = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+    try:
+        for name in names:
+            f = io.BytesIO(z.read(name)) if z else name
+            try:
+                dat = pd.read_csv(f, dtype={"<TICKER>": str, "<PER>": str, "<DATE>": str})
+            except pd.errors.EmptyDataError:
+                continue
+            dats.append(dat.loc[:, [c for c in DUMP_COLS if c in dat.columns]])
+    finally:
+        if z:
+            z.close()
+    if not dats:
+        return pd.DataFrame()
+    dat = pd.concat(dats, ignore_index=True).rename(columns=DUMP_COLS)
+    if "per" in dat.columns:
+        dat = dat.loc[dat["per"] == "D"].drop(columns="per")
+    dat["symbol"] = dat["symbol"].str.upper()
+    dat["date"] = pd.to_datetime(dat["date"], format="%Y%m%d").dt.date
+    return dat.dropna(subset=["val"])
+
+
+def describe(dat: pd.DataFrame, tab: str, desc: pd.DataFrame, country="") -> pd.DataFrame:
+    """add description (as Trader.__describe_table__) from known *_DESC rows
+    from_date and to_date extended with existing, start_quote is first date in dump
+    Args:
+        desc: *_DESC rows [symbol, name, country, from_date, to_date]
+        country: iso2 for unknown symbols, if empty unknown symbols are skipped
+    """
+    if dat.empty:
+        return dat
+    dat = dat.merge(desc, how="left", on="symbol")
+    known = dat["name"].notna()
+    if not country:
+        dat = dat.loc[known].copy()
+    else:
+        dat.loc[~known, "name"] = dat.loc[~known, "symbol"]
+        dat.loc[~known, "country"] = country
+    if dat.empty:
+        return dat
+    dat["hash"] = hash_table(dat, tab)
+    dates = dat.groupby("hash")["date"]
+    first, last = dates.transform("min"), dates.transform("max")
+    dat["start_quote"] = first
+    dat["from_date"] = dat["from_date"].fillna(first)
+    dat["from_date"] = dat["from_date"].where(dat["from_date"] <= first, first)
+    dat["to_date"] = dat["to_date"].fillna(last)
+    dat["to_date"] = dat["to_date"].where(dat["to_date"] >= last, last)
+    dat["vol"] = dat.get("vol", pd.Series(0, index=dat.index)).fillna(0)
+    return dat
+
+
+def __desc__(db_file: str, tab: str) -> pd.DataFrame:
+    # one description per symbol
+    desc = sql.getDF(
+        db_file=db_file, tab=f"{tab}_DESC", search=["%"], where=["symbol"]
+    )
+    cols = ["symbol", "name", "country", "from_date", "to_date"]
+    if desc.empty:
+        return pd.DataFrame(columns=cols)
+    desc = desc.loc[:, cols]
+    desc["symbol"] = desc["symbol"].str.upper()
+    return desc.drop_duplicates(subset="symbol", keep="first")
@@ -0,0 +1,116 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from workers import sql
+
+"""currency rates kept in memory, per db
+all currencies denominated to EUR (as CURRENCY table), loaded once per
+currency and kept in dense array [date x currency], forward filled,
+so rate on any date is the last fixing before (as-of)
+currency is read again from db only after invalidate() (new rates stored)
+"""
+
+BASE = "EUR"
+
+
+def __of__(db_file: str) -> Dict:
+    """store of db_file:
+    {"series": {currency: (days, rates)}, days since EPOCH, sorted
+     "dense": (days, {currency: column}, rates) or None if not built}
+    kept in sql catalog, so reset when DB file is replaced
+    """
+    store = sql.cache_of(db_file, "fx")
+    store.setdefault("series", {})
+    store.setdefault("dense", None)
+    return store
+
+
+def invalidate(db_file: str, currencies: List[str]) -> None:
+    """forget rates of currencies (i.e. after put to CURRENCY table)"""
+    store = __of__(db_file)
+    for cur in currencies:
+        if store["series"].pop(str(cur).upper(), None) is not None:
+            store["dense"] = None
+
+
+def rates(db_file: str, currencies: List[str]) -> Tuple[np.ndarray, Dict[str, int], np.ndarray]:
+    """dense rates of all loaded currencies (loading missing ones from db)
+    returns:
+        days: sorted days (since EPOCH) with any fixing
+        columns: {currency: column in rates}, also BASE
+        rates: array [days x currencies], forward filled, NaN before first fixing
+            (and one more column of NaN for unknown currency)
+    """
+    store = __of__(db_file)
+    missing = {str(c).upper() for c in currencies} - set(store["series"]) - {BASE}
+    if missing:
+        hist = sql.currency_history(db_file=db_file, symbols=sorted(missing))
+        for cur in missing:
+            # also unknown currency, so db is not asked again
+            h = hist.loc[hist["symbol"] == cur].sort_values("day")
+            store["series"][cur] = (
+                h["day"].to_numpy(dtype=np.int64),
+                pd.to_numeric(h["val"], errors="coerce").to_numpy(dtype=float),
+            )
+        store["dense"] = None
+    if store["dense"] is None:
+        store["dense"] = __dense__(store["series"])
+    return store["dense"]
+
+
+def __dense__(series: Dict) -> Tuple[np.ndarray, Dict[str, int], np.ndarray]:
+    # union of fixing days, each currency forward filled
+    # first row (before any day) is NaN, BASE column is 1,
+    # last column (not in columns) is NaN for unknown currency
+    columns = {cur: n for n, cur in enumerate(sorted(series))}
+    columns[BASE] = len(columns)
+    days = [np.array([np.iinfo(np.int64).min])] + [d for d, _ in series.values()]
+    days = np.unique(np.concatenate(days))
+    dense = np.full((len(days), len(columns) + 1), np.nan)
+    for cur, (d, r) in series.items():
+        dense[np.searchsorted(days, d), columns[cur]] = r
+    dense = pd.DataFrame(dense).ffill().to_numpy()
+    dense[:, columns[BASE]] = 1.0
+    dense[:, -1] = np.nan
+    return days, columns, dense
+
+
+def factors(db_file: str, dates, cur_from, cur_to: List[str]) -> np.ndarray:
+    """multipliers converting values from cur_from to each of cur_to
+    rates are taken as of date (last fixing not later than date)
+    Args:
+        dates: date of each value
+        cur_from: currency of each value
+        cur_to: target currencies
+    returns array [values x cur_to], NaN if rate not known
+    """
+    cur_from = pd.Series(np.asarray(cur_from, dtype=object)).str.upper()
+    cur_to = [str(c).upper() for c in cur_to]
+    days, columns, dense = rates(db_file, list(cur_from.dropna().unique()) + cur_to)
+    day = np.asarray(pd.to_datetime(dates), dtype="datetime64[D]").astype(np.int64)
+    row = np.searchsorted(days, day, side="right") - 1
+    unknown = dense.shape[1] - 1
+    col_from = cur_from.map(columns).fillna(unknown).to_numpy(dtype=int)
+    col_to = np.array([columns.get(c, unknown) for c in cur_to], dtype=int)
+    return dense[row[:, None], col_to[None, :]] / dense[row, col_from][:, None]
+
+
+def convert(
+    db_file: str, dat: pd.DataFrame, cur_from, cur_to: List[str], cols: List[str]
+) -> Dict[str, pd.DataFrame]:
+    """values of cols converted to each of cur_to (one lookup for all)
+    Args:
+        dat: DataFrame with 'date' and cols
+        cur_from: currency of each row of dat
+    returns {currency: dat with converted cols}
+    """
+    fac = factors(db_file, dat["date"], cur_from, cur_to)
+    resp = {}
+    for n, cur in enumerate(cur_to):
+        d = dat.copy()
+        for col in [c for c in cols if c in d.columns]:
+            d[col] = pd.to_numeric(d[col], errors="coerce") * fac[:, n]
+        resp[str(cur).upper()] = d
+    return resp
@@ -0,0 +1,142 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+"""OHLCV of many symbols to longer periods in one pass
+each date is mapped to period number (ordinal), rows sorted by
+(symbol, ordinal) and aggregated with numpy reduceat on group boundaries
+periods are labeled as pandas resample does:
+    D - day, W - Sunday ending week, M - last day of month, Q - last day of quarter
+"""
+
+PERIODS = {"daily": "D", "weekly": "W", "monthly": "M", "quarterly": "Q"}
+OHLCV = ["open", "high", "low", "val", "vol"]
+# 1970-01-01 was Thursday, weeks start on Monday
+WEEK_SHIFT = 3
+
+
+def period(date_period: str) -> str:
+    """period letter (D, W, M, Q) for name or letter, '' if not known"""
+    p = PERIODS.get(date_period.lower(), date_period.upper())
+    return p if p in PERIODS.values() else ""
+
+
+def ordinal(dates, per: str) -> np.ndarray:
+    """number of period (D, W, M, Q) for each date"""
+    days = np.asarray(pd.to_datetime(dates), dtype="datetime64[D]")
+    if per == "D":
+        return days.astype(np.int64)
+    if per == "W":
+        return (days.astype(np.int64) + WEEK_SHIFT) // 7
+    months = days.astype("datetime64[M]").astype(np.int64)
+    return months if per == "M" else months // 3
+
+
+def label(ordn: np.ndarray, per: str) -> np.ndarray:
+    """label (datetime64) of period numbers: the day, or last day of period"""
+    ordn = np.asarray(ordn, dtype=np.int64)
+    if per == "D":
+        days = ordn.astype("datetime64[D]")
+    elif per == "W":
+        days = (ordn * 7 - WEEK_SHIFT + 6).astype("datetime64[D]")
+    else:
+        months = ordn + 1 if per == "M" else (ordn + 1) * 3
+        days = months.astype("datetime64[M]").astype("datetime64[D]") - 1
+    return days.astype("datetime64[ns]")
+
+
+def groups(dat: pd.DataFrame, per: str) -> Dict:
+    """aggregate OHLCV dat[symbol, date, open, high, low, val, vol] per symbol and period
+    (only periods with rows), duplicated rows are counted once
+    returns dict with:
+        symbols: sorted symbols
+        code: symbol number, ordinal: period number (sorted by both)
+        open, high, low, val, vol: arrays (first, max, min, last, sum; NaN skipped)
+    """
+    cols = ["symbol", "date"] + OHLCV
+    dat = dat.reindex(columns=cols).drop_duplicates()
+    code, symbols = pd.factorize(dat["symbol"], sort=True)
+    when = np.asarray(pd.to_datetime(dat["date"]), dtype="datetime64[ns]")
+    ordn = ordinal(when, per)
+    # by date, so first and last are right also for unsorted rows
+    order = np.lexsort((when, code))
+    code, ordn = code[order], ordn[order]
+    n = len(order)
+    if n == 0:
+        empty = np.array([], dtype=np.int64)
+        return {
+            "symbols": np.asarray(symbols),
+            "code": empty,
+            "ordinal": empty,
+            **{c: np.array([], dtype=float) for c in cols[2:]},
+        }
+    starts = np.flatnonzero(
+        np.concatenate([[True], (np.diff(code) != 0) | (np.diff(ordn) != 0)])
+    )
+
+    grp = {"symbols": np.asarray(symbols), "code": code[starts], "ordinal": ordn[starts]}
+    idx = np.arange(n)
+    # first and last not NaN value of group
+    v = dat["open"].to_numpy(dtype=float)[order]
+    i = np.minimum.reduceat(np.where(np.isnan(v), n, idx), starts)
+    grp["open"] = np.where(i < n, v[np.minimum(i, n - 1)], np.nan)
+    v = dat["val"].to_numpy(dtype=float)[order]
+    i = np.maximum.reduceat(np.where(np.isnan(v), -1, idx), starts)
+    grp["val"] = np.where(i >= 0, v[i], np.nan)
+    grp["high"] = np.fmax.reduceat(dat["high"].to_numpy(dtype=float)[order], starts)
+    grp["low"] = np.fmin.reduceat(dat["low"].to_numpy(dtype=float)[order], starts)
+    vol = dat["vol"].to_numpy()[order]
+    if not np.issubdtype(vol.dtype, np.integer):
+        vol = np.nan_to_num(vol.astype(float))
+    grp["vol"] = np.add.reduceat(vol, starts)
+    return grp
+
+
+def bounds(code: np.ndarray, ordn: np.ndarray, n_sym: int):
+    """first and last period of each symbol (every symbol must have periods)"""
+    first = np.full(n_sym, np.iinfo(np.int64).max)
+    last = np.full(n_sym, np.iinfo(np.int64).min)
+    np.minimum.at(first, code, ordn)
+    np.maximum.at(last, code, ordn)
+    return first, last
+
+
+def ohlcv(dat: pd.DataFrame, date_period: str, empty=True) -> pd.DataFrame:
+    """resample OHLCV of all symbols to period
+    the same as pandas resample of each symbol separately
+    Args:
+        dat: DataFrame[symbol, date, open, high, low, val, vol]
+        date_period: daily, weekly, monthly, quarterly (or D, W, M, Q)
+        empty: add periods without rows (NaN prices, vol 0) between
+            first and last period of symbol
+    returns DataFrame[symbol, date, open, high, low, val, vol]
+    sorted by symbol and date, date is period label
+    """
+    per = period(date_period)
+    grp = groups(dat, per)
+    code, ordn = grp["code"], grp["ordinal"]
+    cols = OHLCV
+    if empty:
+        n_sym = len(grp["symbols"])
+        first, last = bounds(code, ordn, n_sym)
+        size = last - first + 1
+        start = np.cumsum(size) - size
+        pos = start[code] + ordn - first[code]
+        code_all = np.repeat(np.arange(n_sym), size)
+        ordn = np.repeat(first, size) + np.arange(size.sum()) - np.repeat(start, size)
+        for c in cols:
+            if c == "vol":
+                arr = np.zeros(size.sum(), dtype=grp[c].dtype)
+            else:
+                arr = np.full(size.sum(), np.nan)
+            arr[pos] = grp[c]
+            grp[c] = arr
+        code = code_all
+    return pd.DataFrame(
+        {
+            "symbol": grp["symbols"][code],
+            "date": label(ordn, per),
+            **{c: grp[c] for c in cols},
+        }
+    )
@@ -1,14 +1,21 @@
 import os
 import re
 import sys
+import json
+import atexit
+import time
 import sqlite3
+import threading
+import itertools
+from contextlib import contextmanager
 from datetime import datetime as dt
-from datetime import date
-from typing import Dict, List, Union, Tuple, Set
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Union, Tuple, Set
 
+import numpy as np
 import pandas as pd
-import wbdata as wb
 
+from workers import resample
 from workers.common import read_json, hash_table, read_currency
 
 """manages SQL db.
@@ -18,6 +25,202 @@ DB structure is described in ./asstes/sql_scheme.json
 
 SQL_file = "./assets/sql_scheme.jsonc"
 CURR_file = "./assets/currencies.csv"
+# keys in sql_scheme which are not columns
+SCHEME_KEYS = ["FOREIGN", "UNIQUE", "INDEX", "ROLLUP"]
+# internal key columns, never returned to user
+HIDDEN_COLS = ["hash", "id"]
+# DB layouts (PRAGMA user_version):
+# 1 - as in sql_scheme.jsonc
+# 2 - compact: value tables keyed by integer 'id' of *_DESC row,
+#     'date' as day number since EPOCH and REAL prices (see scheme())
+LAYOUTS = [1, 2]
+EPOCH = date(1970, 1, 1)
+
+# long-lived connections, one per (db file, thread)
+__pool__: Dict[Tuple[str, int], sqlite3.Connection] = {}
+__pool_lock__ = threading.Lock()
+# open transactions: {connection: {"depth": nesting level, "failed": rollback}}
+__tx__: Dict[sqlite3.Connection, Dict] = {}
+# ingest throughput: {table: [rows, seconds]}
+__ingest__: Dict[str, List[float]] = {}
+# schema/catalog cache: {db path: {"stamp": db file identity and scheme mtime,
+#                                   "columns": {table: [columns]},
+#                                   "valid": DB aligned with scheme}}
+__catalog__: Dict[str, Dict] = {}
+# above this number of keys, filter is loaded to temp table
+# instead of binding each key as parameter
+MAX_BOUND_KEYS = 500
+# business days without quotes still treated as continuous period
+# in COVERAGE (holidays)
+COVER_GAP = 3
+# symbols read at once when filling new rollup table
+ROLLUP_CHUNK = 200
+__temp_id__ = itertools.count()
+# emptied temp key tables, reused by __temp_keys__: {connection: [tables]}
+# (temp table can't be dropped while any query of connection is read)
+__temp_free__: Dict[sqlite3.Connection, List[str]] = {}
+
+
+def connect(db_file: str) -> sqlite3.Connection:
+    """return connection to db_file for current thread.
+    Connection is opened on first use and kept open,
+    so pragmas are applied only once per connection.
+    Each thread gets own connection, sqlite connections
+    shall not be shared between threads
+    """
+    key = (os.path.abspath(db_file), threading.get_ident())
+    with __pool_lock__:
+        con = __pool__.get(key)
+        if con is None:
+            con = sqlite3.connect(
+                db_file,
+                detect_types=sqlite3.PARSE_COLNAMES | sqlite3.PARSE_DECLTYPES,
+                # allows close() from other thread, connection itself
+                # is handed out only to the thread which opened it
+                check_same_thread=False,
+            )
+            # Foreign key constraints are disabled by default,
+            # so must be enabled separately for each database connection.
+            con.execute("PRAGMA foreign_keys = ON")
+            __pool__[key] = con
+    return con
+
+
+def close(db_file="") -> None:
+    """close pooled connections to db_file (from all threads).
+    If db_file not given, close all connections
+    """
+    path = os.path.abspath(db_file) if db_file else ""
+    with __pool_lock__:
+        for key in [k for k in __pool__ if not path or k[0] == path]:
+            con = __pool__.pop(key)
+            __tx__.pop(con, None)
+            __temp_free__.pop(con, None)
+            con.close()
+
+
+atexit.register(close)
+
+
+@contextmanager
+def transaction(db_file: str) -> Iterator[sqlite3.Connection]:
+    """group all statements inside 'with' block into one transaction.
+    Can be nested, commit (or rollback if anything failed)
+    happens when the outermost block exits
+    """
+    con = connect(db_file)
+    tx = __tx__.setdefault(con, {"depth": 0, "failed": False})
+    tx["depth"] += 1
+    try:
+        yield con
+    except Exception:
+        tx["failed"] = True
+        raise
+    finally:
+        tx["depth"] -= 1
+        if tx["depth"] == 0:
+            if tx["failed"]:
+                con.rollback()
+                # options may be read inside transaction
+                __drop_options__(db_file)
+            else:
+                con.commit()
+            tx["failed"] = False
+
+
+def ingest_stats(reset=False) -> pd.DataFrame:
+    """rows written to each table, time spent and rows/sec
+    (since start or last reset)"""
+    stats = pd.DataFrame(
+        [(t, int(r), s) for t, (r, s) in __ingest__.items()],
+        columns=["tab", "rows", "seconds"],
+    )
+    stats["rows_per_sec"] = stats["rows"] / stats["seconds"].where(
+        stats["seconds"] > 0
+    )
+    if reset:
+        __ingest__.clear()
+    return stats
+
+
+@contextmanager
+def __key_filter__(
+    db_file: str, cols: List[str], keys: Union[List, Set]
+) -> Iterator[Tuple[str, List]]:
+    """WHERE condition matching any of cols with any of keys.
+    Case insensitive, same as LIKE:
+    - '%' alone matches everything
+    - keys with '%' are matched with LIKE
+    - other keys are matched with equality (NOCASE), so index can be used.
+      Hash columns (md5 hex, lower case) are compared exactly,
+      so primary key index is used
+    Keys are bound as parameters, or loaded to temp table
+    when there is more then MAX_BOUND_KEYS of them
+
+    Yields:
+        tuple: (sql condition, list of parameters)
+    """
+    keys = {str(k) for k in keys if k is not None}
+    if "%" in keys:
+        yield "1", []
+        return
+    like = sorted(k for k in keys if "%" in k)
+    cond: List[str] = []
+    params: List = []
+    # {keys: temp table}
+    temp: Dict[Tuple[str, ...], str] = {}
+
+    def temp_tab(k: List[str]) -> str:
+        if tuple(k) not in temp:
+            temp[tuple(k)] = __temp_keys__(db_file, k)
+        return temp[tuple(k)]
+
+    try:
+        for c in cols:
+            if c.split(".")[-1].endswith("hash"):
+                equal = sorted({k.lower() for k in keys if "%" not in k})
+                collate = ""
+            else:
+                equal = sorted(k for k in keys if "%" not in k)
+                collate = " COLLATE NOCASE"
+            if len(equal) > MAX_BOUND_KEYS:
+                cond.append(f"{c}{collate} IN (SELECT key FROM temp.{temp_tab(equal)})")
+            elif equal:
+                cond.append(f"{c}{collate} IN ({','.join(['?'] * len(equal))})")
+                params += equal
+            if len(like) > MAX_BOUND_KEYS:
+                cond.append(f"EXISTS (SELECT 1 FROM temp.{temp_tab(like)} WHERE {c} LIKE key)")
+            elif like:
+                cond += [f"{c} LIKE ?" for _ in like]
+                params += like
+        yield "(" + (" OR ".join(cond) or "0") + ")", params
+    finally:
+        if temp:
+            with transaction(db_file) as con:
+                for t in temp.values():
+                    # emptied, not dropped: DROP fails with
+                    # 'database table is locked' while query_iter() is read
+                    con.execute(f"DELETE FROM temp.{t}")
+                    __temp_free__.setdefault(con, []).append(t)
+
+
+def __temp_keys__(db_file: str, keys: List[str]) -> str:
+    """load keys to temp table (visible only to own connection),
+    emptied table of connection is reused if any
+    return table name"""
+    with transaction(db_file) as con:
+        free = __temp_free__.get(con)
+        if free:
+            tab = free.pop()
+        else:
+            tab = f"keys_{next(__temp_id__)}"
+            con.execute(
+                f"CREATE TEMP TABLE {tab} (key TEXT PRIMARY KEY COLLATE NOCASE)"
+            )
+        con.executemany(
+            f"INSERT OR IGNORE INTO temp.{tab} VALUES (?)", [(k,) for k in keys]
+        )
+    return tab
 
 
 def query(
@@ -26,6 +229,7 @@ def query(
     symbol: List[str],
     from_date: date,
     to_date:  date,
+    period="daily",
 ) -> pd.DataFrame:
     """get data from sql db about symbol,
     including relevant data from description tab
@@ -39,47 +243,159 @@ def query(
         symbol: symbol from table:
         from_date: start date of data (including).
         to_date: last date of data (including).
+        period: read from rollup table of 'tab' for this period (see rollups()),
+            daily data if not declared. Periods are taken whole, labeled with
+            last day of period
     """
     if not check_sql(db_file):
         return pd.DataFrame()
-    symbol = __escape_quote__(set(symbol))
+    with __query_sql__(db_file, tab, symbol, from_date, to_date, period=period) as (
+        cmd,
+        params,
+    ):
+        resp = __execute_sql__([(cmd, params)], db_file)
+    if resp is None or resp[cmd].empty:
+        return pd.DataFrame()
+    return __query_df__(db_file, tab, resp[cmd])
+
 
+def query_iter(
+    db_file: str,
+    tab: str,
+    symbol: List[str],
+    from_date: date,
+    to_date: date,
+    chunk_rows=100_000,
+    by_symbol=True,
+    period="daily",
+) -> Iterator[pd.DataFrame]:
+    """same as query(), but yields data in chunks read straight from db
+    (cursor.fetchmany), so whole result is never kept in memory
+
+    Args:
+        chunk_rows: rows read from db at once
+        by_symbol: sort by symbol and date, each chunk contains
+            all rows of its symbols (chunk is bigger then chunk_rows
+            only if single symbol has more rows)
+    """
+    if not check_sql(db_file):
+        return
+    by_symbol = by_symbol and tab != "GEO"
+    # indexes of symbols read before the query, not for each chunk
+    # while the query is read
+    idx = None
+    if tab == "STOCK":
+        idx = stock_index(db_file=db_file, search=symbol)
+        if idx is None:
+            # read, nothing found
+            idx = pd.DataFrame(columns=["indexes", "symbol"])
+    with __query_sql__(
+        db_file, tab, symbol, from_date, to_date, order=by_symbol, period=period
+    ) as (cmd, params):
+        cur = connect(db_file).cursor()
+        try:
+            cur.execute(cmd, params)
+            colnames = [c[0] for c in cur.description]
+            pending = []  # rows of last symbol, may continue in next chunk
+            while rows := cur.fetchmany(chunk_rows):
+                dat = pd.DataFrame(rows, columns=colnames)
+                if by_symbol:
+                    last = dat["symbol"].iloc[-1]
+                    is_last = dat["symbol"] == last
+                    if not is_last.all():
+                        yield __query_df__(
+                            db_file,
+                            tab,
+                            pd.concat(pending + [dat.loc[~is_last]]),
+                            idx=idx,
+                        )
+                        pending = []
+                    pending.append(dat.loc[is_last])
+                else:
+                    yield __query_df__(db_file, tab, dat, idx=idx)
+            if pending:
+                yield __query_df__(db_file, tab, pd.concat(pending), idx=idx)
+        except sqlite3.Error as err:
+            # not swallowed, partial result must not look complete
+            print("SQL operation failed:")
+            print(err)
+            raise
+        finally:
+            cur.close()
+
+
+@contextmanager
+def __query_sql__(
+    db_file: str,
+    tab: str,
+    symbol: List[str],
+    from_date: date,
+    to_date: date,
+    order=False,
+    period="daily",
+) -> Iterator[Tuple[str, List]]:
+    """SELECT command (and parameters) for query() and query_iter()
+    order: sort by symbol and date
+    period: read from rollup table, if declared"""
     if tab == "GEO":
         desc = ""
         se_cols = ["country", "iso2", "region"]
     else:
         desc = "_DESC"
         se_cols = ["symbol"]
+    val_tab = rollup(tab, period) or tab
+    if val_tab != tab:
+        # periods containing from_date and to_date
+        per = resample.period(period)
+        from_date, to_date = (__period_end__(d, per) for d in [from_date, to_date])
 
     # get tab columns (without hash)
-    cols = tab_columns(tab=tab, db_file=db_file)
+    cols = tab_columns(tab=val_tab, db_file=db_file)
     cols += tab_columns(tab=tab + desc, db_file=db_file)
-    columns_txt = ",".join({c for c in cols if c != "hash"})
+    columns_txt = ",".join({c for c in cols if c not in HIDDEN_COLS})
 
     cmd = f"""SELECT {columns_txt}
 	        FROM {tab+desc} td"""
     if tab != "GEO":
-        cmd += f" INNER JOIN {tab} t ON t.hash=td.hash"
-    cmd += " WHERE "
-    cmd += "("
-    for c in se_cols:
-        cmd += "".join([f"td.{c} LIKE '" + s + "' OR " for s in symbol])
-    cmd += f"td.{se_cols[0]} LIKE 'none' "  # just to finish last OR
-    cmd += ")"
+        key = __key__(db_file)
+        cmd += f" INNER JOIN {val_tab} t ON t.{key}=td.{key}"
+    with __key_filter__(db_file, [f"td.{c}" for c in se_cols], symbol) as (
+        where,
+        params,
+    ):
+        cmd += f" WHERE {where}"
+        if tab != "GEO":
+            # dates are ISO text (or day numbers),
+            # compare directly so (hash, date) index is used
+            cmd += " AND t.date BETWEEN ? AND ?"
+            params += [__day__(db_file, from_date), __day__(db_file, to_date)]
+        if order:
+            cmd += " ORDER BY td.symbol, t.date"
+        yield cmd, params
 
-    if tab != "GEO":
-        cmd += f"""AND strftime('%s',date) BETWEEN
-                    strftime('%s','{from_date}') AND strftime('%s','{to_date}')
-                """
-    resp = __execute_sql__([cmd], db_file)
-    if resp is None or resp[cmd].empty:
-        return pd.DataFrame()
-    resp = resp[cmd]
+
+def __period_end__(d: date, per: str) -> date:
+    """label (last day) of period containing date"""
+    return __label__(resample.ordinal([d], per)[0], per)
+
+
+def __label__(ordn: int, per: str) -> date:
+    """label of period number as date"""
+    return pd.Timestamp(resample.label(np.array([ordn]), per)[0]).date()
+
+
+def __query_df__(
+    db_file: str, tab: str, dat: pd.DataFrame, idx: Union[pd.DataFrame, None] = None
+) -> pd.DataFrame:
+    """finish query result: decode dates and add indexes for STOCK
+    idx: stock_index() already read, read for symbols of dat if not given"""
+    dat = __decode_dates__(db_file, dat.reset_index(drop=True))
     if tab == "STOCK":
-        idx = stock_index(db_file=db_file, search=resp.loc[:, "symbol"].to_list())
-        if idx is not None:
-            resp = resp.merge(idx, how="left", on="symbol")
-    return resp.drop_duplicates()
+        if idx is None:
+            idx = stock_index(db_file=db_file, search=dat.loc[:, "symbol"].to_list())
+        if idx is not None and not idx.empty:
+            dat = dat.merge(idx, how="left", on="symbol")
+    return dat.drop_duplicates()
 
 
 def get_from_geo(db_file: str, tab: str, search: List, what: List[str]) -> List[str]:
@@ -89,7 +405,6 @@ def get_from_geo(db_file: str, tab: str, search: List, what: List[str]) -> List[
     Args:
         what: which column to match
     """
-    search = __escape_quote__(search)
     cmd = f"""SELECT
                 s.symbol
             FROM
@@ -97,13 +412,12 @@ def get_from_geo(db_file: str, tab: str, search: List, what: List[str]) -> List[
             INNER JOIN GEO g ON s.country=g.iso2
                 WHERE 
         """
-    cmd += "("
-    for w in what:
-        cmd += "".join([f"g.{w} LIKE '" + s + "' OR " for s in search])
-    cmd += f"g.{what[0]} LIKE 'none' "  # just to finish last OR
-    cmd += ")"
-
-    resp = __execute_sql__([cmd], db_file=db_file)
+    with __key_filter__(db_file, [f"g.{w}" for w in what], search) as (
+        where,
+        params,
+    ):
+        cmd += where
+        resp = __execute_sql__([(cmd, params)], db_file=db_file)
     return [] if resp is None or resp[cmd].empty else resp[cmd]["symbol"].to_list()
 
 
@@ -111,9 +425,7 @@ def index_components(db_file: str, search: List) -> List[str]:
     """
     Return components of given index name.
     """
-    search = __escape_quote__(search)
-    cmd = (
-        """SELECT
+    cmd = """SELECT
                 s.symbol
             FROM
                 STOCK_DESC s
@@ -121,12 +433,9 @@ def index_components(db_file: str, search: List) -> List[str]:
             INNER JOIN COMPONENTS c on s.hash = c.stock_hash
                 WHERE 
         """
-        + "("
-    )
-    cmd += "".join(["i.name LIKE '" + s + "' OR " for s in search])
-    cmd += "i.name LIKE 'none' "  # just to finish last OR
-    cmd += ")"
-    resp = __execute_sql__([cmd], db_file=db_file)
+    with __key_filter__(db_file, ["i.name"], search) as (where, params):
+        cmd += where
+        resp = __execute_sql__([(cmd, params)], db_file=db_file)
     return [] if resp is None or resp[cmd].empty else resp[cmd]["symbol"].to_list()
 
 
@@ -136,9 +445,7 @@ def stock_index(db_file: str, search: List) -> Union[pd.DataFrame, None]:
     Use stock symbol in search
     Return DataFrame with columns [indexes] and [stock]
     """
-    search = __escape_quote__(search)
-    cmd = (
-        """SELECT
+    cmd = """SELECT
                 i.name AS 'indexes', s.symbol AS 'symbol'
             FROM
                 STOCK_DESC s
@@ -146,12 +453,9 @@ def stock_index(db_file: str, search: List) -> Union[pd.DataFrame, None]:
             INNER JOIN COMPONENTS c on s.hash = c.stock_hash
                 WHERE 
         """
-        + "("
-    )
-    cmd += "".join(["s.symbol LIKE '" + s + "' OR " for s in set(search)])
-    cmd += "s.symbol LIKE 'none' "  # just to finish last OR
-    cmd += ")"
-    resp = __execute_sql__([cmd], db_file=db_file)
+    with __key_filter__(db_file, ["s.symbol"], search) as (where, params):
+        cmd += where
+        resp = __execute_sql__([(cmd, params)], db_file=db_file)
     if resp is None or resp[cmd].empty:
         return
     return resp[cmd]
@@ -166,36 +470,145 @@ def currency_of_country(db_file: str, country: Union[List, set]) -> pd.DataFrame
             INNER JOIN GEO g ON cd.symbol=g.currency
                 WHERE
         """
-    cmd += "("
-    cmd += "".join(["g.iso2 LIKE '" + c + "' OR " for c in country])
-    cmd += "g.iso2 LIKE 'none' "  # just to finish last OR
-    cmd += ")"
-    resp = __execute_sql__([cmd], db_file=db_file)
+    with __key_filter__(db_file, ["g.iso2"], country) as (where, params):
+        cmd += where
+        resp = __execute_sql__([(cmd, params)], db_file=db_file)
     if resp is None or resp[cmd].empty:
         return pd.DataFrame()
     return resp[cmd].drop(["currency", "last_upd", "hash"], axis="columns")
 
 
-def currency_rate(db_file: str, dat: pd.DataFrame) -> pd.DataFrame:
+def currency_history(db_file: str, symbols: List[str]) -> pd.DataFrame:
     """
-    Return currency rate for cur_symbol | date
+    Return all stored rates of currencies [symbol, day, val]
+    day as number of days since EPOCH (see workers/fx.py)
     """
-    min_date = dat.date.min()
-    max_date = dat.date.max()
-    cmd = [
-        f"""SELECT c.val, c.date, cd.symbol
+    key = __key__(db_file)
+    day = "c.date" if db_layout(db_file) == 2 else "julianday(c.date) - 2440587.5"
+    cmd = f"""SELECT cd.symbol, CAST({day} AS INTEGER) AS day, c.val
             FROM CURRENCY c
-            INNER JOIN CURRENCY_DESC cd ON c.hash=cd.hash
+            INNER JOIN CURRENCY_DESC cd ON c.{key}=cd.{key}
                 WHERE
-            (cd.symbol LIKE '{symbol}' AND strftime('%s',c.date) BETWEEN
-                    strftime('%s','{min_date}') AND strftime('%s','{max_date}') )
-            """
-        for symbol in dat["symbol"].drop_duplicates()
-    ]
-    resp = __execute_sql__(cmd, db_file=db_file)
-    if resp is None or resp[cmd[0]].empty:
-        return pd.DataFrame()
-    return pd.concat(resp.values(), ignore_index=True)
+        """
+    with __key_filter__(db_file, ["cd.symbol"], symbols) as (where, params):
+        cmd += where
+        resp = __execute_sql__([(cmd, params)], db_file=db_file)
+    if resp is None or resp[cmd].empty:
+        return pd.DataFrame(columns=["symbol", "day", "val"])
+    return resp[cmd]
+
+
+def db_layout(db_file: str) -> int:
+    """DB layout version (see LAYOUTS), cached"""
+    cat = __catalog_of__(db_file)
+    if "layout" not in cat:
+        sql_cmd = "PRAGMA user_version"
+        resp = __execute_sql__([sql_cmd], db_file)
+        version = int(resp[sql_cmd].iloc[0, 0]) if resp else 0
+        cat["layout"] = version if version in LAYOUTS else 1
+    return cat["layout"]
+
+
+def scheme(layout=1) -> Dict:
+    """DB scheme for given layout.
+    Layout 2 is generated from sql_scheme.jsonc, for value tables
+    (tables with *_DESC table):
+    - *_DESC gets 'id INTEGER PRIMARY KEY', 'hash' stays UNIQUE
+    - value tables reference 'id' instead of 'hash'
+    - 'date' is INTEGER (days since EPOCH), INTEGER columns are REAL
+    (rollup tables as their source value table)
+    """
+    sql_scheme = read_json(SQL_file)
+    if layout == 1:
+        return sql_scheme
+    for tab in [t for t in sql_scheme if __desc_of__(t, sql_scheme)]:
+        desc = __desc_of__(tab, sql_scheme)
+        if desc == f"{tab}_DESC":
+            sql_scheme[desc] = {
+                "id": "INTEGER PRIMARY KEY",
+                **{
+                    k: ("TEXT UNIQUE NOT NULL" if k == "hash" else v)
+                    for k, v in sql_scheme[desc].items()
+                },
+            }
+        tab_v2 = {}
+        for k, v in sql_scheme[tab].items():
+            if k == "hash":
+                tab_v2["id"] = "INTEGER"
+            elif k == "date":
+                tab_v2[k] = "INTEGER NOT NULL"
+            elif k == "FOREIGN":
+                tab_v2[k] = [
+                    {"id": f"{desc}(id)"} if "hash" in f else f for f in v
+                ]
+            elif k in ["UNIQUE", "INDEX"]:
+                tab_v2[k] = json.loads(json.dumps(v).replace('"hash', '"id'))
+            elif k == "ROLLUP":
+                tab_v2[k] = v
+            else:
+                tab_v2[k] = v.replace("INTEGER", "REAL")
+        sql_scheme[tab] = tab_v2
+    return sql_scheme
+
+
+def __desc_of__(tab: str, sql_scheme: Dict) -> str:
+    """*_DESC table of value table 'tab' (rollup tables: of their source),
+    '' if 'tab' is not value table"""
+    src = sql_scheme.get(tab, {}).get("ROLLUP", {}).get("tab", tab)
+    return f"{src}_DESC" if f"{src}_DESC" in sql_scheme else ""
+
+
+def rollups(tab: str) -> Dict[str, str]:
+    """rollup tables of 'tab' declared in scheme: {period (W, M): table}"""
+    return {
+        v["ROLLUP"]["period"]: t
+        for t, v in read_json(SQL_file).items()
+        if v.get("ROLLUP", {}).get("tab") == tab.upper()
+    }
+
+
+def rollup(tab: str, period: str) -> str:
+    """rollup table of 'tab' for period (daily, weekly... or D, W...),
+    '' if not declared"""
+    return rollups(tab).get(resample.period(period), "")
+
+
+def __key__(db_file: str) -> str:
+    """column joining value table with its *_DESC table"""
+    return "id" if db_layout(db_file) == 2 else "hash"
+
+
+def __day__(db_file: str, d: date) -> Union[date, int]:
+    """date as stored in value tables"""
+    return (d - EPOCH).days if db_layout(db_file) == 2 else d
+
+
+def __decode_dates__(db_file: str, dat: pd.DataFrame) -> pd.DataFrame:
+    """day numbers from value tables back to dates (layout 2)"""
+    if db_layout(db_file) == 2 and "date" in dat.columns:
+        dat["date"] = pd.to_datetime(dat["date"], unit="D").dt.date
+    return dat
+
+
+def __catalog_of__(db_file: str) -> Dict:
+    """cached catalog of db_file
+    Reset when DB file is replaced (other inode) or sql_scheme.jsonc changes.
+    Writes do not change schema, so file mtime is not considered
+    """
+    path = os.path.abspath(db_file)
+    st = os.stat(db_file)
+    stamp = (st.st_dev, st.st_ino, os.stat(SQL_file).st_mtime_ns)
+    cat = __catalog__.get(path)
+    if cat is None or cat["stamp"] != stamp:
+        cat = {"stamp": stamp, "columns": {}, "options": {}, "valid": False}
+        __catalog__[path] = cat
+    return cat
+
+
+def cache_of(db_file: str, name: str) -> Dict:
+    """cache 'name' of other module for db_file (i.e. fx rates),
+    kept in catalog, so is dropped when DB file is replaced"""
+    return __catalog_of__(db_file).setdefault(name, {})
 
 
 def tab_exists(tab: str) -> bool:
@@ -208,10 +621,24 @@ def tab_exists(tab: str) -> bool:
     return True
 
 
-def put(dat: pd.DataFrame, tab: str, db_file: str, index="") -> Union[Dict, None]:
+def put(
+    dat: pd.DataFrame,
+    tab: str,
+    db_file: str,
+    index="",
+    upsert=False,
+    cover: Union[Tuple[date, date], None] = None,
+) -> Union[Dict, None]:
     # put DataFrame into sql at table=tab
     # if description table exists, writes first to 'tab_desc'
     # takes from DataFrame only columns present in sql table
+    # missing description is filled with what is known for the asset
+    # existing (hash, date) rows in 'tab' are replaced (corrected bars),
+    # upsert: only new (hash, date) rows are inserted, for bulk loads
+    # (dump, listings) which shall not overwrite downloaded history
+    # dates are added to COVERAGE, cover: (from, to) period requested
+    # from web, so known to be complete (even if no quotes on some days)
+    # periods with new dates are recalculated in rollup tables of 'tab'
     # check if tab exists!
     if not tab_exists(tab):
         return
@@ -224,78 +651,416 @@ def put(dat: pd.DataFrame, tab: str, db_file: str, index="") -> Union[Dict, None
 
     sql_scheme = read_json(SQL_file)
     tabL = [f"{tab}_DESC", tab] if f"{tab}_DESC" in sql_scheme.keys() else [tab]
-    # merge with what we already know
-    known = query(
-        db_file=db_file,
-        tab=tab,
-        symbol=dat.loc[:, "symbol"].to_list(),
-        from_date=date(1900, 1, 1),
-        to_date=date.today(),
-    )
-    if not known.empty:
-        known["hash"] = hash_table(known, tab)  # add hash column
-
-        # compare new data with what present in sql
-        dat = dat.reindex(columns=known.columns)  # align columns
-        dat = dat.merge(known, how="left", on=["hash", "date"], suffixes=("", "_known"))
-        # fill new data with what already known
-        pattern = re.compile("(date)|(val)|(symbol)|(name)|(hash)")
-        # identify relevant columns and fill missing values
-        for c in known.columns:
-            if not pattern.search(c) and f"{c}_known" in dat.columns:
-                dat[c] = (
-                    dat[c]
-                    .infer_objects() # prevent FutureWarning
-                    .fillna(dat[c + "_known"]
-                        .infer_objects()) # prevent FutureWarning
-                )
-
-    # add new data to sql
-    for t in tabL:
-        sql_columns = tab_columns(t, db_file)
-        d = dat.loc[:, [c in sql_columns for c in dat.columns]]
-        resp = __write_table__(
-            dat=d,
-            tab=t,
-            db_file=db_file,
-        )
-        if not resp:
+    if len(tabL) > 1:
+        dat = __fill_known__(dat=dat, tab=tabL[0], db_file=db_file)
+
+    # add new data to sql, all tables in one transaction
+    with transaction(db_file):
+        for t in tabL:
+            sql_columns = tab_columns(t, db_file)
+            d = dat.loc[:, [c in sql_columns for c in dat.columns]]
+            if t.endswith("_DESC"):
+                # one description row per asset is enough
+                d = d.drop_duplicates(subset="hash", keep="last")
+                # update in place, so row keeps its id
+                on_conflict = "update"
+            else:
+                on_conflict = "ignore" if upsert else "replace"
+                if len(tabL) > 1 and db_layout(db_file) == 2:
+                    d = __to_layout2__(dat=dat, tab=t, db_file=db_file)
+            resp = __write_table__(
+                dat=d,
+                tab=t,
+                db_file=db_file,
+                on_conflict=on_conflict,
+            )
+            if not resp:
+                return
+        if len(tabL) > 1 and not __cover__(dat=dat, db_file=db_file, cover=cover):
             return
-
-    ####
-    # HANDLE INDEXES <-> STOCK: stock can be in many indexes!!!
-    # sql will handle unique rows
-    ####
-    if index:
-        if hashes := getL(
-            db_file=db_file,
-            tab="INDEXES_DESC",
-            get=["hash"],
-            search=[index],
-            where=["symbol"],
-        ):
-            hashes = hashes[0]
-        else:
+        if len(tabL) > 1 and not __put_rollup__(dat=dat, tab=tab, db_file=db_file):
             return
-        components = pd.DataFrame({"stock_hash": dat["hash"], "indexes_hash": hashes})
-        resp = __write_table__(dat=components, tab="COMPONENTS", db_file=db_file)
-        return resp
+
+        ####
+        # HANDLE INDEXES <-> STOCK: stock can be in many indexes!!!
+        # sql will handle unique rows
+        ####
+        if index:
+            if hashes := getL(
+                db_file=db_file,
+                tab="INDEXES_DESC",
+                get=["hash"],
+                search=[index],
+                where=["symbol"],
+            ):
+                hashes = hashes[0]
+            else:
+                return
+            components = pd.DataFrame(
+                {"stock_hash": dat["hash"], "indexes_hash": hashes}
+            ).drop_duplicates()
+            resp = __write_table__(dat=components, tab="COMPONENTS", db_file=db_file)
+            return resp
     return {"put": "success"}
 
 
+def __fill_known__(dat: pd.DataFrame, tab: str, db_file: str) -> pd.DataFrame:
+    """fill missing description in dat with what is known in 'tab' (*_DESC)
+    reads only description rows of assets present in dat
+    (dates and names are not filled)"""
+    cmd = f"SELECT * FROM {tab} WHERE "
+    with __key_filter__(db_file, ["hash"], dat["hash"].drop_duplicates()) as (
+        where,
+        params,
+    ):
+        resp = __execute_sql__([(cmd + where, params)], db_file)
+    if not resp or resp[cmd + where].empty:
+        return dat
+    known = resp[cmd + where]
+    pattern = re.compile("(date)|(val)|(symbol)|(name)|(hash)|(^id$)")
+    known = known.loc[:, [c == "hash" or not pattern.search(c) for c in known.columns]]
+    dat = dat.merge(known, how="left", on="hash", suffixes=("", "_known"))
+    for c in known.columns:
+        if c == "hash":
+            continue
+        if c in dat.columns and f"{c}_known" in dat.columns:
+            dat[c] = (
+                dat[c]
+                .infer_objects()  # prevent FutureWarning
+                .fillna(dat[c + "_known"].infer_objects())
+            )
+            dat.drop(columns=[c + "_known"], inplace=True)
+        else:
+            dat.rename(columns={c + "_known": c}, inplace=True)
+    return dat
+
+
+def __cover__(
+    dat: pd.DataFrame, db_file: str, cover: Union[Tuple[date, date], None] = None
+) -> bool:
+    """add dates of dat[hash, date] (and period 'cover') to COVERAGE
+    periods are merged, so stay disjoint
+    must be called within transaction (as put())
+    """
+    new = __periods__(dat.loc[:, ["hash", "date"]])
+    hashes = list(new["hash"].unique())
+    if cover:
+        req = pd.DataFrame({"hash": hashes, "from_date": cover[0], "to_date": cover[1]})
+        new = pd.concat([new, req], ignore_index=True)
+    return __add_cover__(new=new, hashes=hashes, db_file=db_file)
+
+
+def put_cover(db_file: str, hashes: List[str], cover: Tuple[date, date]) -> bool:
+    """add period 'cover' to COVERAGE of hashes, without any data
+    (i.e. no quotes on web for requested period, so it is not requested again)
+    """
+    hashes = list(dict.fromkeys(hashes))
+    if not hashes:
+        return True
+    new = pd.DataFrame({"hash": hashes, "from_date": cover[0], "to_date": cover[1]})
+    with transaction(db_file):
+        return __add_cover__(new=new, hashes=hashes, db_file=db_file)
+
+
+def __add_cover__(new: pd.DataFrame, hashes: List[str], db_file: str) -> bool:
+    # merge new periods [hash, from_date, to_date] with stored ones
+    new = __merge_periods__(pd.concat([coverage(db_file, hashes), new], ignore_index=True))
+    cmd = "DELETE FROM COVERAGE WHERE "
+    with __key_filter__(db_file, ["hash"], hashes) as (where, params):
+        if __execute_sql__([(cmd + where, params)], db_file) is None:
+            return False
+    return __write_table__(dat=new, tab="COVERAGE", db_file=db_file) is not None
+
+
+def __periods__(dat: pd.DataFrame) -> pd.DataFrame:
+    """continuous periods [hash, from_date, to_date] from dat[hash, date]"""
+    dat = dat.assign(from_date=dat["date"], to_date=dat["date"])
+    return __merge_periods__(dat.loc[:, ["hash", "from_date", "to_date"]])
+
+
+def __merge_periods__(dat: pd.DataFrame) -> pd.DataFrame:
+    """merge overlapping periods [hash, from_date, to_date] and those
+    separated by no more then COVER_GAP business days"""
+    if dat.empty:
+        return pd.DataFrame(columns=["hash", "from_date", "to_date"])
+    dat = dat.assign(
+        from_date=pd.to_datetime(dat["from_date"]).to_numpy(dtype="datetime64[D]"),
+        to_date=pd.to_datetime(dat["to_date"]).to_numpy(dtype="datetime64[D]"),
+    ).sort_values(["hash", "from_date"], ignore_index=True)
+    prev_end = dat.groupby("hash")["to_date"].cummax().groupby(dat["hash"]).shift()
+    # business days between end of previous period and start of next one
+    gap = pd.Series(COVER_GAP + 1, index=dat.index)
+    known = prev_end.notna()
+    gap[known] = np.busday_count(
+        (prev_end[known] + pd.Timedelta(days=1)).to_numpy(dtype="datetime64[D]"),
+        dat.loc[known, "from_date"].to_numpy(dtype="datetime64[D]"),
+    )
+    period = (gap > COVER_GAP).cumsum()
+    dat = dat.groupby(["hash", period]).agg(
+        from_date=("from_date", "min"), to_date=("to_date", "max")
+    )
+    dat = dat.reset_index(level=0).reset_index(drop=True)
+    dat["from_date"] = dat["from_date"].dt.date
+    dat["to_date"] = dat["to_date"].dt.date
+    return dat
+
+
+def coverage(db_file: str, hashes: List[str]) -> pd.DataFrame:
+    """stored periods [hash, from_date, to_date] for hashes"""
+    cmd = "SELECT hash, from_date, to_date FROM COVERAGE WHERE "
+    with __key_filter__(db_file, ["hash"], hashes) as (where, params):
+        resp = __execute_sql__([(cmd + where, params)], db_file)
+    if resp is None or resp[cmd + where].empty:
+        return pd.DataFrame(columns=["hash", "from_date", "to_date"])
+    return resp[cmd + where]
+
+
+def missing_periods(db_file: str, windows: pd.DataFrame) -> pd.DataFrame:
+    """parts of requested periods not in COVERAGE
+    Args:
+        windows: requested periods [hash, from_date, to_date], one per hash
+    returns missing periods [hash, from_date, to_date] (with business days)
+    """
+    cols = ["hash", "from_date", "to_date"]
+    if windows.empty:
+        return pd.DataFrame(columns=cols)
+    day = pd.Timedelta(days=1)
+    w = pd.DataFrame(
+        {
+            "hash": windows["hash"].to_numpy(),
+            "ws": pd.to_datetime(windows["from_date"]).to_numpy(),
+            "we": pd.to_datetime(windows["to_date"]).to_numpy(),
+        }
+    )
+    c = coverage(db_file, list(w["hash"].unique()))
+    c = c.assign(
+        cs=pd.to_datetime(c["from_date"]), ce=pd.to_datetime(c["to_date"])
+    ).merge(w, on="hash")
+    # only stored periods within window
+    c = c.loc[(c["ce"] >= c["ws"]) & (c["cs"] <= c["we"])]
+    c = c.sort_values(["hash", "cs"], ignore_index=True)
+    prev_end = c.groupby("hash")["ce"].cummax().groupby(c["hash"]).shift()
+    prev_end = prev_end.fillna(c["ws"] - day)
+    before = c.loc[c["cs"] > prev_end + day]
+    last = c.groupby("hash").agg(ce=("ce", "max"), we=("we", "first")).reset_index()
+    after = last.loc[last["ce"] < last["we"]]
+    none = w.loc[~w["hash"].isin(c["hash"])]
+    gaps = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "hash": before["hash"],
+                    "from_date": prev_end[before.index] + day,
+                    "to_date": before["cs"] - day,
+                }
+            ),
+            pd.DataFrame(
+                {"hash": after["hash"], "from_date": after["ce"] + day, "to_date": after["we"]}
+            ),
+            pd.DataFrame({"hash": none["hash"], "from_date": none["ws"], "to_date": none["we"]}),
+        ],
+        ignore_index=True,
+    )
+    gaps = gaps.loc[gaps["from_date"] <= gaps["to_date"]]
+    # skip periods without business days (weekends)
+    bdays = np.busday_count(
+        gaps["from_date"].to_numpy(dtype="datetime64[D]"),
+        (gaps["to_date"] + day).to_numpy(dtype="datetime64[D]"),
+    )
+    gaps = gaps.loc[bdays > 0].sort_values(["hash", "from_date"], ignore_index=True)
+    gaps["from_date"] = gaps["from_date"].dt.date
+    gaps["to_date"] = gaps["to_date"].dt.date
+    return gaps
+
+
+def candles(db_file: str, symbols: List[str], period: str, digest: str) -> pd.DataFrame:
+    """cached candle pattern periods [symbol, date, ind, formation]
+    date as datetime64 (many rows, so not converted to date one by one)
+    """
+    cols = ["symbol", "date", "ind", "formation"]
+    cmd = """SELECT symbol, CAST(julianday(date) - 2440587.5 AS INTEGER) AS day,
+            ind, formation FROM CANDLES WHERE period=? AND digest=? AND """
+    with __key_filter__(db_file, ["symbol"], symbols) as (where, params):
+        resp = __execute_sql__([(cmd + where, [period, digest] + params)], db_file)
+    if resp is None or resp[cmd + where].empty:
+        return pd.DataFrame(columns=cols)
+    dat = resp[cmd + where]
+    dat["day"] = pd.to_datetime(dat["day"], unit="D")
+    return dat.rename(columns={"day": "date"})
+
+
+def candles_state(
+    db_file: str, symbols: List[str], period: str, digest: str
+) -> pd.DataFrame:
+    """cached candle pattern periods of symbols
+    [symbol, from_date, to_date, checksum]"""
+    cols = ["symbol", "from_date", "to_date", "checksum"]
+    cmd = f"SELECT {','.join(cols)} FROM CANDLES_STATE WHERE period=? AND digest=? AND "
+    with __key_filter__(db_file, ["symbol"], symbols) as (where, params):
+        resp = __execute_sql__([(cmd + where, [period, digest] + params)], db_file)
+    if resp is None or resp[cmd + where].empty:
+        return pd.DataFrame(columns=cols)
+    return resp[cmd + where]
+
+
+def put_candles(
+    dat: pd.DataFrame, state: pd.DataFrame, db_file: str, period: str, digest: str
+) -> bool:
+    """store candle pattern periods dat[symbol, date, ind, formation]
+    and state[symbol, from_date, to_date, checksum, recalc_date]
+    cached periods from recalc_date are replaced with dat,
+    cache from other pattern files is removed for symbols in state
+    """
+    symbols = list(state["symbol"])
+    with transaction(db_file):
+        for tab in ["CANDLES", "CANDLES_STATE"]:
+            cmd = f"DELETE FROM {tab} WHERE period=? AND digest<>? AND "
+            with __key_filter__(db_file, ["symbol"], symbols) as (where, params):
+                if __execute_sql__([(cmd + where, [period, digest] + params)], db_file) is None:
+                    return False
+        cmd = "DELETE FROM CANDLES WHERE period=? AND digest=? AND symbol=? AND date>=?"
+        recalc = state.loc[:, ["symbol", "recalc_date"]].itertuples(index=False)
+        if __execute_sql__([(cmd, [period, digest, s, d]) for s, d in recalc], db_file) is None:
+            return False
+        state = state.drop(columns="recalc_date").assign(period=period, digest=digest)
+        if __write_table__(dat=state, tab="CANDLES_STATE", db_file=db_file) is None:
+            return False
+        if dat.empty:
+            return True
+        dat = dat.assign(period=period, digest=digest)
+        return __write_table__(dat=dat, tab="CANDLES", db_file=db_file) is not None
+
+
+def __put_rollup__(
+    dat: pd.DataFrame, tab: str, db_file: str, tabs: Union[List[str], None] = None
+) -> bool:
+    """recalculate periods with dates of dat[hash, date] in rollup tables of 'tab'
+    whole periods are read back from 'tab', so also rows stored before are included
+    must be called within transaction (as put())
+    Args:
+        tabs: only these rollup tables (default all)
+    """
+    rolls = {p: t for p, t in rollups(tab).items() if tabs is None or t in tabs}
+    if not rolls or dat.empty:
+        return True
+    span = pd.DataFrame({"hash": dat["hash"].to_numpy()})
+    for per in rolls:
+        k = resample.ordinal(dat["date"], per)
+        span[f"from_{per}"], span[f"to_{per}"] = k, k
+    span = span.groupby("hash").agg(
+        {c: "min" if c.startswith("from") else "max" for c in span.columns[1:]}
+    )
+    # dates of all affected periods (day after end of previous period)
+    from_date = min(__label__(span[f"from_{p}"].min() - 1, p) for p in rolls)
+    from_date += timedelta(days=1)
+    to_date = max(__label__(span[f"to_{p}"].max(), p) for p in rolls)
+
+    key = __key__(db_file)
+    cols = [c for c in tab_columns(tab, db_file) if c in resample.OHLCV]
+    cmd = f"""SELECT td.hash AS symbol, t.date, {",".join(f"t.{c}" for c in cols)}
+            FROM {tab} t INNER JOIN {tab}_DESC td ON t.{key}=td.{key}
+            WHERE t.date BETWEEN ? AND ? AND """
+    with __key_filter__(db_file, ["td.hash"], list(span.index)) as (where, params):
+        params = [__day__(db_file, from_date), __day__(db_file, to_date)] + params
+        resp = __execute_sql__([(cmd + where, params)], db_file)
+    if resp is None:
+        return False
+    stored = __decode_dates__(db_file, resp[cmd + where])
+    if stored.empty:
+        return True
+
+    for per, roll in rolls.items():
+        grp = resample.groups(stored, per)
+        hashes = grp["symbols"][grp["code"]]
+        k = grp["ordinal"]
+        lo = span[f"from_{per}"].reindex(hashes).to_numpy()
+        hi = span[f"to_{per}"].reindex(hashes).to_numpy()
+        new = (k >= lo) & (k <= hi)
+        d = pd.DataFrame(
+            {
+                "hash": hashes[new],
+                "date": pd.DatetimeIndex(resample.label(k[new], per)).date,
+                **{c: grp[c][new] for c in cols},
+            }
+        )
+        if db_layout(db_file) == 2:
+            d = __to_layout2__(dat=d, tab=roll, db_file=db_file)
+        if __write_table__(dat=d, tab=roll, db_file=db_file) is None:
+            return False
+    return True
+
+
+def __to_layout2__(dat: pd.DataFrame, tab: str, db_file: str) -> pd.DataFrame:
+    """value table rows in layout 2: 'hash' replaced with 'id' of *_DESC row
+    (so *_DESC must be written before), 'date' as day number"""
+    sql_columns = tab_columns(tab, db_file)
+    desc = __desc_of__(tab, read_json(SQL_file))
+    cmd = f"SELECT id, hash FROM {desc} WHERE "
+    with __key_filter__(db_file, ["hash"], dat["hash"].drop_duplicates()) as (
+        where,
+        params,
+    ):
+        resp = __execute_sql__([(cmd + where, params)], db_file)
+    ids = resp[cmd + where] if resp else pd.DataFrame(columns=["id", "hash"])
+    d = dat.merge(ids, how="left", on="hash", suffixes=("_x", ""))
+    d["date"] = (pd.to_datetime(d["date"]) - pd.Timestamp(EPOCH)).dt.days
+    return d.loc[:, [c for c in sql_columns if c in d.columns]]
+
+
 def __write_table__(
-    dat: pd.DataFrame, tab: str, db_file: str
+    dat: pd.DataFrame, tab: str, db_file: str, on_conflict="replace"
 ) -> Union[None, Dict[str, pd.DataFrame]]:
-    """writes DataFrame to SQL table 'tab'"""
-    records = list(dat.astype("string").to_records(index=False))
-    records = [tuple(__escape_quote__(r)) for r in records]
-    cmd = [
-        f"""INSERT OR REPLACE INTO {tab} {tuple(dat.columns)}
-            VALUES {values_list}
+    """writes DataFrame to SQL table 'tab'
+    one prepared statement with bound parameters for all rows
+    (executemany), so no quoting or NULL handling needed
+    on_conflict: when row violates unique constraint
+        - 'replace': replace existing row
+        - 'ignore': skip it (so only new rows are inserted)
+        - 'update': update existing row in place (on 'hash' column)
+    """
+    cols = list(dat.columns)
+    conflict = {
+        "replace": "",
+        "ignore": "ON CONFLICT DO NOTHING",
+        "update": "ON CONFLICT(hash) DO UPDATE SET "
+        + ",".join([f"{c}=excluded.{c}" for c in cols if c != "hash"]),
+    }[on_conflict]
+    cmd = f"""INSERT {"OR REPLACE " if on_conflict == "replace" else ""}INTO {tab} ({",".join(cols)})
+            VALUES ({",".join(["?"] * len(cols))})
+            {conflict}
         """
-        for values_list in records
-    ]
-    return __execute_sql__(cmd, db_file)
+    records = __records__(dat)
+    start = time.perf_counter()
+    try:
+        with transaction(db_file) as con:
+            con.executemany(cmd, records)
+    except sqlite3.IntegrityError as err:
+        print("In command:")
+        print(cmd)
+        print(err)
+        return
+    except sqlite3.Error as err:
+        print("SQL operation failed:")
+        print(err)
+        return
+    if tab.endswith("_DESC") or tab == "GEO":
+        __drop_options__(db_file)
+    rows, sec = __ingest__.get(tab, [0, 0.0])
+    __ingest__[tab] = [rows + len(records), sec + time.perf_counter() - start]
+    return {cmd: pd.DataFrame()}
+
+
+def __records__(dat: pd.DataFrame) -> List[Tuple]:
+    """DataFrame rows as tuples of python types accepted by sqlite
+    (dates as datetime.date, missing values as None)
+    """
+    dat = dat.copy()
+    for c in dat.columns:
+        if pd.api.types.is_datetime64_any_dtype(dat[c]):
+            dat[c] = dat[c].dt.date
+    dat = dat.astype(object).where(dat.notna(), None)
+    return list(dat.itertuples(index=False, name=None))
+
 
 def get_start_date(ticker: List, tab: str, db_file: str) -> date:
     if ticker == []:
@@ -308,8 +1073,13 @@ def get_start_date(ticker: List, tab: str, db_file: str) -> date:
     return min(resp)
 
 def get_end_date(ticker: List, tab: str, db_file: str) -> date:
+    # last date in COVERAGE, *_DESC to_date if asset not yet there
     if ticker == []:
         return date.today()
+    hashes = getL(db_file=db_file, tab=tab, get=["hash"], search=ticker, where=["symbol"])
+    cov = coverage(db_file, hashes) if hashes else pd.DataFrame()
+    if not cov.empty and cov["hash"].nunique() == len(set(hashes)):
+        return max(cov["to_date"])
     resp = getL(db_file=db_file, 
                tab=tab, 
                get=["to_date"],
@@ -357,7 +1127,6 @@ def get(
         search: what to get (defoult '%' for everything)
         where: columns used for searching (defoult '%' for everything)
     """
-    search = __escape_quote__(search)
     resp = {}
     all_cols = tab_columns(tab=tab, db_file=db_file)
     tab = tab.upper()
@@ -379,55 +1148,18 @@ def get(
 
     for c in where:
         cmd = f"SELECT {','.join(get)} FROM {tab} WHERE "
-        cmd += "("
-        cmd += " ".join([f"{c} LIKE '{s}' OR " for s in search])
-        cmd += f"{c} LIKE 'none'"  # just to close last 'OR'
-        cmd += ")"
-        if resp_col := __execute_sql__([cmd], db_file):
+        with __key_filter__(db_file, [c], search) as (where_c, params):
+            cmd += where_c
+            resp_col = __execute_sql__([(cmd, params)], db_file)
+        if resp_col:
             resp[c] = resp_col[cmd].drop_duplicates()
     return resp
 
 
-def __split_cmd__(script: list) -> List[List]:
-    # split OR logic chain into 500 len elements
-    # there is limit of 1000 tree depth
-    def split_logic_chain(cmd):
-        cmd = cmd.replace("\t", "").replace("\n", "").replace("\r", "")
-        where_index = cmd.find("WHERE")
-        if where_index == -1:
-            return [cmd]
-        cmd1 = cmd[: where_index + 5]
-        cmd2 = cmd[where_index + 5 :]
-        cmd3 = cmd2[cmd2.find(")") + 1 :]
-        cmd2 = cmd2[: cmd2.find(")") + 1]
-        logic_tree = cmd2.replace("'", "stock_name")
-        lenOR = logic_tree.count(" OR ")
-        lenAND = logic_tree.count(" AND ")
-        if lenAND != 0 and lenAND + lenOR > 500:
-            raise ValueError("FATAL: sql cmd exceeded length limit")
-        if lenOR > 500:
-            cmd_new = [cmd1 + c + cmd3 for c in split_list(cmd2, 500)]
-            return cmd_new
-        else:
-            return [cmd]
-
-    def split_list(cmd: str, n) -> list:
-        lst = cmd.split(" OR ")
-        res = [" OR ".join(lst[i : i + n]) for i in range(0, len(lst), n)]
-        res = [r.strip() for r in res]
-        # remove first and last parenthesis in string if exists
-        res = [r[1:] if r[0] == "(" else r for r in res]
-        res = [r[:-1] if r[-1] == ")" else r for r in res]
-        return [f" ( {r} ) " for r in res]
-
-    resp = [split_logic_chain(cmd) for cmd in script]
-    return [r for r in resp if r]
-
-
 def rm_all(tab: str, symbol: str, db_file: str) -> Union[None, Dict[str, pd.DataFrame]]:
     """
     Remove all instances to asset
-    remove from given tab, from tab+_DESC and from COMPONENTS
+    remove from given tab (and its rollup tables), from tab+_DESC and from COMPONENTS
     (so don't use tab='TAB_DESC'!)
     """
     symbol = symbol.upper()
@@ -443,29 +1175,74 @@ def rm_all(tab: str, symbol: str, db_file: str) -> Union[None, Dict[str, pd.Data
         db_file=db_file,
     )[0]
 
-    cmd = [f"DELETE FROM {tab} WHERE hash='{hashes}'"]
-    cmd += [f"DELETE FROM COMPONENTS WHERE stock_hash='{hashes}'"]
-    cmd += [f"DELETE FROM {tab}_DESC WHERE hash='{hashes}'"]
+    key = __key__(db_file)
+    cmd = [
+        (
+            f"DELETE FROM {t} WHERE {key} IN (SELECT {key} FROM {tab}_DESC WHERE hash=?)",
+            [hashes],
+        )
+        for t in list(rollups(tab).values()) + [tab]
+    ]
+    cmd += [("DELETE FROM COMPONENTS WHERE stock_hash=?", [hashes])]
+    cmd += [(f"DELETE FROM {tab}_DESC WHERE hash=?", [hashes])]
+    cmd += [("DELETE FROM COVERAGE WHERE hash=?", [hashes])]
+    cmd += [("DELETE FROM CANDLES WHERE symbol=?", [symbol])]
+    cmd += [("DELETE FROM CANDLES_STATE WHERE symbol=?", [symbol])]
+
+    resp = __execute_sql__(cmd, db_file)
+    __drop_options__(db_file)
+    return resp
 
-    return __execute_sql__(cmd, db_file)
+
+def options(db_file: str, tab: str, cols: List[str]) -> List[str]:
+    """sorted unique values (upper case) of cols in tab
+    i.e. all symbols, names, countries...
+    Cached per DB until put() writes to *_DESC or GEO tab,
+    sorted list allows prefix search with bisect
+    """
+    if not check_sql(db_file):
+        return []
+    cat = __catalog_of__(db_file)
+    key = (tab.upper(), tuple(c.lower() for c in cols))
+    if key not in cat["options"]:
+        resp = get(db_file=db_file, tab=tab, get=cols, search=["%"], where=cols)
+        cat["options"][key] = sorted(
+            {str(v).upper() for c, d in resp.items() for v in d[c].dropna()}
+        )
+    return cat["options"][key]
+
+
+def __drop_options__(db_file: str):
+    """forget cached options of db_file"""
+    cat = __catalog__.get(os.path.abspath(db_file))
+    if cat is not None:
+        cat["options"] = {}
 
 
 def tab_columns(tab: str, db_file: str) -> List[str]:
-    """return list of columns for table"""
-    sql_cmd = f"pragma table_info({tab})"
-    resp = __execute_sql__([sql_cmd], db_file)
-    if not resp or resp[sql_cmd] is None or "name" not in list(resp[sql_cmd]):
+    """return list of columns for table
+    (cached, see __catalog_of__())"""
+    if not os.path.isfile(db_file):
         return []
-    return resp[sql_cmd]["name"].to_list()
+    columns = __catalog_of__(db_file)["columns"]
+    if tab not in columns:
+        sql_cmd = f"pragma table_info({tab})"
+        resp = __execute_sql__([sql_cmd], db_file)
+        if not resp or resp[sql_cmd] is None or "name" not in list(resp[sql_cmd]):
+            return []
+        columns[tab] = resp[sql_cmd]["name"].to_list()
+    return list(columns[tab])
 
 
-def check_sql(db_file: str) -> bool:
+def check_sql(db_file: str, layout=1) -> bool:
     """Check db file if aligned with scheme written in sql_scheme.json.
     Check if table exists and if has the required columns.
     Creates one if necessery
+    Result is cached, DB file is checked only once (until replaced)
 
     Args:
         db_file (str): file location
+        layout (int): layout of new DB, when file is missing (see LAYOUTS)
 
     Returns:
         bool: True if correct file, False otherway
@@ -475,31 +1252,112 @@ def check_sql(db_file: str) -> bool:
     if not os.path.isfile(db_file):
         print(f"DB file '{db_file}' is missing.")
         print(f"Creating new DB: {db_file}")
-        create_sql(db_file=db_file)
+        create_sql(db_file=db_file, layout=layout)
         return False
 
+    cat = __catalog_of__(db_file)
+    if cat["valid"]:
+        return True
     # check if correct sql
-    sql_scheme = read_json(SQL_file)
+    sql_scheme = scheme(db_layout(db_file))
     for i in range(len(sql_scheme)):
         tab = list(sql_scheme.keys())[i]
-        scheme_cols = [
-            k for k in sql_scheme[tab].keys() if k not in ["FOREIGN", "UNIQUE"]
-        ]
-        if tab_columns(tab, db_file) != scheme_cols:
+        scheme_cols = [k for k in sql_scheme[tab].keys() if k not in SCHEME_KEYS]
+        db_cols = tab_columns(tab, db_file)
+        if db_cols and db_cols != scheme_cols:  # missing table added by migrate()
             print(f"Wrong DB scheme in file '{db_file}'.")
             print(f"Problem with table '{tab}'")
             print("Remove DB file, and tradeDB will create new one.")
             return False
+    cat["valid"] = migrate(db_file)
+    return cat["valid"]
+
+
+def migrate(db_file: str) -> bool:
+    """bring existing DB up to sql_scheme.jsonc in place
+    (what can be done without recreating DB):
+    - add missing tables (COVERAGE filled from *_DESC dates,
+      rollup tables from their source table)
+    - add missing secondary indexes, drop those not declared any more
+    """
+    sql_scheme = scheme(db_layout(db_file))
+    declared = {
+        c.split()[5] for tab in sql_scheme for c in __index_cmd__(tab, sql_scheme[tab])
+    }
+    cmd = "SELECT name FROM sqlite_master WHERE type='index' AND name LIKE 'idx\\_%' ESCAPE '\\'"
+    resp = __execute_sql__([cmd], db_file)
+    if resp is None:
+        return False
+    indexes = resp[cmd]["name"].to_list() if not resp[cmd].empty else []
+    missing = [tab for tab in sql_scheme if not tab_columns(tab, db_file)]
+    sql_cmd = [c for tab in missing for c in __table_cmd__(tab, sql_scheme[tab])]
+    if "COVERAGE" in missing:
+        print("adding COVERAGE table to db...")
+        sql_cmd += [
+            f"""INSERT INTO COVERAGE (hash, from_date, to_date)
+                SELECT hash, from_date, to_date FROM {tab}
+                WHERE from_date <= to_date"""
+            for tab in sql_scheme
+            if tab.endswith("_DESC") and "from_date" in sql_scheme[tab]
+        ]
+    sql_cmd += [c for tab in sql_scheme for c in __index_cmd__(tab, sql_scheme[tab])]
+    sql_cmd += [f"DROP INDEX {i}" for i in indexes if i not in declared]
+    if __execute_sql__(sql_cmd, db_file) is None:
+        return False
+    return all(
+        __fill_rollup__(db_file, tab, sql_scheme[tab]["ROLLUP"]["tab"])
+        for tab in missing
+        if "ROLLUP" in sql_scheme[tab]
+    )
+
+
+def __fill_rollup__(db_file: str, tab: str, src: str) -> bool:
+    """fill new rollup table 'tab' from whole source table 'src'
+    ROLLUP_CHUNK symbols at once"""
+    print(f"adding {tab} table to db...")
+    key = __key__(db_file)
+    cmd = f"""SELECT td.hash, MIN(t.date) AS first, MAX(t.date) AS last
+            FROM {src} t INNER JOIN {src}_DESC td ON t.{key}=td.{key}
+            GROUP BY td.hash"""
+    resp = __execute_sql__([cmd], db_file)
+    if resp is None:
+        return False
+    if resp[cmd].empty:
+        return True
+    # first and last date of each asset is enough to cover all its periods
+    span = resp[cmd].melt(id_vars="hash", value_name="date")
+    if db_layout(db_file) == 2:
+        span["date"] = pd.to_datetime(span["date"], unit="D")
+    hashes = list(resp[cmd]["hash"])
+    with transaction(db_file):
+        for i in range(0, len(hashes), ROLLUP_CHUNK):
+            chunk = span.loc[span["hash"].isin(hashes[i : i + ROLLUP_CHUNK])]
+            if not __put_rollup__(dat=chunk, tab=src, db_file=db_file, tabs=[tab]):
+                return False
     return True
 
 
+def __index_cmd__(tab: str, tab_scheme: Dict) -> List[str]:
+    """CREATE INDEX commands for secondary indexes of table
+    index name is made from table and column names"""
+    sql_cmd = []
+    for cols in tab_scheme.get("INDEX", []):
+        name = "_".join([tab] + [c.split()[0] for c in cols])
+        sql_cmd.append(
+            f"CREATE INDEX IF NOT EXISTS idx_{name} ON {tab} ({', '.join(cols)})"
+        )
+    return sql_cmd
+
+
 def __execute_sql__(script: list, db_file: str) -> Union[None, Dict[str, pd.DataFrame]]:
     """Execute provided SQL commands.
     If db returns anything write as dict {command: respose as pd.DataFrame}
-    Split cmd if logic tree exceeds 500 (just in case as limit is 1000)
+    Uses pooled connection (see connect()), rollback on failure
+    (whole transaction if called within transaction())
 
     Args:
-        script (list): list of sql commands to execute
+        script (list): list of sql commands to execute,
+            command can be also tuple (command, parameters)
         db_file (string): file name
 
     Returns:
@@ -510,39 +1368,21 @@ def __execute_sql__(script: list, db_file: str) -> Union[None, Dict[str, pd.Data
     """
     ans = {}
     cmd = ""
-    # when writing pnada as dictionary
-    # NULL is written as <NA>, sql needs NULL
-    script = [re.sub("<NA>", "NULL", str(c)) for c in script]
-    # Foreign key constraints are disabled by default,
-    # so must be enabled separately for each database connection.
-    script = ["PRAGMA foreign_keys = ON"] + script
-    script_split = __split_cmd__(script)
     try:
-        con = sqlite3.connect(
-            db_file, detect_types=sqlite3.PARSE_COLNAMES | sqlite3.PARSE_DECLTYPES
-        )
-        cur = con.cursor()
-        for cmd_split in script_split:
-            cmd = script[script_split.index(cmd_split)]
-            for c in cmd_split:
-                cur.execute(c)
+        with transaction(db_file) as con:
+            cur = con.cursor()
+            for c in script:
+                cmd, params = (c, []) if isinstance(c, str) else c
+                cur.execute(cmd, params)
                 if a := cur.fetchall():
                     colnames = [c[0] for c in cur.description]
-                    if cmd in ans:
-                        ans[cmd] = pd.concat(
-                            [
-                                ans[cmd].fillna(""),
-                                pd.DataFrame(a, columns=colnames).fillna(""),
-                            ],
-                            ignore_index=True,
-                        )
-                    else:
-                        ans[cmd] = pd.DataFrame(a, columns=colnames)
+                    ans[cmd] = pd.DataFrame(a, columns=colnames)
                 else:
                     ans[cmd] = pd.DataFrame()
-        con.commit()
+            cur.close()
         return ans
     except sqlite3.IntegrityError as err:
+        # transaction is rolled back, connection stays open
         print("In command:")
         print(cmd)
         print(err)
@@ -551,56 +1391,21 @@ def __execute_sql__(script: list, db_file: str) -> Union[None, Dict[str, pd.Data
         print("SQL operation failed:")
         print(err)
         return
-    finally:
-        cur.close()  # type: ignore
-        con.close()  # type: ignore
 
 
-def create_sql(db_file: str) -> bool:
+def create_sql(db_file: str, layout=1) -> bool:
     """Creates sql query based on sql_scheme.json and send to db.
     Perform check if created DB is aligned with scheme from sql.json file.
     add GEO tab
 
     Args:
         db_file (str): file name
+        layout (int): DB layout (see LAYOUTS)
 
     Returns:
         bool: True if success, False otherway
     """
-    if os.path.isfile(db_file):
-        # just in case the file exists
-        os.remove(db_file)
-    sql_scheme = read_json(SQL_file)
-    # create tables query for db
-    sql_cmd = []
-    for tab in sql_scheme:
-        tab_cmd = f"CREATE TABLE {tab} ("
-        for col in sql_scheme[tab]:
-            if col not in ["FOREIGN", "UNIQUE"]:
-                tab_cmd += f"{col} {sql_scheme[tab][col]}, "
-            elif col == "FOREIGN":  # FOREIGN
-                for foreign in sql_scheme[tab][col]:
-                    k, v = list(foreign.items())[0]
-                    tab_cmd += f"FOREIGN KEY({k}) REFERENCES {v}, "
-        tab_cmd = re.sub(",[^,]*$", "", tab_cmd)  # remove last comma
-        tab_cmd += ") "
-        sql_cmd.append(tab_cmd)
-        if unique_cols := (
-            tuple(sql_scheme[tab]["UNIQUE"])
-            if "UNIQUE" in sql_scheme[tab].keys()
-            else ""
-        ):
-            tab_cmd = f"CREATE UNIQUE INDEX uniqueRow_{tab} ON {tab} {unique_cols}"
-            sql_cmd.append(tab_cmd)
-    # last command to check if all tables were created
-    sql_cmd.append("SELECT tbl_name FROM sqlite_master WHERE type='table'")
-    status = __execute_sql__(sql_cmd, db_file)
-
-    if status is None or status[sql_cmd[-1]]["tbl_name"].to_list() != list(
-        sql_scheme.keys()
-    ):
-        if os.path.isfile(db_file):
-            os.remove(db_file)
+    if not __create_tables__(db_file=db_file, layout=layout):
         sys.exit("FATAL: DB not created. Possibly 'sql_scheme.jsonc' file corupted.")
 
     # write CURRENCY info
@@ -621,10 +1426,125 @@ def create_sql(db_file: str) -> bool:
     return True
 
 
+def __create_tables__(db_file: str, layout=1) -> bool:
+    """create empty DB with all tables from scheme(layout)
+    (existing file is removed)"""
+    # connections to removed file would point to deleted data
+    close(db_file)
+    __catalog__.pop(os.path.abspath(db_file), None)
+    if os.path.isfile(db_file):
+        # just in case the file exists
+        os.remove(db_file)
+    sql_scheme = scheme(layout)
+    # create tables query for db
+    sql_cmd = [f"PRAGMA user_version = {layout}"]
+    for tab in sql_scheme:
+        sql_cmd += __table_cmd__(tab, sql_scheme[tab])
+        sql_cmd += __index_cmd__(tab, sql_scheme[tab])
+    # last command to check if all tables were created
+    sql_cmd.append("SELECT tbl_name FROM sqlite_master WHERE type='table'")
+    status = __execute_sql__(sql_cmd, db_file)
+
+    if status is None or status[sql_cmd[-1]]["tbl_name"].to_list() != list(
+        sql_scheme.keys()
+    ):
+        close(db_file)
+        __catalog__.pop(os.path.abspath(db_file), None)
+        if os.path.isfile(db_file):
+            os.remove(db_file)
+        return False
+    return True
+
+
+def __table_cmd__(tab: str, tab_scheme: Dict) -> List[str]:
+    """CREATE TABLE (and its UNIQUE index) commands for table"""
+    tab_cmd = f"CREATE TABLE {tab} ("
+    for col in tab_scheme:
+        if col not in SCHEME_KEYS:
+            tab_cmd += f"{col} {tab_scheme[col]}, "
+        elif col == "FOREIGN":  # FOREIGN
+            for foreign in tab_scheme[col]:
+                k, v = list(foreign.items())[0]
+                tab_cmd += f"FOREIGN KEY({k}) REFERENCES {v}, "
+    tab_cmd = re.sub(",[^,]*$", "", tab_cmd)  # remove last comma
+    tab_cmd += ") "
+    sql_cmd = [tab_cmd]
+    if unique_cols := (
+        tuple(tab_scheme["UNIQUE"]) if "UNIQUE" in tab_scheme.keys() else ""
+    ):
+        sql_cmd.append(f"CREATE UNIQUE INDEX uniqueRow_{tab} ON {tab} {unique_cols}")
+    return sql_cmd
+
+
+def convert_layout(db_file: str, new_file: str, layout=2) -> bool:
+    """copy whole DB into new file with different layout (see LAYOUTS)
+    i.e. convert existing DB into compact layout 2:
+        convert_layout('trader.sqlite', 'trader_v2.sqlite')
+    """
+    if not check_sql(db_file):
+        return False
+    old_layout = db_layout(db_file)
+    if not __create_tables__(db_file=new_file, layout=layout):
+        print(f"Can not create '{new_file}'")
+        return False
+    old_scheme = scheme(old_layout)
+    new_scheme = scheme(layout)
+    # separate connection: foreign keys must be off during copy
+    con = sqlite3.connect(new_file)
+    try:
+        con.execute("ATTACH DATABASE ? AS old", (db_file,))
+        for tab in new_scheme:
+            cols = [c for c in new_scheme[tab] if c not in SCHEME_KEYS]
+            desc = __desc_of__(tab, new_scheme)
+            if not desc:
+                # same data, 'id' is assigned when missing
+                cols = [c for c in cols if c in old_scheme[tab]]
+                cmd = f"""INSERT INTO main.{tab} ({",".join(cols)})
+                        SELECT {",".join(cols)} FROM old.{tab}"""
+            else:
+                select = {
+                    c: (
+                        f"CAST(v.{c} AS {__affinity__(new_scheme[tab][c])})"
+                        if layout == 2
+                        else f"v.{c}"
+                    )
+                    for c in cols
+                }
+                old_key = "id" if old_layout == 2 else "hash"
+                if layout == 2:
+                    select["id"] = "d.id"
+                    select["date"] = "CAST(julianday(v.date) - 2440587.5 AS INTEGER)"
+                else:
+                    select["hash"] = "d.hash"
+                    select["date"] = "date(v.date * 86400, 'unixepoch')"
+                cmd = f"""INSERT INTO main.{tab} ({",".join(cols)})
+                        SELECT {",".join(select[c] for c in cols)}
+                        FROM old.{tab} v
+                        INNER JOIN old.{desc} od ON od.{old_key}=v.{old_key}
+                        INNER JOIN main.{desc} d ON d.hash=od.hash"""
+            con.execute(cmd)
+        con.commit()
+        con.execute("DETACH DATABASE old")
+    except sqlite3.Error as err:
+        print("DB conversion failed:")
+        print(err)
+        return False
+    finally:
+        con.close()
+    return True
+
+
+def __affinity__(decl: str) -> str:
+    """column type from declaration (i.e. 'REAL NOT NULL' -> 'REAL')"""
+    return decl.split()[0]
+
+
 def __geo_tab__() -> pd.DataFrame:
     """create input for GEO table.
     - countries with iso code and region come from world bank data (lib: wbdata)
     - currency of each country come from csv file"""
+    import wbdata as wb  # slow to import, needed only when creating db
+
     sql_scheme = read_json(SQL_file)
     countries = [
         (c["iso2Code"], c["name"], c["region"]["iso2code"], c["region"]["value"])
@@ -667,12 +1587,7 @@ def __currency_tab__() -> pd.DataFrame:
     # will set something extreme so easy to filter
     cur["from_date"] = date(3000, 1, 1)
     cur["to_date"] = date(1900, 1, 1)
-    cur = cur.reindex(columns=pd.Index(sql_scheme["CURRENCY_DESC"].keys()))
+    cur = cur.reindex(
+        columns=[c for c in sql_scheme["CURRENCY_DESC"] if c not in SCHEME_KEYS]
+    )
     return cur
-
-
-def __escape_quote__(txt: Union[List[str], set]) -> List[str]:
-    """
-    escape quotes in a list of strings
-    """
-    return [re.sub(r"'", r"''", str(txt)) for txt in txt if txt is not None]